@@ -1,3 +1,15 @@
 from .types import *
 from .monolith import *
-from .control_server import control_server_start, control_server_stop
\ No newline at end of file
+from .batcher import ReadingBatcher
+from .async_monolith import AsyncMonolith
+from .reading_block import ReadingBlock
+from .cache import RegistrarCache, MetricCache
+from .control_server import ControlServer, ControlLoop, ActionWorkers, control_server_start, control_server_stop
+from .stream_receiver import StreamReceiver
+from .wal import SubmissionLog, FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER, OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT
+from .heartbeat import HeartbeatScheduler
+from .transport import TransportPolicy, CircuitBreaker, FetchResult, PoolExhaustedError, ERROR_TIMEOUT, ERROR_REFUSED, ERROR_CONNECTION, ERROR_HTTP, ERROR_CIRCUIT_OPEN, ERROR_POOL_EXHAUSTED
+from .metrics import ClientMetrics, LatencyHistogram
+from .reading_view import ReadingView
+from .dispatcher import ActionDispatcher
+from .router import ActionRouter, EXECUTE_INLINE, EXECUTE_THREAD, EXECUTE_PROCESS
\ No newline at end of file
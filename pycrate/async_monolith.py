@@ -0,0 +1,505 @@
+import asyncio
+import urllib.parse
+import json
+from time import time, monotonic
+from .types import *
+from .monolith import is_idempotent
+
+"""Documentation for a class.
+
+   A single keep-alive HTTP/1.1 connection over asyncio streams
+"""
+class AsyncConnection:
+   def __init__(self, reader, writer):
+      self.reader = reader
+      self.writer = writer
+      self.last_used = monotonic()
+      self.used = False
+      self.closed = False
+
+   """Documentation for a method.
+
+      Send an encoded request and read back its response
+      returns a (status, body) tuple
+   """
+   async def request(self, data):
+      self.used = True
+      self.writer.write(data)
+      await self.writer.drain()
+
+      status_line = await self.reader.readline()
+      if not status_line:
+         raise ConnectionResetError("Remote end closed connection without response")
+      parts = status_line.split(None, 2)
+      if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+         raise ConnectionError("Malformed status line")
+      status = int(parts[1])
+
+      headers = {}
+      while True:
+         line = await self.reader.readline()
+         if line in (b"\r\n", b"\n", b""):
+            break
+         name, _, value = line.partition(b":")
+         headers[name.strip().lower()] = value.strip()
+
+      connection = headers.get(b"connection", b"").lower()
+      will_close = connection == b"close" or parts[0] == b"HTTP/1.0" and connection != b"keep-alive"
+
+      if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+         chunks = []
+         while True:
+            size = int((await self.reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+               while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                  pass
+               break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+         body = b"".join(chunks)
+      elif b"content-length" in headers:
+         body = await self.reader.readexactly(int(headers[b"content-length"]))
+      else:
+         body = await self.reader.read()
+         will_close = True
+
+      if will_close:
+         self.close()
+      return status, body
+
+   def is_dropped(self):
+      return self.closed or self.reader.at_eof()
+
+   def close(self):
+      if self.closed:
+         return
+      self.closed = True
+      self.writer.close()
+
+"""Documentation for a class.
+
+   Pool of keep-alive asyncio connections to a single host. At most
+   `max_concurrency` requests are in flight at once, each on its own
+   connection. Must be used from a single event loop
+"""
+class AsyncConnectionPool:
+   def __init__(self, address, port, max_concurrency=100, idle_timeout=30.0):
+      if not isinstance(max_concurrency, int) or max_concurrency < 1:
+         raise Exception("MAX CONCURRENCY must be an int greater than 0")
+      if not isinstance(idle_timeout, (int, float)) or idle_timeout < 0:
+         raise Exception("IDLE TIMEOUT must be a non-negative number")
+
+      self.address = address
+      self.port = port
+      self.max_concurrency = max_concurrency
+      self.idle_timeout = idle_timeout
+      self.host_header = address + ":" + str(port)
+      self.idle = []
+      self.slots = None
+      self.closed = False
+
+   def build_request(self, path):
+      return ("GET " + path + " HTTP/1.1\r\n"
+              "Host: " + self.host_header + "\r\n"
+              "Connection: keep-alive\r\n"
+              "Accept-Encoding: identity\r\n"
+              "\r\n").encode("ascii")
+
+   async def acquire(self):
+      now = monotonic()
+      while self.idle:
+         conn = self.idle.pop()
+         if now - conn.last_used > self.idle_timeout or conn.is_dropped():
+            conn.close()
+            continue
+         return conn
+      reader, writer = await asyncio.open_connection(self.address, self.port)
+      return AsyncConnection(reader, writer)
+
+   def release(self, conn, reusable=True):
+      if reusable and not conn.closed and not self.closed:
+         conn.last_used = monotonic()
+         self.idle.append(conn)
+      else:
+         conn.close()
+
+   """Documentation for a method.
+
+      Perform a GET on the given path, giving up after `timeout` seconds
+      returns a (status, body) tuple, raises on connection errors and timeouts.
+      If a reused connection turns out to have been closed by the
+      server the request is sent again on a new connection, unless
+      `retry` is False, as the server may already have acted on it
+   """
+   async def request(self, path, timeout=None, retry=True):
+      if self.closed:
+         raise Exception("Connection pool is closed")
+      if self.slots is None:
+         self.slots = asyncio.Semaphore(self.max_concurrency)
+
+      data = self.build_request(path)
+      async with self.slots:
+         return await asyncio.wait_for(self.send(data, retry), timeout)
+
+   async def send(self, data, retry=True):
+      while True:
+         conn = await self.acquire()
+         reused = conn.used
+         try:
+            status, body = await conn.request(data)
+         except (ConnectionError, asyncio.IncompleteReadError):
+            self.release(conn, False)
+            if not reused or not retry:
+               raise
+            continue
+         except BaseException:
+            self.release(conn, False)
+            raise
+         self.release(conn, True)
+         return status, body
+
+   async def close(self):
+      self.closed = True
+      idle = self.idle
+      self.idle = []
+      for conn in idle:
+         conn.close()
+      for conn in idle:
+         try: await conn.writer.wait_closed()
+         except Exception:
+            pass
+
+"""Documentation for a method.
+
+   Interpret a response that carries "success" on success
+   Returns None iff the command failed,
+   True if the command worked, False otherwise
+"""
+def success_result(response):
+   if response is None:
+      return None
+   decoded_response = json.loads(response)
+   return decoded_response["status"] == 200 and decoded_response["data"] == "success"
+
+"""Documentation for a method.
+
+   Interpret a response that carries data on success
+   Returns None iff the command failed,
+   the data if the command worked, False otherwise
+"""
+def data_result(response):
+   if response is None:
+      return None
+   decoded_response = json.loads(response)
+   if decoded_response["status"] == 200:
+      return decoded_response["data"]
+   return False
+
+"""Documentation for a class.
+
+   asyncio counterpart of Monolith. Every method is a coroutine taking an
+   optional per-call `timeout` in seconds, and returns the same results
+   as its Monolith equivalent. Requests are sent over a pool of keep-alive
+   connections with at most `max_concurrency` requests in flight, so many
+   calls can be awaited concurrently from one event loop
+"""
+class AsyncMonolith:
+   def __init__(self, ipv4_address, max_concurrency=100, idle_timeout=30.0, timeout=None):
+      if not isinstance(ipv4_address, IPV4Connection):
+         raise Exception("Given address must be an IPV4Connection type")
+      self.host = "http://" + ipv4_address.address + ":" + str(ipv4_address.port)
+      self.timeout = timeout
+      self.pool = AsyncConnectionPool(ipv4_address.address,
+                                      ipv4_address.port,
+                                      max_concurrency,
+                                      idle_timeout)
+
+   """Documentation for a method.
+
+      Close any pooled connections to the monolith
+   """
+   async def close(self):
+      await self.pool.close()
+
+   async def __aenter__(self):
+      return self
+
+   async def __aexit__(self, *args):
+      await self.close()
+
+   """Documentation for a method.
+
+      Retrieve a timestamp that conforms to the monolith standard
+   """
+   def get_timestamp(self):
+      return int(time())
+
+   """Documentation for a method.
+
+      Fetch a particular endpoint from monolith.
+      If a problem occurs (including a timeout), None will be returned
+   """
+   async def fetch_endpoint(self, endpoint, timeout=None):
+      if timeout is None:
+         timeout = self.timeout
+      try: status, body = await self.pool.request(urllib.parse.quote(endpoint), timeout, is_idempotent(endpoint))
+      except Exception:
+         return None
+      if status < 200 or status >= 300:
+         return None
+      return body
+
+   """Documentation for a method.
+
+      Check if we are connected to a monolith
+   """
+   async def is_connected(self, timeout=None):
+      return await self.fetch_endpoint("/", timeout) is not None
+
+   """Documentation for a method.
+
+      Attempt to retrieve the version info of the endpoint
+      Returns None iff the command fails,
+      a VersionV1 if the command worked, False otherwise
+   """
+   async def get_version(self, timeout=None):
+      data = data_result(await self.fetch_endpoint("/version", timeout))
+      if data is None or data is False:
+         return data
+      return VersionV1(data["name"],
+                       data["hash"],
+                       data["version_major"],
+                       data["version_minor"],
+                       data["version_patch"])
+
+   """Documentation for a method.
+
+      Register a node with Monolith
+      Returns None iff the command fails,
+      True if the item was added, False otherwise
+   """
+   async def registrar_add_node(self, node, timeout=None):
+      if not isinstance(node, NodeV1):
+         raise Exception("NODE must be of type NodeV1")
+      return success_result(await self.fetch_endpoint("/registrar/add/" + node.id + "/" + node.encode(), timeout))
+
+   """Documentation for a method.
+
+      Register a controller with Monolith
+      Returns None iff the command fails,
+      True if the item was added, False otherwise
+   """
+   async def registrar_add_controller(self, controller, timeout=None):
+      if not isinstance(controller, ControllerV1):
+         raise Exception("NODE must be of type controller")
+      return success_result(await self.fetch_endpoint("/registrar/add/" + controller.id + "/" + controller.encode(), timeout))
+
+   """Documentation for a method.
+
+      Probe the registrar for a node
+      Returns None iff the command fails,
+      True if the item was found, False otherwise
+   """
+   async def registrar_probe(self, id, timeout=None):
+      if not isinstance(id, str):
+         raise Exception("ID must be of type str")
+
+      response = await self.fetch_endpoint("/registrar/probe/" + id, timeout)
+      if response is None:
+         return None
+
+      decoded_response = json.loads(response)
+      return decoded_response["status"] == 200 and decoded_response["data"] == "found"
+
+   """Documentation for a method.
+
+      Attempt to retrieve a node from the registrar
+      Returns None if the command fails or there is no such node,
+      the NodeV1 otherwise
+   """
+   async def registrar_fetch_node(self, id, timeout=None):
+      if not isinstance(id, str):
+         raise Exception("ID must be of type string")
+
+      response = await self.fetch_endpoint("/registrar/fetch/" + id, timeout)
+      if response is None:
+         return None
+
+      # A status indicates that the query worked but there was no node
+      decoded_response = json.loads(response)
+      if "status" in decoded_response:
+         return None
+
+      node = NodeV1("","")
+      if not node.load_decoded(decoded_response):
+         raise Exception("Data from server did not match a V1 Node (is something on fire?)")
+      return node
+
+   """Documentation for a method.
+
+      Attempt to retrieve a controller from the registrar
+      Returns None if the command fails or there is no such controller,
+      the ControllerV1 otherwise
+   """
+   async def registrar_fetch_controller(self, id, timeout=None):
+      if not isinstance(id, str):
+         raise Exception("ID must be of type string")
+
+      response = await self.fetch_endpoint("/registrar/fetch/" + id, timeout)
+      if response is None:
+         return None
+
+      decoded_response = json.loads(response)
+      if "status" in decoded_response:
+         return None
+
+      controller = ControllerV1("","",IPV4Connection("", 0))
+      if not controller.load_decoded(decoded_response):
+         raise Exception("Data from server did not match a V1 Controller (is something on fire?)")
+      return controller
+
+   """Documentation for a method.
+
+      Delete a node or controller
+      Returns None iff the command fails,
+      True if the command worked, False otherwise
+   """
+   async def registrar_delete(self, id, timeout=None):
+      if not isinstance(id, str):
+         raise Exception("ID must be of type string")
+      return success_result(await self.fetch_endpoint("/registrar/delete/" + id, timeout))
+
+   """Documentation for a method.
+
+      Register a metric stream receiver
+      Returns None iff the command fails,
+      True if the command worked, False otherwise
+   """
+   async def metric_stream_add(self, destination, timeout=None):
+      if not isinstance(destination, IPV4Connection):
+         raise Exception("DESTINATION must be of type IPV4Connection")
+      return success_result(await self.fetch_endpoint("/metric/stream/add/" +
+                                                      destination.address +
+                                                      "/" +
+                                                      str(destination.port), timeout))
+
+   """Documentation for a method.
+
+      Delete a metric stream receiver
+      Returns None iff the command fails,
+      True if the command worked, False otherwise
+   """
+   async def metric_stream_delete(self, destination, timeout=None):
+      if not isinstance(destination, IPV4Connection):
+         raise Exception("DESTINATION must be of type IPV4Connection")
+      return success_result(await self.fetch_endpoint("/metric/stream/delete/" +
+                                                      destination.address +
+                                                      "/" +
+                                                      str(destination.port), timeout))
+
+   """Documentation for a method.
+
+      Submit a reading
+      Returns None iff the command fails,
+      True if the command worked, False otherwise
+   """
+   async def metric_submit_reading(self, reading, timeout=None):
+      if not isinstance(reading, ReadingV1):
+         raise Exception("READING must be of type ReadingV1")
+      return success_result(await self.fetch_endpoint("/metric/submit/" + reading.encode(), timeout))
+
+   """Documentation for a method.
+
+      Submit several readings concurrently
+      Returns a list with the result of each reading, in order
+   """
+   async def metric_submit_readings(self, readings, timeout=None):
+      for reading in readings:
+         if not isinstance(reading, ReadingV1):
+            raise Exception("READING must be of type ReadingV1")
+      return list(await asyncio.gather(*[self.metric_submit_reading(reading, timeout) for reading in readings]))
+
+   """Documentation for a method.
+
+      Submit a heartbeat for a node
+      Returns None iff the command fails,
+      True if the command worked, False otherwise
+   """
+   async def metric_submit_heartbeat(self, heartbeat, timeout=None):
+      if not isinstance(heartbeat, HeartbeatV1):
+         raise Exception("HEARTBEAT must be of type HeartbeatV1")
+      return success_result(await self.fetch_endpoint("/metric/heartbeat/" + heartbeat.encode(), timeout))
+
+   """Documentation for a method.
+
+      Attempt to retrieve a list of registered node ids
+      Returns None iff the command fails,
+      the ids if the command worked, False otherwise
+   """
+   async def metric_fetch_nodes(self, timeout=None):
+      return data_result(await self.fetch_endpoint("/metric/fetch/nodes", timeout))
+
+   """Documentation for a method.
+
+      Attempt to retrieve a list of sensor ids for the given node
+      Returns None iff the command fails,
+      the ids if the command worked, False otherwise
+   """
+   async def metric_fetch_sensors(self, node_id, timeout=None):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      return data_result(await self.fetch_endpoint("/metric/fetch/" + node_id + "/sensors", timeout))
+
+   """Documentation for a method.
+
+      Fetch the metrics of a node in a range of time
+      Returns None iff the command fails,
+      the readings if the command worked, False otherwise
+   """
+   async def metric_fetch_range(self, node_id, start, end, timeout=None):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      if not isinstance(start, int):
+         raise Exception("START must be of type int")
+      if not isinstance(end, int):
+         raise Exception("END must be of type int")
+      if start > end:
+         raise Exception("Start must not be after end")
+      if start == end:
+         raise Exception("Start and end can not be the same")
+      return data_result(await self.fetch_endpoint("/metric/fetch/" +
+                                                   node_id +
+                                                   "/range/" +
+                                                   str(start) +
+                                                   "/" +
+                                                   str(end), timeout))
+
+   """Documentation for a method.
+
+      Fetch the metrics of a node after a specified time
+      Returns None iff the command fails,
+      the readings if the command worked, False otherwise
+   """
+   async def metric_fetch_after(self, node_id, time, timeout=None):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      if not isinstance(time, int):
+         raise Exception("TIME must be of type int")
+      if time > self.get_timestamp():
+         raise Exception("Given time exceeds current time (The future) ")
+      return data_result(await self.fetch_endpoint("/metric/fetch/" + node_id + "/after/" + str(time), timeout))
+
+   """Documentation for a method.
+
+      Fetch the metrics of a node before a specified time
+      Returns None iff the command fails,
+      the readings if the command worked, False otherwise
+   """
+   async def metric_fetch_before(self, node_id, time, timeout=None):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      if not isinstance(time, int):
+         raise Exception("TIME must be of type int")
+      if time > self.get_timestamp():
+         raise Exception("Given time exceeds current time (The future) ")
+      return data_result(await self.fetch_endpoint("/metric/fetch/" + node_id + "/before/" + str(time), timeout))
@@ -0,0 +1,134 @@
+import threading
+from time import monotonic
+from .types import ReadingV1, StreamV1
+
+"""Documentation for a class.
+
+   Collects readings into StreamV1 batches and submits each batch to a
+   monolith once it holds `max_readings` readings, once its encoded size
+   reaches `max_bytes`, or `max_delay` seconds after its first reading
+   was added, whichever comes first.
+
+   Flushed batches are pipelined over the monolith's pooled connections.
+   If given, `callback` is called after every flush with the StreamV1 that
+   was sent and a list holding the result of each of its readings
+   (None if the submission failed, True if it worked, False otherwise)
+"""
+class ReadingBatcher:
+   def __init__(self, monolith, max_readings=100, max_bytes=65536, max_delay=1.0, callback=None):
+      if not isinstance(max_readings, int) or max_readings < 1:
+         raise Exception("MAX READINGS must be an int greater than 0")
+      if not isinstance(max_bytes, int) or max_bytes < 1:
+         raise Exception("MAX BYTES must be an int greater than 0")
+      if not isinstance(max_delay, (int, float)) or max_delay <= 0:
+         raise Exception("MAX DELAY must be a positive number")
+
+      self.monolith = monolith
+      self.max_readings = max_readings
+      self.max_bytes = max_bytes
+      self.max_delay = max_delay
+      self.callback = callback
+
+      self.sequence = 0
+      self.stream = None
+      self.endpoints = []
+      self.stream_bytes = 0
+      self.deadline = None
+
+      self.submitted = 0
+      self.failed = 0
+
+      self.lock = threading.Lock()
+      self.flush_lock = threading.Lock()
+      self.wakeup = threading.Condition(self.lock)
+      self.running = True
+      self.thread = threading.Thread(target=self.run, daemon=True)
+      self.thread.start()
+
+   """Documentation for a method.
+
+      Add a reading to the current batch, flushing it if the batch is full
+   """
+   def add(self, reading):
+      if not isinstance(reading, ReadingV1):
+         raise Exception("READING must be of type ReadingV1")
+
+      endpoint = "/metric/submit/" + reading.encode()
+      with self.lock:
+         if not self.running:
+            raise Exception("Batcher has been closed")
+         if self.stream is None:
+            self.stream = StreamV1(self.monolith.get_timestamp(), self.sequence)
+            self.sequence += 1
+            self.deadline = monotonic() + self.max_delay
+            self.wakeup.notify()
+         self.stream.readings.append(reading)
+         self.endpoints.append(endpoint)
+         self.stream_bytes += len(endpoint)
+         full = (len(self.endpoints) >= self.max_readings or
+                 self.stream_bytes >= self.max_bytes)
+      if full:
+         self.flush()
+
+   """Documentation for a method.
+
+      Submit the current batch now
+      Returns the results of the flushed readings, in order
+   """
+   def flush(self):
+      with self.flush_lock:
+         with self.lock:
+            stream = self.stream
+            endpoints = self.endpoints
+            self.stream = None
+            self.endpoints = []
+            self.stream_bytes = 0
+            self.deadline = None
+         if stream is None:
+            return []
+
+         results = [self.monolith.submission_result(response)
+                    for response in self.monolith.fetch_endpoints(endpoints)]
+         for result in results:
+            if result:
+               self.submitted += 1
+            else:
+               self.failed += 1
+         if self.callback is not None:
+            try: self.callback(stream, results)
+            except Exception as error:
+               print("Batcher callback failed: " + str(error))
+         return results
+
+   """Documentation for a method.
+
+      Background loop that flushes batches once they hit their deadline
+   """
+   def run(self):
+      while True:
+         with self.lock:
+            while self.running and (self.deadline is None or self.deadline > monotonic()):
+               if self.deadline is None:
+                  self.wakeup.wait()
+               else:
+                  self.wakeup.wait(self.deadline - monotonic())
+            if not self.running:
+               return
+         self.flush()
+
+   """Documentation for a method.
+
+      Flush any remaining readings and stop the background flusher
+   """
+   def close(self):
+      with self.lock:
+         self.running = False
+         self.wakeup.notify()
+      self.thread.join()
+      self.flush()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
@@ -0,0 +1,317 @@
+import threading
+from math import inf
+from time import time, monotonic
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+"""
+   Returned by cache lookups that found nothing usable
+"""
+MISS = object()
+
+"""Documentation for a class.
+
+   In-process read-through cache for registrar lookups. Entries expire
+   `ttl` seconds after they were stored and the least recently used
+   entries are evicted once more than `max_size` are held.
+
+   "Not found" results are only cached if `negative_caching` is set.
+   Cached NodeV1 / ControllerV1 objects are shared between callers and
+   should not be modified. Thread safe
+"""
+class RegistrarCache:
+   def __init__(self, ttl=30.0, max_size=1024, negative_caching=True):
+      if not isinstance(ttl, (int, float)) or ttl <= 0:
+         raise Exception("TTL must be a positive number")
+      if not isinstance(max_size, int) or max_size < 1:
+         raise Exception("MAX SIZE must be an int greater than 0")
+      self.ttl = ttl
+      self.max_size = max_size
+      self.negative_caching = negative_caching
+      self.entries = OrderedDict()
+      self.lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      self.expirations = 0
+      self.invalidations = 0
+
+   """Documentation for a method.
+
+      Look up the entry stored for a kind of lookup ("probe", "node",
+      "controller") of an id
+      returns the cached value, or MISS
+   """
+   def get(self, kind, id):
+      key = (kind, id)
+      with self.lock:
+         entry = self.entries.get(key)
+         if entry is None:
+            self.misses += 1
+            return MISS
+         value, expires = entry
+         if expires <= monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISS
+         self.entries.move_to_end(key)
+         self.hits += 1
+         return value
+
+   """Documentation for a method.
+
+      Store the result of a lookup. `found` is False for "not found"
+      results, which are dropped unless negative caching is enabled
+   """
+   def put(self, kind, id, value, found=True):
+      if not found and not self.negative_caching:
+         return
+      key = (kind, id)
+      with self.lock:
+         self.entries[key] = (value, monotonic() + self.ttl)
+         self.entries.move_to_end(key)
+         while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+   """Documentation for a method.
+
+      Drop every entry stored for an id
+   """
+   def invalidate(self, id):
+      with self.lock:
+         for kind in ("probe", "node", "controller"):
+            if self.entries.pop((kind, id), None) is not None:
+               self.invalidations += 1
+
+   def clear(self):
+      with self.lock:
+         self.entries.clear()
+
+   """Documentation for a method.
+
+      Get the cache counters
+      returns a dict
+   """
+   def stats(self):
+      with self.lock:
+         return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+         }
+
+"""Documentation for a class.
+
+   The cached readings of a single node. `covered` holds the sorted,
+   disjoint, inclusive [low, high] time intervals that have been fetched,
+   `timestamps` / `readings` every reading in them, in timestamp order
+"""
+class MetricSeries:
+   def __init__(self):
+      self.covered = []
+      self.timestamps = []
+      self.readings = []
+
+   """Documentation for a method.
+
+      Get the parts of [low, high] that have not been fetched yet
+      returns a list of inclusive (low, high) intervals
+   """
+   def gaps(self, low, high):
+      gaps = []
+      cursor = low
+      for covered_low, covered_high in self.covered:
+         if covered_high < cursor:
+            continue
+         if covered_low > high:
+            break
+         if covered_low > cursor:
+            gaps.append((cursor, covered_low - 1))
+         cursor = covered_high + 1
+         if cursor > high:
+            break
+      if cursor <= high:
+         gaps.append((cursor, high))
+      return gaps
+
+   """Documentation for a method.
+
+      Replace what is held for [low, high] with the given readings, which
+      must be every reading in that interval
+      returns the change in the number of readings held
+   """
+   def store(self, low, high, readings):
+      readings = sorted(readings, key=lambda reading: reading["timestamp"])
+      start = bisect_left(self.timestamps, low)
+      end = bisect_right(self.timestamps, high)
+      self.timestamps[start:end] = [reading["timestamp"] for reading in readings]
+      self.readings[start:end] = readings
+
+      merged = []
+      for covered_low, covered_high in self.covered:
+         if covered_high < low - 1 or covered_low > high + 1:
+            merged.append((covered_low, covered_high))
+         else:
+            low = min(low, covered_low)
+            high = max(high, covered_high)
+      merged.append((low, high))
+      merged.sort()
+      self.covered = merged
+      return len(readings) - (end - start)
+
+   def get(self, low, high):
+      return self.readings[bisect_left(self.timestamps, low):bisect_right(self.timestamps, high)]
+
+   """Documentation for a method.
+
+      Forget up to `count` of the oldest readings, along with the
+      coverage of the time they were in
+      returns the number of readings dropped
+   """
+   def drop_oldest(self, count):
+      low, high = self.covered[0]
+      held = bisect_right(self.timestamps, high)
+      if held <= count:
+         del self.timestamps[:held]
+         del self.readings[:held]
+         del self.covered[0]
+         return held
+      cut = self.timestamps[count - 1]
+      dropped = bisect_right(self.timestamps, cut)
+      del self.timestamps[:dropped]
+      del self.readings[:dropped]
+      self.covered[0] = (cut + 1, high)
+      return dropped
+
+"""Documentation for a class.
+
+   Client side cache of node metrics. Remembers which time intervals of
+   each node have been fetched, so metric_fetch_range / _after / _before
+   only ask the monolith for the parts of a query that are not cached.
+
+   Readings newer than `settle` seconds are never cached, as more of them
+   may still arrive; that part of a query is always fetched. Once more
+   than `max_readings` readings are held the oldest are evicted. Thread safe
+
+   Nodes are cached per monolith (by its host), so one cache can be
+   shared by Monolith objects talking to different servers. Queries
+   return copies of the cached readings, changing them does not change
+   the cache
+"""
+class MetricCache:
+   def __init__(self, max_readings=1000000, settle=60):
+      if not isinstance(max_readings, int) or max_readings < 1:
+         raise Exception("MAX READINGS must be an int greater than 0")
+      if not isinstance(settle, (int, float)) or settle < 0:
+         raise Exception("SETTLE must be a non-negative number")
+      self.max_readings = max_readings
+      self.settle = settle
+      self.series = {}
+      self.held = 0
+      self.lock = threading.Lock()
+      self.hits = 0
+      self.partial_hits = 0
+      self.misses = 0
+      self.fetched_readings = 0
+      self.evictions = 0
+
+   """Documentation for a method.
+
+      Fetch an inclusive interval of readings from the monolith with a
+      single request. Either bound may be infinite
+      returns the readings, None or False as metric_fetch_range does
+   """
+   def fetch_interval(self, monolith, node_id, low, high):
+      if low == -inf:
+         endpoint = "/before/" + str(high + 1)
+      elif high == inf:
+         endpoint = "/after/" + str(low - 1)
+      else:
+         endpoint = "/range/" + str(low - 1) + "/" + str(high + 1)
+      return monolith.fetch_data("/metric/fetch/" + node_id + endpoint)
+
+   """Documentation for a method.
+
+      Get the readings of a node within the inclusive interval [low, high],
+      fetching only what is not cached
+      returns the readings in timestamp order, or None / False if a
+      request failed as metric_fetch_range does
+   """
+   def query(self, monolith, node_id, low, high):
+      limit = int(time() - self.settle)
+      cache_high = min(high, limit)
+      key = (monolith.host, node_id)
+
+      with self.lock:
+         series = self.series.get(key)
+         if series is None:
+            series = self.series[key] = MetricSeries()
+         gaps = series.gaps(low, cache_high) if low <= cache_high else []
+
+      for gap_low, gap_high in gaps:
+         readings = self.fetch_interval(monolith, node_id, gap_low, gap_high)
+         if readings is None or readings is False:
+            return readings
+         with self.lock:
+            stored = series.store(gap_low, gap_high, readings)
+            # The node may have been invalidated while it was fetched
+            if self.series.get(key) is series:
+               self.held += stored
+            self.fetched_readings += len(readings)
+
+      tail = []
+      if high > cache_high:
+         tail = self.fetch_interval(monolith, node_id, max(low, cache_high + 1), high)
+         if tail is None or tail is False:
+            return tail
+
+      with self.lock:
+         self.fetched_readings += len(tail)
+         if not gaps and high <= cache_high:
+            self.hits += 1
+         elif len(gaps) == 1 and gaps[0] == (low, cache_high) or low > cache_high:
+            self.misses += 1
+         else:
+            self.partial_hits += 1
+         result = [dict(reading) for reading in series.get(low, cache_high)] if low <= cache_high else []
+         self.evict()
+      return result + sorted(tail, key=lambda reading: reading["timestamp"])
+
+   def evict(self):
+      while self.held > self.max_readings:
+         oldest = min((series for series in self.series.values() if series.covered),
+                      key=lambda series: series.covered[0][0])
+         dropped = oldest.drop_oldest(self.held - self.max_readings)
+         self.held -= dropped
+         self.evictions += dropped
+
+   """Documentation for a method.
+
+      Forget everything cached for a node, on every monolith
+   """
+   def invalidate(self, node_id):
+      with self.lock:
+         for key in [key for key in self.series if key[1] == node_id]:
+            self.held -= len(self.series.pop(key).timestamps)
+
+   def clear(self):
+      with self.lock:
+         self.series.clear()
+         self.held = 0
+
+   def stats(self):
+      with self.lock:
+         return {
+            "nodes": len(self.series),
+            "readings": self.held,
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "fetched_readings": self.fetched_readings,
+            "evictions": self.evictions,
+         }
@@ -1,51 +1,689 @@
-from sqlite3 import connect
 from .types import IPV4Connection
 import socket
+import selectors
 import threading
-from sys import exit
+from collections import deque
+from time import time, perf_counter
 from .types import ActionV1
+from .metrics import LatencyHistogram, prometheus_counters
+from .router import ActionRouter
 
-server_thread = None
-start_thread = None
-continue_serving = True
+"""Documentation for a class.
 
-def new_conn(socket, callback_fn):
-   global continue_serving
-   while continue_serving:
-      sock, address = socket.accept()
-      actual_data = None
+   Reassembles frames made of a 4 byte little endian length followed
+   by that many bytes of payload, regardless of how the stream was
+   split up across reads
+"""
+class FrameDecoder:
+   def __init__(self, max_frame_size=1048576):
+      self.max_frame_size = max_frame_size
+      self.buffer = bytearray()
+
+   """Documentation for a method.
+
+      Add received data to the decoder
+      returns a list of every frame payload completed by the data.
+      Raises if a frame announces a length over max_frame_size
+   """
+   def feed(self, data):
+      self.buffer += data
+      frames = []
+      offset = 0
+      while len(self.buffer) - offset >= 4:
+         frame_len = int.from_bytes(self.buffer[offset:offset + 4], "little")
+         if frame_len > self.max_frame_size:
+            raise Exception("Frame of " + str(frame_len) + " bytes exceeds the maximum frame size")
+         if len(self.buffer) - offset - 4 < frame_len:
+            break
+         frames.append(bytes(self.buffer[offset + 4:offset + 4 + frame_len]))
+         offset += 4 + frame_len
+      if offset:
+         del self.buffer[:offset]
+      return frames
+
+"""Documentation for a class.
+
+   Runs server callbacks on a fixed set of worker threads fed by a
+   bounded queue, so a slow callback never stalls the network thread.
+   One ActionWorkers can be shared by several servers, servers that are
+   not given workers of their own share ActionWorkers.default().
+
+   Three opt-in policies keep the delay of actions bounded when they
+   arrive faster than the callbacks take them:
+      coalesce     a queued action is replaced by a newer action of the
+                   same server, controller_id and action_id, keeping its
+                   place in the queue, so only the latest value is acted
+                   on. An action older than the queued one is dropped
+      max_age      actions whose timestamp is more than `max_age` seconds
+                   old when a worker takes them are dropped
+      high_water   once that many items are queued, the oldest queued
+                   action is dropped to make room for each new one
+                   instead of pushing back on the connection
+
+   Dropped actions are counted in the stats of their server as
+   coalesced, expired and shed. The policies only apply to ActionV1
+   items queued on the workers: streams queued by a StreamReceiver, and
+   actions an ActionRouter runs inline or on its process pool, are left
+   alone
+"""
+class ActionWorkers:
+   default_workers = None
+   default_lock = threading.Lock()
+
+   def __init__(self, workers=4, queue_size=1024, coalesce=False, max_age=None, high_water=None):
+      if not isinstance(workers, int) or workers < 1:
+         raise Exception("WORKERS must be an int greater than 0")
+      if not isinstance(queue_size, int) or queue_size < 1:
+         raise Exception("QUEUE SIZE must be an int greater than 0")
+      if max_age is not None and (not isinstance(max_age, (int, float)) or max_age < 0):
+         raise Exception("MAX AGE must be a non-negative number or None")
+      if high_water is not None and (not isinstance(high_water, int) or not 0 < high_water <= queue_size):
+         raise Exception("HIGH WATER must be an int from 1 up to the queue size, or None")
+      self.queue_size = queue_size
+      self.coalesce = coalesce
+      self.max_age = max_age
+      self.high_water = high_water
+      self.order = deque()
+      self.items = {}
+      self.active = {}
+      self.stopping = False
+      self.lock = threading.Lock()
+      self.not_empty = threading.Condition(self.lock)
+      self.drained = threading.Condition(self.lock)
+      self.space_listeners = []
+      self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+      for thread in self.threads:
+         thread.start()
+
+   """Documentation for a method.
+
+      Get the workers shared by servers that were not given any
+   """
+   @classmethod
+   def default(cls):
+      with cls.default_lock:
+         if cls.default_workers is None:
+            cls.default_workers = ActionWorkers()
+         return cls.default_workers
+
+   """Documentation for a method.
+
+      Queue an action for the given server without blocking, to be
+      passed to `handler` or the server's callback
+      returns False if the queue is full
+   """
+   def submit(self, server, action, handler=None):
+      is_action = isinstance(action, ActionV1)
+      with self.lock:
+         if self.coalesce and is_action:
+            key = (server, action.controller_id, action.action_id)
+            queued = self.items.get(key)
+            if queued is not None:
+               if action.timestamp >= queued[1].timestamp:
+                  queued[1] = action
+                  queued[2] = handler
+               server.stats.record_dropped("coalesced")
+               return True
+         else:
+            key = object()
+         if self.high_water is not None and is_action and len(self.order) >= self.high_water:
+            if not self.shed_oldest():
+               server.stats.record_dropped("shed")
+               return True
+         if len(self.order) >= self.queue_size:
+            return False
+         self.order.append(key)
+         self.items[key] = [server, action, handler]
+         self.active[server] = self.active.get(server, 0) + 1
+         self.not_empty.notify()
+      return True
+
+   """Documentation for a method.
+
+      Drop the oldest queued action, called with the lock held
+      returns False if no action is queued
+   """
+   def shed_oldest(self):
+      for key in self.order:
+         queued = self.items[key]
+         if isinstance(queued[1], ActionV1):
+            self.order.remove(key)
+            del self.items[key]
+            queued[0].stats.record_dropped("shed")
+            self.finished(queued[0])
+            return True
+      return False
+
+   """Documentation for a method.
+
+      Count an item of a server as handled, called with the lock held
+   """
+   def finished(self, server):
+      remaining = self.active[server] - 1
+      if remaining:
+         self.active[server] = remaining
+      else:
+         del self.active[server]
+         self.drained.notify_all()
+
+   """Documentation for a method.
+
+      Check if an action is older than max_age
+   """
+   def is_expired(self, action):
+      return (self.max_age is not None and isinstance(action, ActionV1) and
+              time() - action.timestamp > self.max_age)
+
+   def run(self):
+      while True:
+         with self.lock:
+            while not self.order and not self.stopping:
+               self.not_empty.wait()
+            if not self.order:
+               return
+            was_full = len(self.order) >= self.queue_size
+            server, action, handler = self.items.pop(self.order.popleft())
+         try:
+            if self.is_expired(action):
+               server.stats.record_dropped("expired")
+            elif handler is None:
+               server.run_callback(action)
+            else:
+               server.run_callback(action, handler)
+         except Exception as error:
+            print("Action worker failed: " + str(error))
+         with self.lock:
+            self.finished(server)
+         if was_full:
+            for listener in list(self.space_listeners):
+               listener()
+
+   def pending(self):
+      with self.lock:
+         return len(self.order)
+
+   """Documentation for a method.
+
+      Wait until every action queued for a server has been handled
+   """
+   def drain(self, server):
+      if threading.current_thread() in self.threads:
+         return
+      with self.lock:
+         while server in self.active:
+            self.drained.wait()
+
+   """Documentation for a method.
+
+      Finish the queued actions and stop the workers
+   """
+   def stop(self):
+      with self.lock:
+         self.stopping = True
+         self.not_empty.notify_all()
+      for thread in self.threads:
+         thread.join()
+
+"""Documentation for a class.
+
+   State kept for each accepted connection
+"""
+class FramedConnection:
+   def __init__(self, server, sock):
+      self.server = server
+      self.sock = sock
+      self.decoder = FrameDecoder(server.max_frame_size)
+      self.pending = deque()
+      self.paused = False
+      self.next_sequence = None
+
+"""Documentation for a class.
+
+   A selector and a single thread driving the sockets of any number of
+   control servers (and stream receivers). Servers started without a loop
+   of their own share ControlLoop.default().
+
+   A server driven by the loop provides `listener`, `connections`,
+   `max_frame_size` and `stats`, `decode_frame(frame, conn)` returning the
+   item carried by a frame received on a FramedConnection (None if it is
+   invalid) and `submit(item)` returning
+   False when the item can not be taken yet
+"""
+class ControlLoop:
+   default_loop = None
+   default_lock = threading.Lock()
+
+   def __init__(self):
+      self.selector = selectors.DefaultSelector()
+      self.wakeup_sockets = socket.socketpair()
+      for sock in self.wakeup_sockets:
+         sock.setblocking(False)
+      self.selector.register(self.wakeup_sockets[0], selectors.EVENT_READ, self)
+      self.calls = deque()
+      self.paused = []
+      self.running = False
+      self.thread = None
+      self.lock = threading.Lock()
+
+   """Documentation for a method.
+
+      Get the loop shared by servers that were not given one
+   """
+   @classmethod
+   def default(cls):
+      with cls.default_lock:
+         if cls.default_loop is None:
+            cls.default_loop = ControlLoop()
+         return cls.default_loop
+
+   """Documentation for a method.
+
+      Start the loop thread if it is not already running
+   """
+   def start(self):
+      with self.lock:
+         if self.running:
+            return
+         self.running = True
+         self.thread = threading.Thread(target=self.run, daemon=True)
+         self.thread.start()
+
+   """Documentation for a method.
+
+      Stop the loop thread. Servers still on the loop stop being served
+   """
+   def stop(self):
+      with self.lock:
+         if not self.running:
+            return
+         self.running = False
+      self.wake()
+      if self.thread is not threading.current_thread():
+         self.thread.join()
+
+   def wake(self):
+      try: self.wakeup_sockets[1].send(b"\0")
+      except OSError:
+         pass
+
+   """Documentation for a method.
+
+      Run fn on the loop thread
+   """
+   def call_soon(self, fn):
+      self.calls.append(fn)
+      self.wake()
+
+   """Documentation for a method.
+
+      Run fn on the loop thread and wait for it to complete
+      Raises what fn raised, or if the loop thread died before running it
+   """
+   def call(self, fn):
+      done = threading.Event()
+      errors = []
+      def run():
+         try: fn()
+         except Exception as error:
+            errors.append(error)
+         finally:
+            done.set()
+      if threading.current_thread() is self.thread or not self.running:
+         run()
+      else:
+         self.call_soon(run)
+         while not done.wait(0.1):
+            if not self.thread.is_alive():
+               raise Exception("Control loop thread is not running")
+      if errors:
+         raise errors[0]
+
+   def register(self, sock, data):
+      self.selector.register(sock, selectors.EVENT_READ, data)
+
+   def unregister(self, sock):
+      self.selector.unregister(sock)
+
+   """Documentation for a method.
+
+      Hand items decoded from a connection to its server. If the server
+      can not take any more the connection stops being read from until
+      there is room again, which pushes back on the sender through TCP
+      flow control
+      returns True iff every pending action was queued
+   """
+   def dispatch_pending(self, conn):
+      server = conn.server
+      while conn.pending:
+         if not server.submit(conn.pending[0]):
+            if not conn.paused:
+               self.unregister(conn.sock)
+               conn.paused = True
+               self.paused.append(conn)
+               server.stats.paused += 1
+            return False
+         conn.pending.popleft()
+      if conn.paused:
+         conn.paused = False
+         self.register(conn.sock, conn)
+      return True
+
+   def close_conn(self, conn):
+      if not conn.paused:
+         self.unregister(conn.sock)
+      conn.sock.close()
+      conn.server.connections.discard(conn)
+
+   def on_readable(self, conn):
+      server = conn.server
+      try: data = conn.sock.recv(65536)
+      except (BlockingIOError, InterruptedError):
+         return
+      except OSError:
+         data = b""
+      if not data:
+         self.close_conn(conn)
+         return
+      try: frames = conn.decoder.feed(data)
+      except Exception:
+         server.stats.decode_failures += 1
+         self.close_conn(conn)
+         return
+      for frame in frames:
+         server.stats.frames += 1
+         action = server.decode_frame(frame, conn)
+         if action is None:
+            server.stats.decode_failures += 1
+         else:
+            conn.pending.append(action)
+      self.dispatch_pending(conn)
+
+   def on_accept(self, server):
+      while True:
+         try: sock, _ = server.listener.accept()
+         except (BlockingIOError, InterruptedError):
+            return
+         except OSError:
+            return
+         sock.setblocking(False)
+         conn = FramedConnection(server, sock)
+         server.connections.add(conn)
+         server.stats.accepted += 1
+         self.register(sock, conn)
+
+   """Documentation for a method.
+
+      Handle an event of a connection or server, so an error raised while
+      handling it (by a server's submit for instance) only closes the
+      connection instead of stopping the loop
+      returns what fn returned, None if it raised
+   """
+   def guard(self, fn, data):
+      try: return fn(data)
+      except Exception as error:
+         print("Control loop failed: " + str(error))
+         if isinstance(data, FramedConnection) and data.sock.fileno() != -1:
+            try: self.close_conn(data)
+            except Exception:
+               data.sock.close()
+         return None
+
+   def run_calls(self):
+      while self.calls:
+         try: self.calls.popleft()()
+         except Exception as error:
+            print("Control loop call failed: " + str(error))
+
+   def run(self):
+      while self.running:
+         for key, _ in self.selector.select(0.05 if self.paused else None):
+            if key.data is self:
+               try: self.wakeup_sockets[0].recv(4096)
+               except BlockingIOError:
+                  pass
+            elif isinstance(key.data, FramedConnection):
+               self.guard(self.on_readable, key.data)
+            else:
+               self.guard(self.on_accept, key.data)
+
+         self.run_calls()
+
+         if self.paused:
+            paused = self.paused
+            self.paused = []
+            for conn in paused:
+               if conn.sock.fileno() == -1:
+                  continue
+               if self.guard(self.dispatch_pending, conn) is False:
+                  self.paused.append(conn)
+
+      self.run_calls()
+
+"""Documentation for a class.
+
+   Counters kept by a control server, along with a histogram of the
+   time taken by the callback. Callbacks finish and actions are dropped
+   on several threads, so both are recorded under `lock`
+"""
+class ControlServerStats:
+   def __init__(self):
+      self.accepted = 0
+      self.frames = 0
+      self.decode_failures = 0
+      self.actions = 0
+      self.callback_errors = 0
+      self.paused = 0
+      self.rejected = 0
+      self.unrouted = 0
+      self.coalesced = 0
+      self.expired = 0
+      self.shed = 0
+      self.callback_latency = LatencyHistogram()
+      self.lock = threading.Lock()
+
+   """Documentation for a method.
+
+      Record a callback that took `seconds` and raised `error` (None if
+      it worked)
+   """
+   def record_callback(self, seconds, error=None):
+      with self.lock:
+         self.callback_latency.record(seconds)
+         if error is not None:
+            self.callback_errors += 1
+
+   """Documentation for a method.
+
+      Count an action dropped by an overload policy, `reason` is one of
+      coalesced, expired or shed
+   """
+   def record_dropped(self, reason):
+      with self.lock:
+         setattr(self, reason, getattr(self, reason) + 1)
+
+   def counters(self):
+      return {name: value for name, value in self.__dict__.items() if isinstance(value, int)}
+
+   def snapshot(self):
+      with self.lock:
+         snapshot = self.counters()
+         snapshot["callback_latency"] = self.callback_latency.snapshot()
+      return snapshot
+
+   """Documentation for a method.
+
+      Export the stats in the Prometheus text format
+   """
+   def prometheus(self, prefix="pycrate_control_server"):
+      with self.lock:
+         return prometheus_counters(prefix, self.counters(), {"callback_seconds": self.callback_latency})
+
+"""Documentation for a class.
+
+   Listens for actions sent to a controller and passes each one to
+   callback_fn, or to the handlers of an ActionRouter given as
+   callback_fn. Every server owns its listening socket, statistics and
+   lifecycle, and can be stopped and started again.
+
+   Sockets are driven by `loop` (ControlLoop.default() if not given), so
+   any number of servers can share a single network thread. Callbacks
+   run on a given ActionWorkers, or on `workers` threads of the server's
+   own fed by a queue of `queue_size` actions. `coalesce`, `max_age` and
+   `high_water` set the overload policies of the workers the server
+   creates, see ActionWorkers (shared workers have their own). A server
+   given none of these shares ActionWorkers.default()
+"""
+class ControlServer:
+   def __init__(self, connection, callback_fn, workers=None, queue_size=None, max_frame_size=1048576, loop=None,
+                coalesce=False, max_age=None, high_water=None):
+      if not isinstance(connection, IPV4Connection):
+         raise Exception("Connection must be an IPV4Connection")
+      self.connection = connection
+      self.callback_fn = callback_fn
+      self.router = callback_fn if isinstance(callback_fn, ActionRouter) else None
+      self.worker_count = workers
+      self.queue_size = queue_size
+      self.coalesce = coalesce
+      self.max_age = max_age
+      self.high_water = high_water
+      self.max_frame_size = max_frame_size
+      self.loop = loop
+      self.workers = None
+      self.owns_workers = False
+      self.listener = None
+      self.connections = set()
+      self.stats = ControlServerStats()
+
+   """Documentation for a method.
+
+      The address the server is listening on. When started on port 0
+      this holds the port that was picked by the OS
+   """
+   @property
+   def address(self):
+      if self.listener is None:
+         return self.connection
+      address, port = self.listener.getsockname()
+      return IPV4Connection(address, port)
+
+   def is_running(self):
+      return self.listener is not None
+
+   def decode_frame(self, frame, conn=None):
+      try: return ActionV1.from_frame(frame)
+      except Exception:
+         return None
+
+   def submit(self, action):
+      if self.router is not None:
+         return self.router.submit(self, action)
+      return self.workers.submit(self, action)
+
+   def run_callback(self, action, handler=None):
+      with self.stats.lock:
+         self.stats.actions += 1
+      started = perf_counter()
+      failure = None
       try:
-         data_len = int.from_bytes(sock.recv(4), "little")
-         actual_data = sock.recv(data_len)
-      except:
-         continue
-      
-      if actual_data is not None:
-         action = ActionV1(0,"","",0.0)
-         if action.decode_from(actual_data.decode("utf-8")):
-            callback_fn(action)
-
-def start(connection, callback_fn):
-   if not isinstance(connection, IPV4Connection):
-      raise Exception("Connection must be an IPV4Connection")
-
-   global server_thread
-   sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-   sock.bind((connection.address, connection.port))
-   sock.listen(5)
-   server_thread = threading.Thread(target=new_conn, args=(sock, callback_fn))
-   server_thread.start()
-
-def control_server_start(connection, callback_fn):
-   global start_thread
-   start_thread = threading.Thread(target=start, args=(connection, callback_fn))
-   start_thread.start()
-   
+         (handler or self.callback_fn)(action)
+      except Exception as error:
+         failure = error
+         print("Control server callback failed: " + str(error))
+      self.stats.record_callback(perf_counter() - started, failure)
+
+   """Documentation for a method.
+
+      Start listening. Raises if the address can not be bound
+   """
+   def start(self):
+      if self.listener is not None:
+         raise Exception("Control server is already running")
+
+      listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      try:
+         listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+         listener.bind((self.connection.address, self.connection.port))
+         listener.listen(128)
+         listener.setblocking(False)
+      except Exception:
+         listener.close()
+         raise
+
+      if isinstance(self.worker_count, ActionWorkers):
+         self.workers = self.worker_count
+         self.owns_workers = False
+      elif (self.worker_count is None and self.queue_size is None and not self.coalesce and
+            self.max_age is None and self.high_water is None):
+         self.workers = ActionWorkers.default()
+         self.owns_workers = False
+      else:
+         self.workers = ActionWorkers(4 if self.worker_count is None else self.worker_count,
+                                      1024 if self.queue_size is None else self.queue_size,
+                                      self.coalesce, self.max_age, self.high_water)
+         self.owns_workers = True
+
+      if self.loop is None:
+         self.loop = ControlLoop.default()
+      self.workers.space_listeners.append(self.loop.wake)
+      self.listener = listener
+      self.loop.start()
+      self.loop.call(lambda: self.loop.register(listener, self))
+
+   """Documentation for a method.
+
+      Stop listening and close every connection. Actions already queued
+      for the workers are still handed to the callback before this returns
+   """
+   def stop(self):
+      if self.listener is None:
+         return
+      listener = self.listener
+
+      def detach():
+         self.loop.unregister(listener)
+         for conn in list(self.connections):
+            self.loop.close_conn(conn)
+
+      self.loop.call(detach)
+      listener.close()
+      self.listener = None
+      self.workers.space_listeners.remove(self.loop.wake)
+      if self.owns_workers:
+         self.workers.stop()
+      else:
+         self.workers.drain(self)
+      self.workers = None
+
+   def __enter__(self):
+      self.start()
+      return self
+
+   def __exit__(self, *args):
+      self.stop()
+
+default_server = None
+
+"""Documentation for a method.
+
+   Start a control server on the given connection
+   Kept for compatibility, see ControlServer to run several servers
+"""
+def control_server_start(connection, callback_fn, workers=None, queue_size=None, max_frame_size=1048576,
+                         coalesce=False, max_age=None, high_water=None):
+   global default_server
+   if default_server is not None:
+      default_server.stop()
+   default_server = ControlServer(connection, callback_fn, workers, queue_size, max_frame_size,
+                                  coalesce=coalesce, max_age=max_age, high_water=high_water)
+   default_server.start()
+
+"""Documentation for a method.
+
+   Stop the control server started by control_server_start
+"""
 def control_server_stop():
-   global continue_serving
-   continue_serving = False
-   try:
-      server_thread.join()
-      start_thread.join()
-   except:
-      exit(0)
+   global default_server
+   if default_server is None:
+      return
+   default_server.stop()
+   default_server = None
@@ -0,0 +1,449 @@
+import errno
+import socket
+import selectors
+import threading
+from collections import deque
+from time import time, monotonic
+from .types import ActionV1
+from .monolith import Monolith
+from .cache import RegistrarCache, MISS
+from .transport import TransportPolicy
+
+"""Documentation for a class.
+
+   Connection to a single controller and the frames queued for it.
+   `batch` holds the frames being written, `written` how many bytes of
+   them the socket took so far
+"""
+class ControllerLink:
+   def __init__(self, controller_id):
+      self.controller_id = controller_id
+      self.target = None
+      self.address = None
+      self.sock = None
+      self.connecting = False
+      self.deadline = None
+      self.events = 0
+      self.frames = deque()
+      self.batch = []
+      self.buffer = b""
+      self.written = 0
+      self.failures = 0
+      self.retry_at = 0.0
+      self.sent = 0
+      self.dropped = 0
+      self.connects = 0
+      self.errors = 0
+      self.last_error = None
+
+   def is_idle(self):
+      return not self.frames and not self.batch
+
+"""Documentation for a class.
+
+   Sends ActionV1 frames to controllers over persistent connections, all
+   driven by one selector thread. Frames use the control server framing,
+   a 4 byte little endian length followed by the action as json, or in
+   the binary encoding if `binary` is set.
+
+   Controller endpoints are looked up with registrar_fetch_controller
+   and kept in `registrar_cache` (the monolith's if it has one, a new
+   RegistrarCache otherwise). Each controller has its own queue of at
+   most `queue_size` frames and its own non-blocking socket, so a slow
+   or unreachable controller only fills up its own queue. Connections
+   that fail are reopened after a jittered exponential backoff taken
+   from `policy`, with the frame that was being written sent again, and
+   the controller's endpoint is looked up again on the next send.
+
+   Frames the controller's socket accepted count as sent, the protocol
+   has no acknowledgements
+"""
+class ActionDispatcher:
+   def __init__(self, monolith, queue_size=1024, binary=False, policy=None, registrar_cache=None, batch_frames=64):
+      if not isinstance(monolith, Monolith):
+         raise Exception("MONOLITH must be of type Monolith")
+      if not isinstance(queue_size, int) or queue_size < 1:
+         raise Exception("QUEUE SIZE must be an int greater than 0")
+      if policy is None:
+         policy = TransportPolicy()
+      if not isinstance(policy, TransportPolicy):
+         raise Exception("POLICY must be of type TransportPolicy")
+      if registrar_cache is None:
+         registrar_cache = monolith.registrar_cache or RegistrarCache()
+      if not isinstance(registrar_cache, RegistrarCache):
+         raise Exception("REGISTRAR CACHE must be of type RegistrarCache")
+      self.monolith = monolith
+      self.queue_size = queue_size
+      self.binary = binary
+      self.policy = policy
+      self.registrar_cache = registrar_cache
+      self.batch_frames = batch_frames
+      self.links = {}
+      self.ready = []
+      self.waiting = set()
+      self.queued = 0
+      self.lookup_failures = 0
+      self.lock = threading.Lock()
+      self.drained = threading.Condition(self.lock)
+      self.selector = selectors.DefaultSelector()
+      self.wakeup_sockets = socket.socketpair()
+      for sock in self.wakeup_sockets:
+         sock.setblocking(False)
+      self.selector.register(self.wakeup_sockets[0], selectors.EVENT_READ, self)
+      self.running = True
+      self.thread = threading.Thread(target=self.run, daemon=True)
+      self.thread.start()
+
+   """Documentation for a method.
+
+      Look up a controller, through the registrar cache
+      returns a ControllerV1, or None if it could not be found
+   """
+   def lookup(self, controller_id):
+      controller = self.registrar_cache.get("controller", controller_id)
+      if controller is not MISS and controller is not None:
+         return controller
+      controller = self.monolith.registrar_fetch_controller(controller_id)
+      if controller is None:
+         with self.lock:
+            self.lookup_failures += 1
+         return None
+      self.registrar_cache.put("controller", controller_id, controller)
+      return controller
+
+   def encode_frame(self, action):
+      payload = action.encode_binary() if self.binary else action.encode().encode("utf-8")
+      return len(payload).to_bytes(4, "little") + payload
+
+   """Documentation for a method.
+
+      Queue an action for the controller named by its controller_id
+      returns True if it was queued, False if the controller could not
+      be found or its queue is full
+   """
+   def send(self, action):
+      if not isinstance(action, ActionV1):
+         raise Exception("ACTION must be of type ActionV1")
+      controller = self.lookup(action.controller_id)
+      if controller is None:
+         return False
+      frame = self.encode_frame(action)
+      with self.lock:
+         if not self.running:
+            return False
+         link = self.links.get(action.controller_id)
+         if link is None:
+            link = self.links[action.controller_id] = ControllerLink(action.controller_id)
+         link.target = (controller.ip, controller.port)
+         if len(link.frames) >= self.queue_size:
+            link.dropped += 1
+            return False
+         link.frames.append(frame)
+         self.queued += 1
+         self.ready.append(link)
+      self.wake()
+      return True
+
+   """Documentation for a method.
+
+      Send the same action to several controllers at once. The writes
+      to the controllers happen concurrently on the dispatcher thread
+      returns a list with the result of send for each controller
+   """
+   def fan_out(self, controller_ids, action_id, value, timestamp=None):
+      if timestamp is None:
+         timestamp = int(time())
+      return [self.send(ActionV1(timestamp, controller_id, action_id, value)) for controller_id in controller_ids]
+
+   """Documentation for a method.
+
+      Wait until every queued frame was written to its controller
+      returns False if that did not happen within `timeout` seconds
+   """
+   def flush(self, timeout=None):
+      with self.lock:
+         return self.drained.wait_for(lambda: self.queued == 0 or not self.running, timeout) and self.queued == 0
+
+   def wake(self):
+      try: self.wakeup_sockets[1].send(b"\0")
+      except OSError:
+         pass
+
+   def set_events(self, link, events):
+      if events == link.events:
+         return
+      if not link.events:
+         self.selector.register(link.sock, events, link)
+      elif not events:
+         self.selector.unregister(link.sock)
+      else:
+         self.selector.modify(link.sock, events, link)
+      link.events = events
+
+   def connect(self, link):
+      self.waiting.discard(link)
+      link.address = link.target
+      sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      sock.setblocking(False)
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      link.connects += 1
+      try: error = sock.connect_ex(link.address)
+      except OSError as failure:
+         # Raised for addresses that can not be resolved
+         sock.close()
+         self.fail(link, failure)
+         return
+      # Set before the socket so a link is never seen as connected early
+      link.connecting = True
+      link.sock = sock
+      if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+         self.fail(link, OSError(error, "connect failed"))
+         return
+      if self.policy.connect_timeout is not None:
+         link.deadline = monotonic() + self.policy.connect_timeout
+         self.waiting.add(link)
+      self.set_events(link, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+   def close_link(self, link):
+      if link.sock is None:
+         return
+      self.set_events(link, 0)
+      link.sock.close()
+      link.sock = None
+      link.connecting = False
+      link.deadline = None
+
+   """Documentation for a method.
+
+      Close a link after an error. Frames of the batch that were not
+      completely written are put back at the front of the queue
+   """
+   def fail(self, link, error):
+      self.close_link(link)
+      end = 0
+      unsent = []
+      for frame in link.batch:
+         end += len(frame)
+         if end > link.written:
+            unsent.append(frame)
+      with self.lock:
+         self.sent_frames(link, len(link.batch) - len(unsent))
+         link.frames.extendleft(reversed(unsent))
+      link.batch = []
+      link.buffer = b""
+      link.written = 0
+      link.errors += 1
+      link.last_error = str(error) or type(error).__name__
+      link.retry_at = monotonic() + self.policy.retry_delay(link.failures)
+      link.failures += 1
+      self.registrar_cache.invalidate(link.controller_id)
+      self.waiting.add(link)
+
+   def sent_frames(self, link, count):
+      if not count:
+         return
+      link.sent += count
+      self.queued -= count
+      if self.queued == 0:
+         self.drained.notify_all()
+
+   """Documentation for a method.
+
+      Write as much of a link's queue as its socket takes without
+      blocking
+   """
+   def write(self, link):
+      while True:
+         if link.written == len(link.buffer):
+            with self.lock:
+               self.sent_frames(link, len(link.batch))
+               count = min(len(link.frames), self.batch_frames)
+               link.batch = [link.frames.popleft() for _ in range(0, count)]
+            link.buffer = b"".join(link.batch)
+            link.written = 0
+            if not link.batch:
+               self.set_events(link, selectors.EVENT_READ)
+               return
+         try: link.written += link.sock.send(memoryview(link.buffer)[link.written:])
+         except (BlockingIOError, InterruptedError):
+            self.set_events(link, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            return
+         except OSError as error:
+            self.fail(link, error)
+            return
+
+   def on_writable(self, link):
+      if link.connecting:
+         error = link.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+         if error:
+            self.fail(link, OSError(error, "connect failed"))
+            return
+         link.connecting = False
+         link.deadline = None
+         link.failures = 0
+         self.waiting.discard(link)
+      self.write(link)
+
+   """Documentation for a method.
+
+      Controllers do not send anything back, so a readable socket means
+      the controller closed the connection or sent something to ignore
+   """
+   def on_readable(self, link):
+      if link.connecting:
+         self.on_writable(link)
+         return
+      try: data = link.sock.recv(4096)
+      except (BlockingIOError, InterruptedError):
+         return
+      except OSError as error:
+         self.fail(link, error)
+         return
+      if not data:
+         self.fail(link, ConnectionResetError("connection closed by controller"))
+
+   """Documentation for a method.
+
+      Get a link going after frames were queued for it
+   """
+   def service(self, link):
+      if link.sock is not None and link.address != link.target:
+         self.fail(link, ConnectionResetError("controller endpoint changed"))
+         link.retry_at = 0.0
+      if link.sock is None:
+         if link.retry_at <= monotonic():
+            self.connect(link)
+         else:
+            self.waiting.add(link)
+         return
+      if not link.connecting and link.events & selectors.EVENT_WRITE == 0:
+         self.write(link)
+
+   """Documentation for a method.
+
+      Time out connection attempts and retry failed links that have
+      frames queued
+      returns the time until the next of those is due, None if none is
+   """
+   def check_timers(self):
+      now = monotonic()
+      next_due = None
+      for link in list(self.waiting):
+         if link.connecting:
+            if link.deadline <= now:
+               self.fail(link, TimeoutError("connect timed out"))
+               continue
+            due = link.deadline
+         elif link.is_idle():
+            self.waiting.discard(link)
+            continue
+         elif link.retry_at <= now:
+            self.connect(link)
+            continue
+         else:
+            due = link.retry_at
+         next_due = due if next_due is None else min(next_due, due)
+      if self.waiting and next_due is None:
+         return 0.0
+      return None if next_due is None else max(0.0, next_due - now)
+
+   """Documentation for a method.
+
+      Run fn on a link, failing the link rather than the dispatcher
+      thread if it raises
+   """
+   def guard(self, link, fn):
+      try: fn(link)
+      except Exception as error:
+         print("Action dispatcher failed on " + link.controller_id + ": " + str(error))
+         try: self.fail(link, error)
+         except Exception:
+            link.sock = None
+            link.connecting = False
+
+   def run(self):
+      timeout = None
+      while True:
+         for key, mask in self.selector.select(timeout):
+            if key.data is self:
+               try: self.wakeup_sockets[0].recv(4096)
+               except BlockingIOError:
+                  pass
+               continue
+            link = key.data
+            if mask & selectors.EVENT_WRITE:
+               self.guard(link, self.on_writable)
+            elif mask & selectors.EVENT_READ:
+               self.guard(link, self.on_readable)
+
+         with self.lock:
+            if not self.running:
+               break
+            ready = self.ready
+            self.ready = []
+         for link in dict.fromkeys(ready):
+            self.guard(link, self.service)
+         try: timeout = self.check_timers()
+         except Exception as error:
+            print("Action dispatcher timers failed: " + str(error))
+            timeout = 0.05
+
+      for link in self.links.values():
+         self.close_link(link)
+      self.selector.close()
+      for sock in self.wakeup_sockets:
+         sock.close()
+
+   """Documentation for a method.
+
+      Stop the dispatcher, closing every connection. Frames that were
+      not written yet are dropped, call flush first to send them
+   """
+   def close(self):
+      with self.lock:
+         if not self.running:
+            return
+         self.running = False
+         self.drained.notify_all()
+      self.wake()
+      self.thread.join()
+
+   """Documentation for a method.
+
+      Get the state of the link to a controller
+      returns a dict, or None if nothing was sent to the controller
+   """
+   def status(self, controller_id):
+      with self.lock:
+         link = self.links.get(controller_id)
+         if link is None:
+            return None
+         return {
+            "connected": link.sock is not None and not link.connecting,
+            "address": link.address,
+            "queued": len(link.frames) + len(link.batch),
+            "sent": link.sent,
+            "dropped": link.dropped,
+            "connects": link.connects,
+            "errors": link.errors,
+            "last_error": link.last_error,
+         }
+
+   def stats(self):
+      with self.lock:
+         links = list(self.links.values())
+         return {
+            "controllers": len(links),
+            "connected": sum(1 for link in links if link.sock is not None and not link.connecting),
+            "queued": self.queued,
+            "sent": sum(link.sent for link in links),
+            "dropped": sum(link.dropped for link in links),
+            "errors": sum(link.errors for link in links),
+            "lookup_failures": self.lookup_failures,
+         }
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
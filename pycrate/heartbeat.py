@@ -0,0 +1,227 @@
+import heapq
+import random
+import threading
+from time import time, monotonic
+from .types import HeartbeatV1
+from .monolith import Monolith
+
+"""Documentation for a class.
+
+   Heartbeat state of a node managed by a HeartbeatScheduler.
+   `last_success` is the wall clock time of the last accepted heartbeat
+   (None if there was none yet) and `failures` the number of heartbeats
+   that failed since then
+"""
+class NodeHeartbeat:
+   __slots__ = ("node_id", "interval", "due", "last_attempt", "last_success", "failures", "sent", "failed")
+
+   def __init__(self, node_id, interval):
+      self.node_id = node_id
+      self.interval = interval
+      self.due = None
+      self.last_attempt = None
+      self.last_success = None
+      self.failures = 0
+      self.sent = 0
+      self.failed = 0
+
+"""Documentation for a class.
+
+   Sends the heartbeats of any number of nodes from a single thread.
+   Every node is kept on one heap ordered by the time its next heartbeat
+   is due. Heartbeats that fall due together are pipelined over a pooled
+   connection to the monolith in batches of at most `batch_size`.
+
+   Each node's heartbeat is sent every `interval` seconds, give or take
+   `jitter` (a fraction of the interval), and the first one at a random
+   point of the first interval, so nodes added together do not keep
+   sending in lock step
+"""
+class HeartbeatScheduler:
+   def __init__(self, monolith, interval=30.0, jitter=0.1, batch_size=256):
+      if not isinstance(monolith, Monolith):
+         raise Exception("MONOLITH must be of type Monolith")
+      if not isinstance(interval, (int, float)) or interval <= 0:
+         raise Exception("INTERVAL must be a positive number")
+      if not isinstance(jitter, (int, float)) or jitter < 0 or jitter >= 1:
+         raise Exception("JITTER must be a number from 0 up to 1")
+      if not isinstance(batch_size, int) or batch_size < 1:
+         raise Exception("BATCH SIZE must be an int greater than 0")
+      self.monolith = monolith
+      self.interval = interval
+      self.jitter = jitter
+      self.batch_size = batch_size
+      self.nodes = {}
+      self.heap = []
+      self.counter = 0
+      self.random = random.Random()
+      self.lock = threading.Lock()
+      self.changed = threading.Condition(self.lock)
+      self.running = False
+      self.thread = None
+      self.rounds = 0
+
+   """Documentation for a method.
+
+      Start sending heartbeats for a node, every `interval` seconds if
+      given or the scheduler's interval otherwise. Adding a node that is
+      already scheduled changes its interval
+   """
+   def add(self, node_id, interval=None):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      if interval is None:
+         interval = self.interval
+      elif not isinstance(interval, (int, float)) or interval <= 0:
+         raise Exception("INTERVAL must be a positive number")
+      with self.lock:
+         node = self.nodes.get(node_id)
+         if node is None:
+            node = self.nodes[node_id] = NodeHeartbeat(node_id, interval)
+         node.interval = interval
+         self.schedule(node, monotonic() + self.random.uniform(0, interval))
+
+   """Documentation for a method.
+
+      Add several nodes at once
+   """
+   def add_many(self, node_ids, interval=None):
+      for node_id in node_ids:
+         self.add(node_id, interval)
+
+   """Documentation for a method.
+
+      Stop sending heartbeats for a node
+      returns False if the node was not scheduled
+   """
+   def remove(self, node_id):
+      with self.lock:
+         return self.nodes.pop(node_id, None) is not None
+
+   def schedule(self, node, due):
+      node.due = due
+      self.counter += 1
+      heapq.heappush(self.heap, (due, self.counter, node))
+      if self.heap[0][2] is node:
+         self.changed.notify()
+
+   """Documentation for a method.
+
+      Get the heartbeat state of a node
+      returns a NodeHeartbeat, or None if the node is not scheduled
+   """
+   def status(self, node_id):
+      with self.lock:
+         return self.nodes.get(node_id)
+
+   """Documentation for a method.
+
+      Get the ids of the nodes whose last `min_failures` or more
+      heartbeats failed
+   """
+   def failing(self, min_failures=1):
+      with self.lock:
+         return [node.node_id for node in self.nodes.values() if node.failures >= min_failures]
+
+   """Documentation for a method.
+
+      Take the nodes whose heartbeat is due, skipping heap entries of
+      nodes that were removed or rescheduled since
+      returns the due nodes, or the time until the next one is due
+   """
+   def take_due(self):
+      now = monotonic()
+      due = []
+      heap = self.heap
+      while heap and len(due) < self.batch_size:
+         when, _, node = heap[0]
+         if self.nodes.get(node.node_id) is not node or node.due != when:
+            heapq.heappop(heap)
+            continue
+         if when > now:
+            break
+         heapq.heappop(heap)
+         due.append(node)
+      if due or not heap:
+         return due, None
+      return due, heap[0][0] - now
+
+   """Documentation for a method.
+
+      Send the heartbeats of the given nodes in one pipelined batch and
+      schedule their next heartbeat
+   """
+   def send(self, nodes):
+      endpoints = ["/metric/heartbeat/" + HeartbeatV1(node.node_id).encode() for node in nodes]
+      results = [self.monolith.submission_result(response, "metric_heartbeat") for response in self.monolith.fetch_endpoints(endpoints)]
+      now = time()
+      clock = monotonic()
+      with self.lock:
+         self.rounds += 1
+         for node, result in zip(nodes, results):
+            node.last_attempt = now
+            if result:
+               node.last_success = now
+               node.failures = 0
+               node.sent += 1
+            else:
+               node.failures += 1
+               node.failed += 1
+            if self.nodes.get(node.node_id) is node and node.due is not None:
+               # Count from now if the scheduler fell behind, rather than
+               # catching up with a burst of overdue heartbeats
+               spread = node.interval * self.jitter
+               self.schedule(node, max(node.due, clock) + node.interval + self.random.uniform(-spread, spread))
+
+   def run(self):
+      while True:
+         with self.lock:
+            while self.running:
+               nodes, wait = self.take_due()
+               if nodes:
+                  break
+               self.changed.wait(wait)
+            if not self.running:
+               return
+         self.send(nodes)
+
+   """Documentation for a method.
+
+      Start the scheduler thread
+   """
+   def start(self):
+      with self.lock:
+         if self.running:
+            return
+         self.running = True
+         self.thread = threading.Thread(target=self.run, daemon=True)
+         self.thread.start()
+
+   """Documentation for a method.
+
+      Stop the scheduler thread. A batch being sent is finished first
+   """
+   def stop(self):
+      with self.lock:
+         if not self.running:
+            return
+         self.running = False
+         self.changed.notify_all()
+      self.thread.join()
+
+   def stats(self):
+      with self.lock:
+         return {
+            "nodes": len(self.nodes),
+            "rounds": self.rounds,
+            "sent": sum(node.sent for node in self.nodes.values()),
+            "failed": sum(node.failed for node in self.nodes.values()),
+            "failing": sum(1 for node in self.nodes.values() if node.failures),
+         }
+
+   def __enter__(self):
+      self.start()
+      return self
+
+   def __exit__(self, *args):
+      self.stop()
@@ -0,0 +1,232 @@
+import threading
+from math import log2, ceil
+
+"""
+   Histogram buckets are spaced `HISTOGRAM_STEPS` per doubling, starting
+   at HISTOGRAM_BASE seconds, which bounds the error of any recorded
+   latency to about 19%
+"""
+HISTOGRAM_BASE = 0.000001
+HISTOGRAM_STEPS = 4
+HISTOGRAM_BUCKETS = 28 * HISTOGRAM_STEPS
+
+"""Documentation for a method.
+
+   Get the endpoint family used to group the stats of a request:
+   "registrar", "metric_submit", "metric_fetch", "metric_heartbeat",
+   "metric_stream", "version" or "root"
+"""
+def endpoint_family(endpoint):
+   parts = endpoint.split("/", 3)
+   if len(parts) < 2 or not parts[1]:
+      return "root"
+   if parts[1] == "metric" and len(parts) > 2:
+      return "metric_" + parts[2]
+   return parts[1]
+
+"""Documentation for a class.
+
+   Log bucketed latency histogram. Bucket i counts the values up to
+   HISTOGRAM_BASE * 2^(i / HISTOGRAM_STEPS) seconds, the last bucket
+   everything above
+"""
+class LatencyHistogram:
+   def __init__(self):
+      self.buckets = [0] * (HISTOGRAM_BUCKETS + 1)
+      self.count = 0
+      self.sum = 0.0
+      self.min = None
+      self.max = None
+
+   def record(self, seconds):
+      if seconds <= HISTOGRAM_BASE:
+         index = 0
+      else:
+         index = min(HISTOGRAM_BUCKETS, ceil(log2(seconds / HISTOGRAM_BASE) * HISTOGRAM_STEPS))
+      self.buckets[index] += 1
+      self.count += 1
+      self.sum += seconds
+      if self.min is None or seconds < self.min:
+         self.min = seconds
+      if self.max is None or seconds > self.max:
+         self.max = seconds
+
+   def bound(self, index):
+      return HISTOGRAM_BASE * 2 ** (index / HISTOGRAM_STEPS)
+
+   """Documentation for a method.
+
+      Estimate a quantile (0 to 1) of the recorded values
+      returns the upper bound of the bucket holding it, None if empty
+   """
+   def quantile(self, q):
+      if not self.count:
+         return None
+      rank = q * self.count
+      seen = 0
+      for index, count in enumerate(self.buckets):
+         seen += count
+         if seen >= rank and count:
+            return min(self.bound(index), self.max)
+      return self.max
+
+   def snapshot(self):
+      return {
+         "count": self.count,
+         "sum": self.sum,
+         "min": self.min,
+         "max": self.max,
+         "p50": self.quantile(0.5),
+         "p90": self.quantile(0.9),
+         "p99": self.quantile(0.99),
+      }
+
+   """Documentation for a method.
+
+      Get the Prometheus histogram lines of a metric, with one bucket
+      per doubling of latency
+   """
+   def prometheus(self, name, labels=""):
+      bucket = name + "_bucket{" + labels + ("," if labels else "") + "le=\""
+      suffix = "{" + labels + "}" if labels else ""
+      lines = []
+      cumulative = 0
+      for index, count in enumerate(self.buckets):
+         cumulative += count
+         if index % HISTOGRAM_STEPS == 0 and index < HISTOGRAM_BUCKETS:
+            lines.append(bucket + format(self.bound(index), ".6g") + "\"} " + str(cumulative))
+      lines.append(bucket + "+Inf\"} " + str(self.count))
+      lines.append(name + "_sum" + suffix + " " + repr(self.sum))
+      lines.append(name + "_count" + suffix + " " + str(self.count))
+      return lines
+
+"""Documentation for a class.
+
+   Stats of the requests made to one endpoint family
+"""
+class EndpointStats:
+   def __init__(self):
+      self.requests = 0
+      self.sent_bytes = 0
+      self.received_bytes = 0
+      self.errors = {}
+      self.latency = LatencyHistogram()
+      self.encode_seconds = 0.0
+      self.encodes = 0
+      self.decode_seconds = 0.0
+      self.decodes = 0
+
+   def snapshot(self):
+      return {
+         "requests": self.requests,
+         "sent_bytes": self.sent_bytes,
+         "received_bytes": self.received_bytes,
+         "errors": dict(self.errors),
+         "latency": self.latency.snapshot(),
+         "encode_seconds": self.encode_seconds,
+         "encodes": self.encodes,
+         "decode_seconds": self.decode_seconds,
+         "decodes": self.decodes,
+      }
+
+"""Documentation for a class.
+
+   Request stats of a Monolith, kept per endpoint family: a latency
+   histogram, request, byte and error counts (by the error kinds of
+   FetchResult) and the time spent encoding requests and decoding
+   responses. Pipelined requests are recorded one by one, their latency
+   running from the start of the batch to their response. Thread safe.
+
+   Monolith only records anything when given a ClientMetrics, so
+   leaving it out costs nothing
+"""
+class ClientMetrics:
+   def __init__(self):
+      self.families = {}
+      self.lock = threading.Lock()
+
+   def family(self, name):
+      stats = self.families.get(name)
+      if stats is None:
+         stats = self.families[name] = EndpointStats()
+      return stats
+
+   """Documentation for a method.
+
+      Record a request
+   """
+   def record_request(self, family, seconds, sent_bytes, received_bytes, error=None):
+      with self.lock:
+         stats = self.family(family)
+         stats.requests += 1
+         stats.sent_bytes += sent_bytes
+         stats.received_bytes += received_bytes
+         stats.latency.record(seconds)
+         if error is not None:
+            stats.errors[error] = stats.errors.get(error, 0) + 1
+
+   def record_encode(self, family, seconds):
+      with self.lock:
+         stats = self.family(family)
+         stats.encode_seconds += seconds
+         stats.encodes += 1
+
+   def record_decode(self, family, seconds):
+      with self.lock:
+         stats = self.family(family)
+         stats.decode_seconds += seconds
+         stats.decodes += 1
+
+   """Documentation for a method.
+
+      Get the stats of every endpoint family
+      returns a dict of plain values keyed by family
+   """
+   def snapshot(self):
+      with self.lock:
+         return {name: stats.snapshot() for name, stats in self.families.items()}
+
+   def reset(self):
+      with self.lock:
+         self.families.clear()
+
+   """Documentation for a method.
+
+      Export the stats in the Prometheus text format
+   """
+   def prometheus(self, prefix="pycrate"):
+      with self.lock:
+         families = sorted(self.families.items())
+         lines = []
+         counters = (("requests_total", "requests"),
+                     ("sent_bytes_total", "sent_bytes"),
+                     ("received_bytes_total", "received_bytes"),
+                     ("encode_seconds_total", "encode_seconds"),
+                     ("decode_seconds_total", "decode_seconds"))
+         for metric, field in counters:
+            lines.append("# TYPE " + prefix + "_" + metric + " counter")
+            for name, stats in families:
+               lines.append(prefix + "_" + metric + "{family=\"" + name + "\"} " + str(getattr(stats, field)))
+         lines.append("# TYPE " + prefix + "_errors_total counter")
+         for name, stats in families:
+            for error, count in sorted(stats.errors.items()):
+               lines.append(prefix + "_errors_total{family=\"" + name + "\",error=\"" + error + "\"} " + str(count))
+         lines.append("# TYPE " + prefix + "_request_duration_seconds histogram")
+         for name, stats in families:
+            lines.extend(stats.latency.prometheus(prefix + "_request_duration_seconds", "family=\"" + name + "\""))
+      return "\n".join(lines) + "\n"
+
+"""Documentation for a method.
+
+   Export plain counters and latency histograms, such as the stats of a
+   control server, in the Prometheus text format
+"""
+def prometheus_counters(prefix, counters, histograms=None):
+   lines = []
+   for name, value in sorted(counters.items()):
+      lines.append("# TYPE " + prefix + "_" + name + "_total counter")
+      lines.append(prefix + "_" + name + "_total " + str(value))
+   for name, histogram in sorted((histograms or {}).items()):
+      lines.append("# TYPE " + prefix + "_" + name + " histogram")
+      lines.extend(histogram.prometheus(prefix + "_" + name))
+   return "\n".join(lines) + "\n"
@@ -1,19 +1,139 @@
-from time import time
+from time import time, sleep, perf_counter
+from math import inf
+import re
 import threading
-import urllib.request, urllib.parse
+import urllib.parse
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .types import *
+from .pool import ConnectionPool
+from .reading_block import ReadingBlock
+from .reading_view import ReadingView
+from .cache import RegistrarCache, MetricCache, MISS
+from .transport import TransportPolicy, FetchResult, error_result, ERROR_HTTP, ERROR_CONNECTION, ERROR_CIRCUIT_OPEN, ERROR_POOL_EXHAUSTED
+from .metrics import ClientMetrics, endpoint_family
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r"[ \t\n\r]*")
+
+"""
+   Prefixes of the endpoints that change state on the monolith. These
+   are never retried, as a request that timed out may still have worked
+"""
+mutating_endpoints = ("/registrar/add/", "/registrar/delete/", "/metric/submit/", "/metric/heartbeat/", "/metric/stream/")
+
+def is_idempotent(endpoint):
+   return not endpoint.startswith(mutating_endpoints)
+
+"""Documentation for a method.
+
+   Iterate over the elements of the "data" array of a monolith response,
+   decoding them one at a time rather than building the whole list.
+   Raises if the response is malformed or its status is not 200
+"""
+def iter_response_data(response):
+   text = response.decode("utf-8") if isinstance(response, (bytes, bytearray)) else response
+   index = json_whitespace.match(text, 0).end()
+   if text[index:index + 1] != "{":
+      raise Exception("Response is not a json object")
+   index = json_whitespace.match(text, index + 1).end()
+   while text[index:index + 1] != "}":
+      key, index = json_decoder.raw_decode(text, index)
+      index = json_whitespace.match(text, index).end()
+      if text[index:index + 1] != ":":
+         raise Exception("Malformed response")
+      index = json_whitespace.match(text, index + 1).end()
+
+      if key == "data" and text[index:index + 1] == "[":
+         index = json_whitespace.match(text, index + 1).end()
+         while text[index:index + 1] != "]":
+            element, index = json_decoder.raw_decode(text, index)
+            yield element
+            index = json_whitespace.match(text, index).end()
+            if text[index:index + 1] == ",":
+               index = json_whitespace.match(text, index + 1).end()
+         index += 1
+      else:
+         value, index = json_decoder.raw_decode(text, index)
+         if key == "status" and value != 200:
+            raise Exception("Monolith responded with status " + str(value))
+
+      index = json_whitespace.match(text, index).end()
+      if text[index:index + 1] == ",":
+         index = json_whitespace.match(text, index + 1).end()
+
+"""Documentation for a class.
+
+   Result of fetching a single node in Monolith.fetch_fleet.
+   `sensors` and `readings` hold what metric_fetch_sensors and
+   metric_fetch_range returned, `error` describes what went wrong
+   (None if both fetches worked)
+"""
+class FleetResult:
+   def __init__(self, node_id, sensors=None, readings=None, error=None):
+      self.node_id = node_id
+      self.sensors = sensors
+      self.readings = readings
+      self.error = error
+
+   def ok(self):
+      return self.error is None
 
 """Documentation for a class.
 
    Object to interact with a monolith
+
+   Requests are sent over a pool of at most `pool_size` keep-alive
+   connections, idle connections are dropped after `idle_timeout` seconds.
+   A Monolith object can be shared between threads
+
+   Registrar probes and fetches are served from `registrar_cache` when
+   one is given (see RegistrarCache), adding or deleting an entry
+   invalidates what is cached for its id
+
+   metric_fetch_range / _after / _before only request the parts of a query
+   that are not already held by `metric_cache` when one is given
+   (see MetricCache)
+
+   Timeouts, retries and the circuit breaker are set by `policy` (see
+   TransportPolicy). Without one requests are never retried and may
+   wait forever on an unresponsive monolith
+
+   Request latencies, counts, errors and encode / decode times are
+   recorded in `metrics` when one is given (see ClientMetrics)
 """
 class Monolith:
-   def __init__(self, ipv4_address):
+   def __init__(self, ipv4_address, pool_size=4, idle_timeout=30.0, registrar_cache=None, metric_cache=None, policy=None, metrics=None):
       if not isinstance(ipv4_address, IPV4Connection):
          raise Exception("Given address must be an IPV4Connection type")
+      if policy is not None and not isinstance(policy, TransportPolicy):
+         raise Exception("POLICY must be of type TransportPolicy")
       self.host = "http://" + ipv4_address.address + ":" + str(ipv4_address.port)
       self.server_thread = None
+      self.policy = policy
+      self.breaker = None if policy is None else policy.make_breaker()
+      self.pool = ConnectionPool(ipv4_address.address,
+                                 ipv4_address.port,
+                                 pool_size,
+                                 idle_timeout,
+                                 None if policy is None else policy.read_timeout,
+                                 None if policy is None else policy.connect_timeout)
+      if registrar_cache is not None and not isinstance(registrar_cache, RegistrarCache):
+         raise Exception("REGISTRAR CACHE must be of type RegistrarCache")
+      self.registrar_cache = registrar_cache
+      if metric_cache is not None and not isinstance(metric_cache, MetricCache):
+         raise Exception("METRIC CACHE must be of type MetricCache")
+      self.metric_cache = metric_cache
+      if metrics is not None and not isinstance(metrics, ClientMetrics):
+         raise Exception("METRICS must be of type ClientMetrics")
+      self.metrics = metrics
+
+   """Documentation for a method.
+
+      Close any pooled connections to the monolith
+   """
+   def close(self):
+      self.pool.close()
 
    """Documentation for a method.
 
@@ -22,16 +142,201 @@ class Monolith:
    def get_timestamp(self):
       return int(time())
 
+   """Documentation for a method.
+
+      Send a request to the monolith, applying the transport policy.
+      `idempotent` defaults to whether the endpoint is free of side
+      effects, only idempotent requests are retried
+      returns a FetchResult telling timeouts, refused connections and
+      HTTP errors apart
+   """
+   def request(self, endpoint, idempotent=None):
+      if idempotent is None:
+         idempotent = is_idempotent(endpoint)
+      retries = self.policy.retries if self.policy is not None and idempotent else 0
+      path = urllib.parse.quote(endpoint)
+      attempt = 0
+      while True:
+         if self.breaker is not None and not self.breaker.allow():
+            return FetchResult(error=ERROR_CIRCUIT_OPEN, detail="monolith is unhealthy", attempts=attempt)
+         attempt += 1
+         if self.metrics is not None:
+            started = perf_counter()
+         try:
+            status, body = self.pool.request(path, idempotent)
+            result = FetchResult(status, body, attempts=attempt)
+            if status < 200 or status >= 300:
+               result.error = ERROR_HTTP
+               result.detail = "HTTP " + str(status)
+         except Exception as error:
+            result = error_result(error, attempt)
+         if self.metrics is not None:
+            self.metrics.record_request(endpoint_family(endpoint),
+                                        perf_counter() - started,
+                                        len(self.pool.build_request(path)),
+                                        len(result.body) if result.body is not None else 0,
+                                        result.error)
+         if self.breaker is not None:
+            # Waiting on our own pool says nothing about the monolith
+            if result.error == ERROR_POOL_EXHAUSTED:
+               self.breaker.cancel()
+            else:
+               self.breaker.record(not result.is_transient())
+         if result.ok() or not result.is_transient() or attempt > retries:
+            return result
+         sleep(self.policy.retry_delay(attempt - 1))
+
    """Documentation for a method.
 
       Fetch a particular endpoing from monolith.
-      If a problem occurs, None will be returned
+      If a problem occurs, None will be returned, see request()
+      for the reason of failures
    """
    def fetch_endpoint(self, endpoint):
-      target_url = self.host +  urllib.parse.quote(endpoint)
-      try: return urllib.request.urlopen(target_url).read()
-      except:
+      result = self.request(endpoint)
+      if not result.ok():
          return None
+      return result.body
+
+   """Documentation for a method.
+
+      Fetch an endpoint whose response carries a "data" field
+      Returns None iff the command fails, the data if the
+      command worked, False otherwise
+   """
+   def fetch_data(self, endpoint):
+      response = self.fetch_endpoint(endpoint)
+      if response is None:
+         return None
+
+      decoded_response = self.decode(response, endpoint_family(endpoint))
+
+      if decoded_response["status"] == 200:
+         return decoded_response["data"]
+      return False
+
+   """Documentation for a method.
+
+      Fetch several endpoints from monolith, pipelined over a single
+      pooled connection. Returns a list with the body of each response,
+      or None for any endpoint that could not be fetched
+   """
+   def fetch_endpoints(self, endpoints):
+      return [result.body if result.ok() else None for result in self.request_endpoints(endpoints)]
+
+   """Documentation for a method.
+
+      Send several requests to the monolith, pipelined over a single
+      pooled connection. Requests are not retried
+      returns a FetchResult for each endpoint, see request()
+   """
+   def request_endpoints(self, endpoints):
+      paths = [urllib.parse.quote(endpoint) for endpoint in endpoints]
+      if self.breaker is not None and paths and not self.breaker.allow():
+         return [FetchResult(error=ERROR_CIRCUIT_OPEN, detail="monolith is unhealthy") for path in paths]
+      times = None
+      errors = [None] * len(paths)
+      if self.metrics is not None:
+         times = [None] * len(paths)
+         started = perf_counter()
+      pipelined = self.pool.pipeline(paths, times=times, errors=errors)
+      results = []
+      for response, error in zip(pipelined, errors):
+         if response is None:
+            if error is None:
+               results.append(FetchResult(error=ERROR_CONNECTION, detail="request was not answered", attempts=1))
+            else:
+               results.append(error_result(error, 1))
+            continue
+         result = FetchResult(response[0], response[1], attempts=1)
+         if response[0] < 200 or response[0] >= 300:
+            result.error = ERROR_HTTP
+            result.detail = "HTTP " + str(response[0])
+         results.append(result)
+      if self.metrics is not None:
+         self.record_pipeline(endpoints, paths, results, started, times)
+      if self.breaker is not None and paths:
+         sent = [result for result in results if result.error != ERROR_POOL_EXHAUSTED]
+         if sent:
+            self.breaker.record(not all(result.is_transient() for result in sent))
+         else:
+            self.breaker.cancel()
+      return results
+
+   """Documentation for a method.
+
+      Record the stats of each request of a pipelined batch that started
+      at `started`, given its FetchResult and the time its response was
+      read at (None for requests that failed)
+   """
+   def record_pipeline(self, endpoints, paths, results, started, times):
+      ended = perf_counter()
+      for endpoint, path, result, time_read in zip(endpoints, paths, results, times):
+         self.metrics.record_request(endpoint_family(endpoint),
+                                     (ended if time_read is None else time_read) - started,
+                                     len(self.pool.build_request(path)),
+                                     len(result.body) if result.body is not None else 0,
+                                     result.error)
+
+   """Documentation for a method.
+
+      Decode a json response, timing it if metrics are recorded
+   """
+   def decode(self, response, family):
+      if self.metrics is None:
+         return json.loads(response)
+      started = perf_counter()
+      decoded = json.loads(response)
+      self.metrics.record_decode(family, perf_counter() - started)
+      return decoded
+
+   """Documentation for a method.
+
+      Decode a metric_fetch response into a ReadingView, timing it if
+      metrics are recorded
+      returns the view, or False if the status is not 200
+   """
+   def decode_view(self, response):
+      started = perf_counter()
+      status, view = ReadingView.decode(response)
+      if self.metrics is not None:
+         self.metrics.record_decode("metric_fetch", perf_counter() - started)
+      return False if view is None else view
+
+   """Documentation for a method.
+
+      Wrap readings returned by the metric cache in a ReadingView
+   """
+   def cached_view(self, readings):
+      if readings is None or readings is False:
+         return readings
+      return ReadingView.from_decoded(readings)
+
+   """Documentation for a method.
+
+      Encode an object, timing it if metrics are recorded
+   """
+   def encode(self, item, family):
+      if self.metrics is None:
+         return item.encode()
+      started = perf_counter()
+      encoded = item.encode()
+      self.metrics.record_encode(family, perf_counter() - started)
+      return encoded
+
+   """Documentation for a method.
+
+      Interpret the response of a submission endpoint
+      Returns None iff the command failed,
+      True if the command worked, False otherwise
+   """
+   def submission_result(self, response, family="metric_submit"):
+      if response is None:
+         return None
+      try: decoded_response = self.decode(response, family)
+      except ValueError:
+         return False
+      return decoded_response["status"] == 200 and decoded_response["data"] == "success"
 
    """Documentation for a method.
 
@@ -56,7 +361,7 @@ class Monolith:
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "version")
 
       if decoded_response["status"] == 200:
          data = decoded_response["data"]
@@ -78,14 +383,16 @@ class Monolith:
       if not isinstance(node, NodeV1):
          raise Exception("NODE must be of type NodeV1")
 
-      encoded = node.encode()
+      encoded = self.encode(node, "registrar")
 
       response = self.fetch_endpoint("/registrar/add/" + node.id + "/" + encoded)
+      if self.registrar_cache is not None:
+         self.registrar_cache.invalidate(node.id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -102,14 +409,16 @@ class Monolith:
       if not isinstance(controller, ControllerV1):
          raise Exception("NODE must be of type controller")
 
-      encoded = controller.encode()
+      encoded = self.encode(controller, "registrar")
 
       response = self.fetch_endpoint("/registrar/add/" + controller.id + "/" + encoded)
+      if self.registrar_cache is not None:
+         self.registrar_cache.invalidate(controller.id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -126,16 +435,24 @@ class Monolith:
       if not isinstance(id, str):
          raise Exception("ID must be of type str")
 
+      if self.registrar_cache is not None:
+         cached = self.registrar_cache.get("probe", id)
+         if cached is not MISS:
+            return cached
+
       response = self.fetch_endpoint("/registrar/probe/" + id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
-      if decoded_response["status"] == 200 and decoded_response["data"] == "found":
-         return True
-      return False
+      definitive = decoded_response["status"] == 200 and decoded_response["data"] in ("found", "not found")
+      found = definitive and decoded_response["data"] == "found"
+      # Only cache answers from the registrar, not its errors
+      if self.registrar_cache is not None and definitive:
+         self.registrar_cache.put("probe", id, found, found)
+      return found
 
    """Documentation for a method.
 
@@ -147,23 +464,32 @@ class Monolith:
    def registrar_fetch_node(self, id):
       if not isinstance(id, str):
          raise Exception("ID must be of type string")
+
+      if self.registrar_cache is not None:
+         cached = self.registrar_cache.get("node", id)
+         if cached is not MISS:
+            return cached
       
       response = self.fetch_endpoint("/registrar/fetch/" + id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
       # A status indicates that the query worked but there was no node
       if "status" in decoded_response:
+         if self.registrar_cache is not None:
+            self.registrar_cache.put("node", id, None, False)
          return None
 
       # Attempt to convert the reponse into a node
       node = NodeV1("","")
-      if not node.decode_from(response):
+      if not node.load_decoded(decoded_response):
          raise Exception("Data from server did not match a V1 Node (is something on fire?)")
 
+      if self.registrar_cache is not None:
+         self.registrar_cache.put("node", id, node)
       return node
 
    """Documentation for a method.
@@ -176,23 +502,32 @@ class Monolith:
    def registrar_fetch_controller(self, id):
       if not isinstance(id, str):
          raise Exception("ID must be of type string")
+
+      if self.registrar_cache is not None:
+         cached = self.registrar_cache.get("controller", id)
+         if cached is not MISS:
+            return cached
       
       response = self.fetch_endpoint("/registrar/fetch/" + id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
       # A status indicates that the query worked but there was no node
       if "status" in decoded_response:
+         if self.registrar_cache is not None:
+            self.registrar_cache.put("controller", id, None, False)
          return None
 
       # Attempt to convert the reponse into a controller
       controller = ControllerV1("","",IPV4Connection("", 0))
-      if not controller.decode_from(response):
+      if not controller.load_decoded(decoded_response):
          raise Exception("Data from server did not match a V1 Controller (is something on fire?)")
 
+      if self.registrar_cache is not None:
+         self.registrar_cache.put("controller", id, controller)
       return controller
 
    """Documentation for a method.
@@ -211,11 +546,13 @@ class Monolith:
          raise Exception("ID must be of type string")
       
       response = self.fetch_endpoint("/registrar/delete/" + id)
+      if self.registrar_cache is not None:
+         self.registrar_cache.invalidate(id)
 
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "registrar")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -238,7 +575,7 @@ class Monolith:
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_stream")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -261,7 +598,7 @@ class Monolith:
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_stream")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -277,18 +614,35 @@ class Monolith:
       if not isinstance(reading, ReadingV1):
          raise Exception("READING must be of type ReadingV1")
 
-      encoded_reading = reading.encode()
+      encoded_reading = self.encode(reading, "metric_submit")
 
       response = self.fetch_endpoint("/metric/submit/" + encoded_reading)
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_submit")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
       return False
 
+   """Documentation for a method.
+
+      Submit several readings in one go. The readings are pipelined over
+      a single connection rather than waiting a round trip for each one
+      Returns a list with the result of each reading, in order:
+      None iff submitting that reading failed,
+      True if it worked, False otherwise
+   """
+   def metric_submit_readings(self, readings):
+      endpoints = []
+      for reading in readings:
+         if not isinstance(reading, ReadingV1):
+            raise Exception("READING must be of type ReadingV1")
+         endpoints.append("/metric/submit/" + self.encode(reading, "metric_submit"))
+
+      return [self.submission_result(response) for response in self.fetch_endpoints(endpoints)]
+
    """Documentation for a method.
 
       Submit a heartbeat for a node 
@@ -299,13 +653,13 @@ class Monolith:
       if not isinstance(heartbeat, HeartbeatV1):
          raise Exception("HEARTBEAT must be of type HeartbeatV1")
          
-      encoded_heartbeat = heartbeat.encode()
+      encoded_heartbeat = self.encode(heartbeat, "metric_heartbeat")
 
       response = self.fetch_endpoint("/metric/heartbeat/" + encoded_heartbeat)
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_heartbeat")
 
       if decoded_response["status"] == 200 and decoded_response["data"] == "success":
          return True
@@ -324,7 +678,7 @@ class Monolith:
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_fetch")
 
       if decoded_response["status"] == 200:
          return decoded_response["data"]
@@ -347,7 +701,7 @@ class Monolith:
       if response is None:
          return None
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_fetch")
 
       if decoded_response["status"] == 200:
          return decoded_response["data"]
@@ -356,10 +710,12 @@ class Monolith:
    """Documentation for a method.
 
       Fetch a metrics from a specified range of time
+      With `as_view` the readings are returned as a ReadingView
+      rather than a list of dicts
       Returns None iff the command fails,
       True if the command worked, False otherwise
    """
-   def metric_fetch_range(self, node_id, start, end):
+   def metric_fetch_range(self, node_id, start, end, as_view=False):
       if not isinstance(node_id, str):
          raise Exception("NODE ID must be of type string")
       if not isinstance(start, int):
@@ -371,6 +727,10 @@ class Monolith:
       if start == end:
          raise Exception("Start and end can not be the same")
 
+      if self.metric_cache is not None:
+         readings = self.metric_cache.query(self, node_id, start + 1, end - 1)
+         return self.cached_view(readings) if as_view else readings
+
       s_start = str(start)
       s_end = str(end)
       response = self.fetch_endpoint("/metric/fetch/" + 
@@ -381,20 +741,150 @@ class Monolith:
                                      s_end)
       if response is None:
          return None
+      if as_view:
+         return self.decode_view(response)
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_fetch")
 
       if decoded_response["status"] == 200:
          return decoded_response["data"]
       return False
 
+   """Documentation for a method.
+
+      Iterate over the metrics of a node in a range of time without
+      holding the whole range in memory. The range is split into
+      sub-ranges spanning `window` seconds that are fetched one after
+      another, with up to `prefetch` of them fetched ahead in the
+      background while earlier ones are consumed. Each response is
+      decoded element by element into a ReadingBlock.
+
+      Like metric_fetch_range, neither `start` nor `end` are included.
+      Yields ReadingV1 objects in timestamp order, or one ReadingBlock
+      per sub-range if `as_blocks` is set.
+      Raises if a sub-range can not be fetched
+   """
+   def iter_metric_range(self, node_id, start, end, window=3600, prefetch=1, as_blocks=False):
+      if not isinstance(node_id, str):
+         raise Exception("NODE ID must be of type string")
+      if not isinstance(start, int):
+         raise Exception("START must be of type int")
+      if not isinstance(end, int):
+         raise Exception("END must be of type int")
+      if start >= end:
+         raise Exception("Start must be before end")
+      if not isinstance(window, int) or window < 1:
+         raise Exception("WINDOW must be an int greater than 0")
+      if not isinstance(prefetch, int) or prefetch < 0:
+         raise Exception("PREFETCH must be a non-negative int")
+
+      # Sub-ranges cover [low, high] and are requested as (low - 1, high + 1)
+      # so that together they cover exactly (start, end)
+      windows = [(low, min(low + window - 1, end - 1)) for low in range(start + 1, end, window)]
+      blocks = self.iter_metric_windows(node_id, windows, prefetch)
+      if as_blocks:
+         return blocks
+      return (reading for block in blocks for reading in block)
+
+   def iter_metric_windows(self, node_id, windows, prefetch):
+      def fetch(low, high):
+         response = self.fetch_endpoint("/metric/fetch/" +
+                                        node_id +
+                                        "/range/" +
+                                        str(low - 1) +
+                                        "/" +
+                                        str(high + 1))
+         if response is None:
+            raise Exception("Failed to fetch metrics from " + str(low) + " to " + str(high))
+         if self.metrics is None:
+            return ReadingBlock.from_decoded(iter_response_data(response)).sorted()
+         started = perf_counter()
+         block = ReadingBlock.from_decoded(iter_response_data(response)).sorted()
+         self.metrics.record_decode("metric_fetch", perf_counter() - started)
+         return block
+
+      if prefetch == 0:
+         for low, high in windows:
+            yield fetch(low, high)
+         return
+
+      with ThreadPoolExecutor(max_workers=prefetch) as executor:
+         pending = []
+         remaining = iter(windows)
+         try:
+            for low, high in remaining:
+               pending.append(executor.submit(fetch, low, high))
+               if len(pending) > prefetch:
+                  yield pending.pop(0).result()
+            while pending:
+               yield pending.pop(0).result()
+         finally:
+            for future in pending:
+               future.cancel()
+
+   """Documentation for a method.
+
+      Fetch the sensors and the metrics in a range of time for many nodes
+      concurrently, on at most `max_workers` threads (by default the size
+      of the connection pool) sharing the pooled connections.
+      If `nodes` is not given every node from metric_fetch_nodes is fetched.
+
+      Returns an iterator yielding a FleetResult per node as soon as it
+      completes. A node that fails does not affect the others, its result
+      carries the error.
+      Raises right away if the arguments are invalid or the list of
+      nodes can not be fetched
+   """
+   def fetch_fleet(self, start, end, nodes=None, max_workers=None):
+      if not isinstance(start, int):
+         raise Exception("START must be of type int")
+      if not isinstance(end, int):
+         raise Exception("END must be of type int")
+      if start > end:
+         raise Exception("Start must not be after end")
+      if start == end:
+         raise Exception("Start and end can not be the same")
+      if nodes is None:
+         nodes = self.metric_fetch_nodes()
+         if nodes is None or nodes is False:
+            raise Exception("Failed to fetch the list of nodes")
+      if max_workers is None:
+         max_workers = self.pool.size
+      if not isinstance(max_workers, int) or max_workers < 1:
+         raise Exception("MAX WORKERS must be an int greater than 0")
+      return self.iter_fleet(start, end, nodes, max_workers)
+
+   def iter_fleet(self, start, end, nodes, max_workers):
+      def fetch(node_id):
+         try:
+            sensors = self.metric_fetch_sensors(node_id)
+            if sensors is None or sensors is False:
+               return FleetResult(node_id, error="Failed to fetch sensors")
+            readings = self.metric_fetch_range(node_id, start, end)
+            if readings is None or readings is False:
+               return FleetResult(node_id, sensors, error="Failed to fetch readings")
+            return FleetResult(node_id, sensors, readings)
+         except Exception as error:
+            return FleetResult(node_id, error=str(error))
+
+      with ThreadPoolExecutor(max_workers=max_workers) as executor:
+         futures = [executor.submit(fetch, node_id) for node_id in nodes]
+         try:
+            for future in as_completed(futures):
+               yield future.result()
+         finally:
+            for future in futures:
+               future.cancel()
+
    """Documentation for a method.
 
       Fetch a metrics after a specified time
+      With `as_view` the readings are returned as a ReadingView
+      rather than a list of dicts
       Returns None iff the command fails,
       True if the command worked, False otherwise
    """
-   def metric_fetch_after(self, node_id, time):
+   def metric_fetch_after(self, node_id, time, as_view=False):
       if not isinstance(node_id, str):
          raise Exception("NODE ID must be of type string")
       if not isinstance(time, int):
@@ -402,6 +892,10 @@ class Monolith:
       if time > self.get_timestamp():
          raise Exception("Given time exceeds current time (The future) ")
 
+      if self.metric_cache is not None:
+         readings = self.metric_cache.query(self, node_id, time + 1, inf)
+         return self.cached_view(readings) if as_view else readings
+
       s_time = str(time)
       response = self.fetch_endpoint("/metric/fetch/" + 
                                      node_id +
@@ -409,8 +903,10 @@ class Monolith:
                                      s_time)
       if response is None:
          return None
+      if as_view:
+         return self.decode_view(response)
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_fetch")
 
       if decoded_response["status"] == 200:
          return decoded_response["data"]
@@ -419,10 +915,12 @@ class Monolith:
    """Documentation for a method.
 
       Fetch a metrics after a specified time
+      With `as_view` the readings are returned as a ReadingView
+      rather than a list of dicts
       Returns None iff the command fails,
       True if the command worked, False otherwise
    """
-   def metric_fetch_before(self, node_id, time):
+   def metric_fetch_before(self, node_id, time, as_view=False):
       if not isinstance(node_id, str):
          raise Exception("NODE ID must be of type string")
       if not isinstance(time, int):
@@ -430,6 +928,10 @@ class Monolith:
       if time > self.get_timestamp():
          raise Exception("Given time exceeds current time (The future) ")
 
+      if self.metric_cache is not None:
+         readings = self.metric_cache.query(self, node_id, -inf, time - 1)
+         return self.cached_view(readings) if as_view else readings
+
       s_time = str(time)
       response = self.fetch_endpoint("/metric/fetch/" + 
                                      node_id +
@@ -437,8 +939,10 @@ class Monolith:
                                      s_time)
       if response is None:
          return None
+      if as_view:
+         return self.decode_view(response)
 
-      decoded_response = json.loads(response)
+      decoded_response = self.decode(response, "metric_fetch")
 
       if decoded_response["status"] == 200:
          return decoded_response["data"]
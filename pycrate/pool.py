@@ -0,0 +1,284 @@
+import socket
+import select
+import threading
+import http.client
+from time import monotonic, perf_counter
+from collections import deque
+from .transport import PoolExhaustedError
+
+"""Documentation for a class.
+
+   Lets http.client parse several responses, one after another,
+   from the same buffered socket reader. http.client closes the
+   file it reads from once a response is complete, which would
+   otherwise tear down the keep-alive connection
+"""
+class _ResponseSource:
+   def __init__(self, reader):
+      self.reader = reader
+
+   def makefile(self, mode, *args, **kwargs):
+      return self
+
+   def close(self):
+      pass
+
+   def __getattr__(self, name):
+      return getattr(self.reader, name)
+
+"""Documentation for a class.
+
+   A single keep-alive HTTP/1.1 connection owned by a ConnectionPool
+"""
+class PooledConnection:
+   def __init__(self, address, port, timeout=None, connect_timeout=None):
+      self.sock = socket.create_connection((address, port), timeout if connect_timeout is None else connect_timeout)
+      self.sock.settimeout(timeout)
+      self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      self.reader = self.sock.makefile("rb")
+      self.source = _ResponseSource(self.reader)
+      self.last_used = monotonic()
+      self.used = False
+      self.closed = False
+
+   """Documentation for a method.
+
+      Write one or more encoded requests to the connection
+   """
+   def send(self, data):
+      self.used = True
+      self.sock.sendall(data)
+
+   """Documentation for a method.
+
+      Read the next response off of the connection
+      returns a (status, body) tuple
+   """
+   def read_response(self):
+      response = http.client.HTTPResponse(self.source)
+      response.begin()
+      body = response.read()
+      if response.will_close:
+         self.close()
+      return response.status, body
+
+   """Documentation for a method.
+
+      Check if the server has closed (or written unexpected data to)
+      an idle connection. Either way it can not be reused
+   """
+   def is_dropped(self):
+      if self.closed:
+         return True
+      try:
+         readable, _, _ = select.select([self.sock], [], [], 0)
+      except (OSError, ValueError):
+         return True
+      return len(readable) > 0
+
+   def close(self):
+      if self.closed:
+         return
+      self.closed = True
+      try:
+         self.reader.close()
+         self.sock.close()
+      except OSError:
+         pass
+
+"""Documentation for a class.
+
+   Bounded, thread safe pool of keep-alive connections to a single host.
+   Idle connections are reused most-recently-used first and are dropped
+   once they have been idle for longer than idle_timeout seconds.
+   `timeout` bounds each read from a connection and `connect_timeout`
+   waiting for a free connection and opening one (`timeout` is used for
+   both if it is not given)
+"""
+class ConnectionPool:
+   def __init__(self, address, port, size=4, idle_timeout=30.0, timeout=None, connect_timeout=None):
+      if not isinstance(size, int) or size < 1:
+         raise Exception("SIZE must be an int greater than 0")
+      if not isinstance(idle_timeout, (int, float)) or idle_timeout < 0:
+         raise Exception("IDLE TIMEOUT must be a non-negative number")
+
+      self.address = address
+      self.port = port
+      self.size = size
+      self.idle_timeout = idle_timeout
+      self.timeout = timeout
+      self.connect_timeout = connect_timeout
+      self.host_header = address + ":" + str(port)
+      self.idle = deque()
+      self.lock = threading.Lock()
+      self.slots = threading.BoundedSemaphore(size)
+      self.closed = False
+
+   """Documentation for a method.
+
+      Encode a GET request for the given (already quoted) path
+   """
+   def build_request(self, path):
+      return ("GET " + path + " HTTP/1.1\r\n"
+              "Host: " + self.host_header + "\r\n"
+              "Connection: keep-alive\r\n"
+              "Accept-Encoding: identity\r\n"
+              "\r\n").encode("ascii")
+
+   """Documentation for a method.
+
+      Take a connection from the pool, opening a new one if there
+      are no usable idle connections. Blocks while all `size`
+      connections are in use, raises PoolExhaustedError if none is
+      freed within the connect timeout
+   """
+   def acquire(self):
+      if self.closed:
+         raise Exception("Connection pool is closed")
+
+      timeout = self.timeout if self.connect_timeout is None else self.connect_timeout
+      if not self.slots.acquire(timeout=timeout):
+         raise PoolExhaustedError("Timed out waiting for a pooled connection")
+      try:
+         now = monotonic()
+         discarded = []
+         conn = None
+         with self.lock:
+            while self.idle:
+               candidate = self.idle.pop()
+               if now - candidate.last_used > self.idle_timeout:
+                  discarded.append(candidate)
+                  continue
+               conn = candidate
+               break
+         for stale in discarded:
+            stale.close()
+         if conn is not None and conn.is_dropped():
+            conn.close()
+            conn = None
+         if conn is None:
+            conn = PooledConnection(self.address, self.port, self.timeout, self.connect_timeout)
+         return conn
+      except BaseException:
+         self.slots.release()
+         raise
+
+   """Documentation for a method.
+
+      Return a connection to the pool. Connections that are not
+      reusable (errors, server asked to close) are closed instead
+   """
+   def release(self, conn, reusable=True):
+      try:
+         if reusable and not conn.closed and not self.closed:
+            conn.last_used = monotonic()
+            with self.lock:
+               self.idle.append(conn)
+         else:
+            conn.close()
+      finally:
+         self.slots.release()
+
+   """Documentation for a method.
+
+      Perform a GET on the given path
+      returns a (status, body) tuple, raises on connection errors.
+      If a reused connection turns out to have been closed by the
+      server the request is sent again on a new connection, unless
+      `retry` is False: the server may have acted on a request it
+      closed the connection after, so requests that change state
+      should not be sent twice
+   """
+   def request(self, path, retry=True):
+      data = self.build_request(path)
+      while True:
+         conn = self.acquire()
+         reused = conn.used
+         try:
+            conn.send(data)
+            status, body = conn.read_response()
+         except (ConnectionError, http.client.BadStatusLine):
+            self.release(conn, False)
+            if not reused or not retry:
+               raise
+            continue
+         except BaseException:
+            self.release(conn, False)
+            raise
+         self.release(conn, True)
+         return status, body
+
+   """Documentation for a method.
+
+      Perform a GET on each of the given paths, pipelining up to `depth`
+      requests at a time on a single connection so a batch costs a
+      handful of round trips rather than one per request.
+      returns a list of (status, body) tuples in request order, with None
+      in place of any request that could not be completed. If `times` is
+      a list of the same length, the perf_counter() time each response
+      was read at is stored in it, and if `errors` is, the exception each
+      request that could not be completed was given up with.
+
+      If the connection fails part way through, the requests that were
+      written to it but not answered are given up on (None), as the
+      server may have acted on them, and the requests that were never
+      written are sent on a new connection. The batch is abandoned if
+      that happens twice in a row without any response being read
+   """
+   def pipeline(self, paths, depth=32, times=None, errors=None):
+      results = [None] * len(paths)
+      done = 0
+      failed_attempts = 0
+      error = None
+      while done < len(paths):
+         try:
+            conn = self.acquire()
+         except Exception as acquire_error:
+            error = acquire_error
+            break
+         progress = done
+         sent = done
+         try:
+            while done < len(paths) and not conn.closed:
+               window = paths[done:done + depth]
+               sent = done + len(window)
+               conn.send(b"".join(self.build_request(path) for path in window))
+               for _ in window:
+                  results[done] = conn.read_response()
+                  if times is not None:
+                     times[done] = perf_counter()
+                  done += 1
+                  if conn.closed:
+                     break
+         except Exception as send_error:
+            self.release(conn, False)
+            error = send_error
+            answered = done > progress
+            if errors is not None:
+               errors[done:sent] = [error] * (sent - done)
+            done = sent
+            if answered:
+               failed_attempts = 0
+               continue
+            failed_attempts += 1
+            if failed_attempts > 1:
+               break
+            continue
+         self.release(conn, True)
+         failed_attempts = 0
+      if errors is not None and done < len(paths):
+         errors[done:] = [error] * (len(paths) - done)
+      return results
+
+   """Documentation for a method.
+
+      Close all idle connections. Connections currently in use
+      are closed as they are released
+   """
+   def close(self):
+      self.closed = True
+      with self.lock:
+         idle = list(self.idle)
+         self.idle.clear()
+      for conn in idle:
+         conn.close()
@@ -0,0 +1,296 @@
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from operator import le
+from .types import ReadingV1, StreamV1, json_source, split_json, decode_json
+
+"""Documentation for a class.
+
+   Columnar container for a large set of readings. Timestamps are held in
+   an array('q'), values in an array('d'), and node / sensor ids are
+   dictionary encoded into array('l') codes indexing `node_ids` and
+   `sensor_ids`.
+
+   The columns support the buffer protocol, so with NumPy installed
+   numpy.frombuffer(block.values) is a zero-copy view of the values
+"""
+class ReadingBlock:
+   def __init__(self):
+      self.timestamps = array("q")
+      self.values = array("d")
+      self.node_codes = array("l")
+      self.sensor_codes = array("l")
+      self.node_ids = []
+      self.sensor_ids = []
+      self.node_index = {}
+      self.sensor_index = {}
+      self.is_sorted = True
+
+   def __len__(self):
+      return len(self.timestamps)
+
+   """Documentation for a method.
+
+      Get the code for an id, adding it to the dictionary if it is new
+   """
+   def node_code(self, node_id):
+      code = self.node_index.get(node_id)
+      if code is None:
+         code = len(self.node_ids)
+         self.node_ids.append(node_id)
+         self.node_index[node_id] = code
+      return code
+
+   def sensor_code(self, sensor_id):
+      code = self.sensor_index.get(sensor_id)
+      if code is None:
+         code = len(self.sensor_ids)
+         self.sensor_ids.append(sensor_id)
+         self.sensor_index[sensor_id] = code
+      return code
+
+   """Documentation for a method.
+
+      Append a single reading's fields to the block
+   """
+   def append(self, timestamp, node_id, sensor_id, value):
+      if self.is_sorted and self.timestamps and timestamp < self.timestamps[-1]:
+         self.is_sorted = False
+      self.timestamps.append(timestamp)
+      self.values.append(value)
+      self.node_codes.append(self.node_code(node_id))
+      self.sensor_codes.append(self.sensor_code(sensor_id))
+
+   """Documentation for a method.
+
+      Append ReadingV1 objects to the block
+   """
+   def extend(self, readings):
+      for reading in readings:
+         self.append(reading.timestamp, reading.node_id, reading.sensor_id, reading.value)
+
+   """Documentation for a method.
+
+      Append decoded json readings, as returned by the metric_fetch_*
+      methods of Monolith, to the block
+   """
+   def extend_decoded(self, decoded_readings):
+      for reading in decoded_readings:
+         self.append(reading["timestamp"], reading["node_id"], reading["sensor_id"], float(reading["value"]))
+
+   """Documentation for a method.
+
+      Append columns of raw reading fields, as split up by
+      types.split_readings, to the block. Raises ValueError, leaving
+      the block as it was, if a field is not a number
+   """
+   def extend_columns(self, columns):
+      timestamps, node_ids, sensor_ids, values = columns
+      if not timestamps:
+         return
+      timestamps = array("q", map(int, timestamps))
+      values = array("d", map(float, values))
+      if self.is_sorted:
+         self.is_sorted = ((not self.timestamps or self.timestamps[-1] <= timestamps[0]) and
+                           all(map(le, timestamps, timestamps[1:])))
+      self.timestamps.extend(timestamps)
+      self.values.extend(values)
+      node_codes = {raw: self.node_code(raw.decode("utf-8")) for raw in dict.fromkeys(node_ids)}
+      sensor_codes = {raw: self.sensor_code(raw.decode("utf-8")) for raw in dict.fromkeys(sensor_ids)}
+      self.node_codes.extend(map(node_codes.__getitem__, node_ids))
+      self.sensor_codes.extend(map(sensor_codes.__getitem__, sensor_ids))
+
+   """Documentation for a method.
+
+      Append the readings of encoded json to the block without building
+      an object per reading. The data (str, bytes, bytearray or
+      memoryview) is an array of readings, a stream, or a metric_fetch
+      response from the monolith
+   """
+   def extend_json(self, data):
+      data = json_source(data)
+      columns = split_json(data)
+      if columns is not None:
+         try:
+            self.extend_columns(columns)
+            return
+         except ValueError:
+            pass
+
+      status, decoded = decode_json(data)
+      if decoded is None:
+         raise Exception("Response status is " + str(status))
+      self.extend_decoded(decoded)
+
+   """Documentation for a method.
+
+      Build a block from encoded json, see extend_json
+   """
+   @classmethod
+   def from_json(cls, data):
+      block = cls()
+      block.extend_json(data)
+      return block
+
+   """Documentation for a method.
+
+      Build a block from ReadingV1 objects
+   """
+   @classmethod
+   def from_readings(cls, readings):
+      block = cls()
+      block.extend(readings)
+      return block
+
+   """Documentation for a method.
+
+      Build a block from decoded json readings
+   """
+   @classmethod
+   def from_decoded(cls, decoded_readings):
+      block = cls()
+      block.extend_decoded(decoded_readings)
+      return block
+
+   """Documentation for a method.
+
+      Build a block holding the readings of a stream
+   """
+   @classmethod
+   def from_stream(cls, stream):
+      if not isinstance(stream, StreamV1):
+         raise Exception("STREAM must be of type StreamV1")
+      return cls.from_readings(stream.readings)
+
+   """Documentation for a method.
+
+      Get the reading at the given position as a ReadingV1
+   """
+   def reading(self, index):
+      return ReadingV1(self.timestamps[index],
+                       self.node_ids[self.node_codes[index]],
+                       self.sensor_ids[self.sensor_codes[index]],
+                       self.values[index])
+
+   def __iter__(self):
+      for index in range(0, len(self.timestamps)):
+         yield self.reading(index)
+
+   """Documentation for a method.
+
+      Convert the block to a stream
+   """
+   def to_stream(self, timestamp, sequence):
+      stream = StreamV1(timestamp, sequence)
+      stream.readings = list(self)
+      return stream
+
+   """Documentation for a method.
+
+      Get the positions of the readings matching every given condition.
+      `start` is inclusive and `end` exclusive, ids that are not in the
+      block match nothing
+      returns an array('l') of positions
+   """
+   def select(self, start=None, end=None, node_id=None, sensor_id=None):
+      timestamps = self.timestamps
+      if start is None and end is None:
+         indices = range(0, len(timestamps))
+      elif self.is_sorted:
+         low = 0 if start is None else bisect_left(timestamps, start)
+         high = len(timestamps) if end is None else bisect_left(timestamps, end)
+         indices = range(low, max(low, high))
+      else:
+         indices = [i for i, timestamp in enumerate(timestamps)
+                    if (start is None or timestamp >= start) and (end is None or timestamp < end)]
+
+      filters = []
+      if node_id is not None:
+         filters.append((self.node_codes, self.node_index.get(node_id, -1)))
+      if sensor_id is not None:
+         filters.append((self.sensor_codes, self.sensor_index.get(sensor_id, -1)))
+      for codes, code in filters:
+         if isinstance(indices, range):
+            indices = list(compress(indices, map(code.__eq__, codes[indices.start:indices.stop])))
+         else:
+            indices = [i for i in indices if codes[i] == code]
+      return array("l", indices)
+
+   """Documentation for a method.
+
+      Build a new block holding the readings at the given positions,
+      in the order they are given
+   """
+   def take(self, indices):
+      block = ReadingBlock()
+      block.node_ids = list(self.node_ids)
+      block.sensor_ids = list(self.sensor_ids)
+      block.node_index = dict(self.node_index)
+      block.sensor_index = dict(self.sensor_index)
+      block.timestamps = array("q", [self.timestamps[i] for i in indices])
+      block.is_sorted = all(map(le, block.timestamps, block.timestamps[1:]))
+      block.values = array("d", [self.values[i] for i in indices])
+      block.node_codes = array("l", [self.node_codes[i] for i in indices])
+      block.sensor_codes = array("l", [self.sensor_codes[i] for i in indices])
+      return block
+
+   """Documentation for a method.
+
+      Get the block ordered by timestamp
+      returns the block itself if it is already in order
+   """
+   def sorted(self):
+      if self.is_sorted:
+         return self
+      block = self.take(sorted(range(0, len(self.timestamps)), key=self.timestamps.__getitem__))
+      block.is_sorted = True
+      return block
+
+   """Documentation for a method.
+
+      Build a new block holding only the readings matching the filter,
+      see select() for the conditions
+   """
+   def filter(self, start=None, end=None, node_id=None, sensor_id=None):
+      return self.take(self.select(start, end, node_id, sensor_id))
+
+   def filtered_values(self, start, end, node_id, sensor_id):
+      if start is None and end is None and node_id is None and sensor_id is None:
+         return self.values
+      values = self.values
+      return [values[i] for i in self.select(start, end, node_id, sensor_id)]
+
+   """Documentation for a method.
+
+      Aggregations over the values, optionally filtered as in select()
+      Return None when no readings match
+   """
+   def min(self, start=None, end=None, node_id=None, sensor_id=None):
+      values = self.filtered_values(start, end, node_id, sensor_id)
+      return min(values) if len(values) else None
+
+   def max(self, start=None, end=None, node_id=None, sensor_id=None):
+      values = self.filtered_values(start, end, node_id, sensor_id)
+      return max(values) if len(values) else None
+
+   def sum(self, start=None, end=None, node_id=None, sensor_id=None):
+      values = self.filtered_values(start, end, node_id, sensor_id)
+      return sum(values) if len(values) else None
+
+   def mean(self, start=None, end=None, node_id=None, sensor_id=None):
+      values = self.filtered_values(start, end, node_id, sensor_id)
+      return sum(values) / len(values) if len(values) else None
+
+   """Documentation for a method.
+
+      Get zero-copy NumPy views of the columns
+      returns a dict of arrays, raises if NumPy is not installed
+   """
+   def to_numpy(self):
+      import numpy
+      return {
+         "timestamps": numpy.frombuffer(self.timestamps, dtype=numpy.int64),
+         "values": numpy.frombuffer(self.values, dtype=numpy.float64),
+         "node_codes": numpy.frombuffer(self.node_codes, dtype="l"),
+         "sensor_codes": numpy.frombuffer(self.sensor_codes, dtype="l"),
+      }
@@ -0,0 +1,130 @@
+from array import array
+from collections.abc import Sequence
+from .types import ReadingV1, json_source, split_json, decode_json
+
+"""Documentation for a class.
+
+   Read-only sequence of the readings of a metric_fetch response that
+   builds a ReadingV1 only when an element is accessed. Timestamps and
+   values are parsed into an array('q') and an array('d') up front, so
+   `timestamps` and `values` give whole columns without building any
+   objects, while node and sensor ids are kept as they were received
+   and decoded on access, each distinct id once.
+
+   Supports len(), indexing and slicing (a slice is another view).
+   Readings built on access are new objects every time, so changing one
+   does not change the view
+"""
+class ReadingView(Sequence):
+   def __init__(self, timestamps, values, node_ids, sensor_ids, strings=None):
+      self.timestamps = timestamps
+      self.values = values
+      self.node_ids = node_ids
+      self.sensor_ids = sensor_ids
+      self.strings = {} if strings is None else strings
+
+   """Documentation for a method.
+
+      Build a view from columns of raw reading fields, as split up by
+      types.split_readings. Raises ValueError if a field is not a number
+   """
+   @classmethod
+   def from_columns(cls, columns):
+      timestamps, node_ids, sensor_ids, values = columns
+      return cls(array("q", map(int, timestamps)), array("d", map(float, values)), node_ids, sensor_ids)
+
+   """Documentation for a method.
+
+      Build a view from decoded json readings
+   """
+   @classmethod
+   def from_decoded(cls, decoded_readings):
+      return cls(array("q", [reading["timestamp"] for reading in decoded_readings]),
+                 array("d", [reading["value"] for reading in decoded_readings]),
+                 [reading["node_id"] for reading in decoded_readings],
+                 [reading["sensor_id"] for reading in decoded_readings])
+
+   """Documentation for a method.
+
+      Build a view from encoded json (str, bytes, bytearray or
+      memoryview): an array of readings, a stream or a metric_fetch
+      response from the monolith
+      returns (status, view) where status is None if the data is not a
+      response, and view is None if the status is not 200
+   """
+   @classmethod
+   def decode(cls, data):
+      data = json_source(data)
+      columns = split_json(data)
+      if columns is not None:
+         status = 200 if bytes(data[0:9]) == b'{"status"' else None
+         try: return status, cls.from_columns(columns)
+         except ValueError:
+            pass
+      status, decoded = decode_json(data)
+      if decoded is None:
+         return status, None
+      return status, cls.from_decoded(decoded)
+
+   """Documentation for a method.
+
+      Build a view from encoded json, see decode
+      Raises if the data is a response with a status other than 200
+   """
+   @classmethod
+   def from_json(cls, data):
+      status, view = cls.decode(data)
+      if view is None:
+         raise Exception("Response status is " + str(status))
+      return view
+
+   def __len__(self):
+      return len(self.timestamps)
+
+   def __getitem__(self, index):
+      if isinstance(index, slice):
+         return ReadingView(self.timestamps[index], self.values[index],
+                            self.node_ids[index], self.sensor_ids[index], self.strings)
+      reading = object.__new__(ReadingV1)
+      reading.timestamp = self.timestamps[index]
+      reading.node_id = self.text(self.node_ids[index])
+      reading.sensor_id = self.text(self.sensor_ids[index])
+      reading.value = self.values[index]
+      return reading
+
+   def __iter__(self):
+      for index in range(0, len(self.timestamps)):
+         yield self[index]
+
+   """Documentation for a method.
+
+      Get an id as a string, decoding ids received as bytes once
+   """
+   def text(self, raw):
+      if isinstance(raw, str):
+         return raw
+      text = self.strings.get(raw)
+      if text is None:
+         text = self.strings[raw] = raw.decode("utf-8")
+      return text
+
+   """Documentation for a method.
+
+      Get the ids of the nodes of all readings, in order
+   """
+   def node_id_list(self):
+      return [self.text(raw) for raw in self.node_ids]
+
+   def sensor_id_list(self):
+      return [self.text(raw) for raw in self.sensor_ids]
+
+   """Documentation for a method.
+
+      Build every reading at once
+      returns a list of ReadingV1
+   """
+   def materialize(self):
+      return list(self)
+
+   def __repr__(self):
+      return "ReadingView(" + str(len(self)) + " readings)"
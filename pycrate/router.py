@@ -0,0 +1,200 @@
+import threading
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from .types import ControllerV1
+
+EXECUTE_INLINE = "inline"
+EXECUTE_THREAD = "thread"
+EXECUTE_PROCESS = "process"
+
+"""Documentation for a class.
+
+   A handler registered with an ActionRouter
+"""
+class Route:
+   __slots__ = ("handler", "execution")
+
+   def __init__(self, handler, execution):
+      self.handler = handler
+      self.execution = execution
+
+"""Documentation for a class.
+
+   Routes the actions received by a ControlServer to handlers registered
+   for a (controller_id, action_id) pair, either of which may be left
+   out (None) to match any id. A lookup tries the exact pair, then the
+   action on any controller, then any action of the controller and
+   finally the catch-all route. Resolved pairs are kept in an index, so
+   routing an action costs a single dict lookup once its pair was seen.
+
+   Each route has an execution class:
+      EXECUTE_INLINE   on the network thread, for handlers that return
+                       right away. A slow inline handler stalls every
+                       connection of the loop
+      EXECUTE_THREAD   on the server's worker threads (the default), the
+                       only class the overload policies of ActionWorkers
+                       (coalesce, max_age, high_water) apply to
+      EXECUTE_PROCESS  on a pool of `process_workers` processes, for CPU
+                       heavy handlers. The handler and actions must be
+                       picklable, and at most `process_queue_size` actions
+                       are waiting on the pool before the server pushes
+                       back on its connections
+
+   Once a controller is registered with allow, the router only takes
+   actions whose ids appear in the ControllerV1.actions of their
+   controller, and rejects every action of controllers that were never
+   allowed. Rejected actions are dropped before they are queued. Pass
+   the router as the callback_fn of a ControlServer
+"""
+class ActionRouter:
+   max_index_size = 65536
+
+   def __init__(self, process_workers=None, process_queue_size=1024):
+      if not isinstance(process_queue_size, int) or process_queue_size < 1:
+         raise Exception("PROCESS QUEUE SIZE must be an int greater than 0")
+      self.process_workers = process_workers
+      self.process_queue_size = process_queue_size
+      self.routes = {}
+      self.index = {}
+      self.allowed = {}
+      self.executor = None
+      self.process_pending = 0
+      self.lock = threading.Lock()
+
+   """Documentation for a method.
+
+      Register a handler for an action id of a controller. Registering
+      the same pair again replaces its handler
+   """
+   def route(self, handler, controller_id=None, action_id=None, execution=EXECUTE_THREAD):
+      if not callable(handler):
+         raise Exception("HANDLER must be callable")
+      for name, id in (("CONTROLLER ID", controller_id), ("ACTION ID", action_id)):
+         if id is not None and not isinstance(id, str):
+            raise Exception(name + " must be a string or None")
+      if execution not in (EXECUTE_INLINE, EXECUTE_THREAD, EXECUTE_PROCESS):
+         raise Exception("EXECUTION must be EXECUTE_INLINE, EXECUTE_THREAD or EXECUTE_PROCESS")
+      with self.lock:
+         self.routes[(controller_id, action_id)] = Route(handler, execution)
+         self.index = {}
+
+   """Documentation for a method.
+
+      Remove the handler of a pair
+      returns False if there was none
+   """
+   def unroute(self, controller_id=None, action_id=None):
+      with self.lock:
+         if self.routes.pop((controller_id, action_id), None) is None:
+            return False
+         self.index = {}
+         return True
+
+   """Documentation for a method.
+
+      Only accept the actions listed by a controller from now on.
+      Allowing a controller again replaces its list of actions
+   """
+   def allow(self, controller):
+      if not isinstance(controller, ControllerV1):
+         raise Exception("CONTROLLER must be of type ControllerV1")
+      with self.lock:
+         self.allowed[controller.id] = frozenset(entry.id for entry in controller.actions)
+         self.index = {}
+
+   """Documentation for a method.
+
+      Find the route of an action
+      returns a Route, or None if the action is rejected or has no route
+   """
+   def resolve(self, controller_id, action_id):
+      key = (controller_id, action_id)
+      route = self.index.get(key, self)
+      if route is not self:
+         return route
+      with self.lock:
+         route = None
+         if self.is_allowed(controller_id, action_id):
+            routes = self.routes
+            route = (routes.get(key) or routes.get((None, action_id)) or
+                     routes.get((controller_id, None)) or routes.get((None, None)))
+         if len(self.index) >= self.max_index_size:
+            self.index = {}
+         self.index[key] = route
+      return route
+
+   """Documentation for a method.
+
+      Check if an action would be accepted by the allowed controllers.
+      Every action is accepted until a controller is allowed, after
+      which controllers that were not allowed have none accepted
+   """
+   def is_allowed(self, controller_id, action_id):
+      allowed = self.allowed.get(controller_id)
+      return not self.allowed or (allowed is not None and action_id in allowed)
+
+   """Documentation for a method.
+
+      Hand an action received by a server to its handler. Called on the
+      network thread
+      returns False if the action can not be taken yet
+   """
+   def submit(self, server, action):
+      route = self.resolve(action.controller_id, action.action_id)
+      if route is None:
+         if self.is_allowed(action.controller_id, action.action_id):
+            server.stats.unrouted += 1
+         else:
+            server.stats.rejected += 1
+         return True
+      if route.execution == EXECUTE_THREAD:
+         return server.workers.submit(server, action, route.handler)
+      if route.execution == EXECUTE_INLINE:
+         server.run_callback(action, route.handler)
+         return True
+      return self.submit_process(server, action, route.handler)
+
+   def submit_process(self, server, action, handler):
+      with self.lock:
+         if self.process_pending >= self.process_queue_size:
+            return False
+         self.process_pending += 1
+         if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.process_workers)
+         executor = self.executor
+      with server.stats.lock:
+         server.stats.actions += 1
+      started = perf_counter()
+      try: future = executor.submit(handler, action)
+      except Exception as error:
+         self.process_done(server, started, error)
+         return True
+      future.add_done_callback(lambda future: self.process_done(server, started, future.exception()))
+      return True
+
+   def process_done(self, server, started, error):
+      server.stats.record_callback(perf_counter() - started, error)
+      if error is not None:
+         print("Control server callback failed: " + str(error))
+      with self.lock:
+         was_full = self.process_pending >= self.process_queue_size
+         self.process_pending -= 1
+      if was_full and server.loop is not None:
+         server.loop.wake()
+
+   """Documentation for a method.
+
+      Shut down the process pool, waiting for the actions on it
+   """
+   def close(self):
+      with self.lock:
+         executor = self.executor
+         self.executor = None
+      if executor is not None:
+         executor.shutdown()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
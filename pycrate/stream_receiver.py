@@ -0,0 +1,256 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+from time import monotonic
+from .types import IPV4Connection, StreamV1, VALIDATE_TYPES
+from .control_server import ControlLoop, ActionWorkers
+
+"""Documentation for a class.
+
+   Counters kept by a stream receiver
+"""
+class StreamReceiverStats:
+   def __init__(self):
+      self.accepted = 0
+      self.frames = 0
+      self.decode_failures = 0
+      self.streams = 0
+      self.readings = 0
+      self.gaps = 0
+      self.missing = 0
+      self.reordered = 0
+      self.paused = 0
+      self.callback_errors = 0
+
+   def snapshot(self):
+      return dict(self.__dict__)
+
+"""Documentation for a class.
+
+   Receives the StreamV1 frames a monolith pushes to destinations
+   registered with Monolith.metric_stream_add. Frames are a 4 byte
+   little endian length followed by the encoded stream.
+
+   Received streams are either passed to `batch_callback` (with the list
+   of readings in the stream) on `workers` threads, or queued for
+   consumers using get(), readings() or `async for`. At most `queue_size`
+   streams wait for the callback, or `max_pending_readings` readings wait
+   for consumers, before the receiver stops reading from the network, so
+   a slow consumer pushes back on the sender instead of growing memory.
+
+   Sequence numbers are tracked for each connection to count gaps
+   (streams that never arrived) and reordered streams (arriving after a
+   later one), so a sender reconnecting with a fresh sequence or several
+   senders at once do not disturb the counts
+"""
+class StreamReceiver:
+   def __init__(self, connection, batch_callback=None, workers=1, queue_size=256, max_pending_readings=65536, max_frame_size=16777216, loop=None):
+      if not isinstance(connection, IPV4Connection):
+         raise Exception("Connection must be an IPV4Connection")
+      if not isinstance(max_pending_readings, int) or max_pending_readings < 1:
+         raise Exception("MAX PENDING READINGS must be an int greater than 0")
+
+      self.connection = connection
+      self.batch_callback = batch_callback
+      self.worker_count = workers
+      self.queue_size = queue_size
+      self.max_pending_readings = max_pending_readings
+      self.max_frame_size = max_frame_size
+      self.loop = loop
+      self.workers = None
+      self.listener = None
+      self.connections = set()
+      self.stats = StreamReceiverStats()
+
+      self.lock = threading.Lock()
+      self.available = threading.Condition(self.lock)
+      self.streams = deque()
+      self.pending_readings = 0
+      self.async_waiters = []
+      self.stopped = True
+
+   @property
+   def address(self):
+      if self.listener is None:
+         return self.connection
+      address, port = self.listener.getsockname()
+      return IPV4Connection(address, port)
+
+   def decode_frame(self, frame, conn=None):
+      try: stream = StreamV1.from_bytes(frame, VALIDATE_TYPES)
+      except Exception:
+         return None
+      if conn is not None:
+         self.track_sequence(conn, stream.sequence)
+      return stream
+
+   """Documentation for a method.
+
+      Update the gap / reordering counters with a sequence number
+      received on a connection
+   """
+   def track_sequence(self, conn, sequence):
+      if conn.next_sequence is not None:
+         if sequence > conn.next_sequence:
+            self.stats.gaps += 1
+            self.stats.missing += sequence - conn.next_sequence
+         elif sequence < conn.next_sequence:
+            self.stats.reordered += 1
+            return
+      conn.next_sequence = sequence + 1
+
+   def submit(self, stream):
+      if self.workers is not None:
+         if not self.workers.submit(self, stream):
+            return False
+         self.count(stream)
+         return True
+
+      with self.lock:
+         if self.streams and self.pending_readings + len(stream.readings) > self.max_pending_readings:
+            return False
+         self.streams.append(stream)
+         self.pending_readings += len(stream.readings)
+         self.count(stream)
+         self.available.notify()
+         waiters = self.async_waiters
+         self.async_waiters = []
+      for event_loop, future in waiters:
+         event_loop.call_soon_threadsafe(wake_future, future)
+      return True
+
+   def count(self, stream):
+      self.stats.streams += 1
+      self.stats.readings += len(stream.readings)
+
+   def run_callback(self, stream):
+      try:
+         self.batch_callback(stream.readings)
+      except Exception as error:
+         with self.lock:
+            self.stats.callback_errors += 1
+         print("Stream receiver callback failed: " + str(error))
+
+   """Documentation for a method.
+
+      Take the next queued stream
+      Returns None if nothing arrived within `timeout` seconds
+      or once the receiver has been stopped and drained
+   """
+   def get(self, timeout=None):
+      deadline = None if timeout is None else monotonic() + timeout
+      with self.lock:
+         while not self.streams and not self.stopped:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+               break
+            self.available.wait(remaining)
+         if not self.streams:
+            return None
+         return self.take()
+
+   def take(self):
+      stream = self.streams.popleft()
+      self.pending_readings -= len(stream.readings)
+      if self.loop is not None and self.loop.paused:
+         self.loop.wake()
+      return stream
+
+   """Documentation for a method.
+
+      Iterate over received readings until the receiver is stopped
+   """
+   def readings(self):
+      while True:
+         stream = self.get()
+         if stream is None:
+            return
+         for reading in stream.readings:
+            yield reading
+
+   def __aiter__(self):
+      return self
+
+   async def __anext__(self):
+      while True:
+         with self.lock:
+            if self.streams:
+               return self.take()
+            if self.stopped:
+               raise StopAsyncIteration
+            event_loop = asyncio.get_running_loop()
+            future = event_loop.create_future()
+            self.async_waiters.append((event_loop, future))
+         await future
+
+   """Documentation for a method.
+
+      Start listening. Raises if the address can not be bound
+   """
+   def start(self):
+      if self.listener is not None:
+         raise Exception("Stream receiver is already running")
+
+      listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      try:
+         listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+         listener.bind((self.connection.address, self.connection.port))
+         listener.listen(128)
+         listener.setblocking(False)
+      except Exception:
+         listener.close()
+         raise
+
+      if self.batch_callback is not None:
+         self.workers = ActionWorkers(self.worker_count, self.queue_size)
+      if self.loop is None:
+         self.loop = ControlLoop.default()
+      if self.workers is not None:
+         self.workers.space_listeners.append(self.loop.wake)
+      self.stopped = False
+      self.listener = listener
+      self.loop.start()
+      self.loop.call(lambda: self.loop.register(listener, self))
+
+   """Documentation for a method.
+
+      Stop listening and close every connection. Streams already queued
+      can still be taken, after which consumers see the end of the stream
+   """
+   def stop(self):
+      if self.listener is None:
+         return
+      listener = self.listener
+
+      def detach():
+         self.loop.unregister(listener)
+         for conn in list(self.connections):
+            self.loop.close_conn(conn)
+
+      self.loop.call(detach)
+      listener.close()
+      self.listener = None
+      if self.workers is not None:
+         self.workers.space_listeners.remove(self.loop.wake)
+         self.workers.stop()
+         self.workers = None
+
+      with self.lock:
+         self.stopped = True
+         self.available.notify_all()
+         waiters = self.async_waiters
+         self.async_waiters = []
+      for event_loop, future in waiters:
+         event_loop.call_soon_threadsafe(wake_future, future)
+
+   def __enter__(self):
+      self.start()
+      return self
+
+   def __exit__(self, *args):
+      self.stop()
+
+def wake_future(future):
+   if not future.done():
+      future.set_result(None)
@@ -0,0 +1,189 @@
+import random
+import socket
+import threading
+from time import monotonic
+
+ERROR_TIMEOUT = "timeout"
+ERROR_REFUSED = "refused"
+ERROR_CONNECTION = "connection"
+ERROR_HTTP = "http"
+ERROR_CIRCUIT_OPEN = "circuit_open"
+ERROR_POOL_EXHAUSTED = "pool_exhausted"
+
+"""Documentation for a class.
+
+   Raised when no pooled connection to the monolith is freed in time.
+   This is local contention rather than a sign of an unhealthy monolith
+"""
+class PoolExhaustedError(TimeoutError):
+   pass
+
+"""Documentation for a class.
+
+   Outcome of a request to the monolith. `error` is None on success, or
+   one of ERROR_TIMEOUT, ERROR_REFUSED, ERROR_CONNECTION, ERROR_HTTP
+   (`status` holds the HTTP status), ERROR_CIRCUIT_OPEN (the request
+   was not sent because the monolith is considered unhealthy) and
+   ERROR_POOL_EXHAUSTED (the request was not sent because every pooled
+   connection stayed busy)
+"""
+class FetchResult:
+   def __init__(self, status=None, body=None, error=None, detail=None, attempts=0):
+      self.status = status
+      self.body = body
+      self.error = error
+      self.detail = detail
+      self.attempts = attempts
+
+   def ok(self):
+      return self.error is None
+
+   """Documentation for a method.
+
+      Check if the request failed in a way that may not happen again
+      (the monolith could not be reached or reported a server error)
+   """
+   def is_transient(self):
+      if self.error == ERROR_HTTP:
+         return self.status >= 500
+      return self.error in (ERROR_TIMEOUT, ERROR_REFUSED, ERROR_CONNECTION)
+
+   def __repr__(self):
+      if self.ok():
+         return "FetchResult(status=" + str(self.status) + ")"
+      return "FetchResult(error=" + str(self.error) + ", status=" + str(self.status) + ", detail=" + repr(self.detail) + ")"
+
+"""Documentation for a method.
+
+   Classify an exception raised while sending a request
+   returns a FetchResult
+"""
+def error_result(error, attempts=0):
+   if isinstance(error, PoolExhaustedError):
+      kind = ERROR_POOL_EXHAUSTED
+   elif isinstance(error, (socket.timeout, TimeoutError)):
+      kind = ERROR_TIMEOUT
+   elif isinstance(error, ConnectionRefusedError):
+      kind = ERROR_REFUSED
+   else:
+      kind = ERROR_CONNECTION
+   return FetchResult(error=kind, detail=str(error) or type(error).__name__, attempts=attempts)
+
+"""Documentation for a class.
+
+   Fails requests fast once the monolith looks unhealthy. After
+   `failure_threshold` transient failures in a row the circuit opens and
+   requests are refused for `reset_timeout` seconds, after which a single
+   trial request is let through: the circuit closes again if it succeeds
+   and stays open for another `reset_timeout` otherwise
+"""
+class CircuitBreaker:
+   CLOSED = "closed"
+   OPEN = "open"
+   HALF_OPEN = "half_open"
+
+   def __init__(self, failure_threshold=5, reset_timeout=10.0):
+      if not isinstance(failure_threshold, int) or failure_threshold < 1:
+         raise Exception("FAILURE THRESHOLD must be an int greater than 0")
+      if not isinstance(reset_timeout, (int, float)) or reset_timeout < 0:
+         raise Exception("RESET TIMEOUT must be a non-negative number")
+      self.failure_threshold = failure_threshold
+      self.reset_timeout = reset_timeout
+      self.state = CircuitBreaker.CLOSED
+      self.failures = 0
+      self.opened_at = 0.0
+      self.trial_running = False
+      self.rejected = 0
+      self.lock = threading.Lock()
+
+   """Documentation for a method.
+
+      Check if a request may be sent
+   """
+   def allow(self):
+      with self.lock:
+         if self.state == CircuitBreaker.CLOSED:
+            return True
+         if self.state == CircuitBreaker.OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = CircuitBreaker.HALF_OPEN
+            self.trial_running = False
+         if self.state == CircuitBreaker.HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+         self.rejected += 1
+         return False
+
+   """Documentation for a method.
+
+      Give back a request that was allowed but never sent, so a half
+      open circuit lets another trial request through
+   """
+   def cancel(self):
+      with self.lock:
+         if self.state == CircuitBreaker.HALF_OPEN:
+            self.trial_running = False
+
+   """Documentation for a method.
+
+      Record the outcome of a request that was allowed
+   """
+   def record(self, success):
+      with self.lock:
+         if success:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            return
+         self.failures += 1
+         if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = monotonic()
+            self.trial_running = False
+
+"""Documentation for a class.
+
+   How a Monolith talks to the monolith server.
+
+   `connect_timeout` and `read_timeout` bound how long opening a
+   connection and waiting on a response may take (None waits forever).
+   Idempotent requests (fetches and probes) that fail transiently are
+   retried up to `retries` times, waiting an exponentially growing,
+   randomly jittered delay of at most `backoff` * 2^attempt and
+   `max_backoff` seconds in between. `failure_threshold` and
+   `reset_timeout` configure the circuit breaker, which is left out if
+   `failure_threshold` is None
+"""
+class TransportPolicy:
+   def __init__(self, connect_timeout=5.0, read_timeout=30.0, retries=2, backoff=0.05, max_backoff=2.0, failure_threshold=5, reset_timeout=10.0):
+      for name, timeout in (("CONNECT TIMEOUT", connect_timeout), ("READ TIMEOUT", read_timeout)):
+         if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise Exception(name + " must be a positive number or None")
+      if not isinstance(retries, int) or retries < 0:
+         raise Exception("RETRIES must be a non-negative int")
+      if not isinstance(backoff, (int, float)) or backoff < 0:
+         raise Exception("BACKOFF must be a non-negative number")
+      if not isinstance(max_backoff, (int, float)) or max_backoff < 0:
+         raise Exception("MAX BACKOFF must be a non-negative number")
+      self.connect_timeout = connect_timeout
+      self.read_timeout = read_timeout
+      self.retries = retries
+      self.backoff = backoff
+      self.max_backoff = max_backoff
+      self.failure_threshold = failure_threshold
+      self.reset_timeout = reset_timeout
+
+   """Documentation for a method.
+
+      Get the delay before retry number `attempt` (starting at 0)
+   """
+   def retry_delay(self, attempt):
+      return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+   """Documentation for a method.
+
+      Build the circuit breaker for a Monolith using this policy
+      returns a CircuitBreaker, or None if there should not be one
+   """
+   def make_breaker(self):
+      if self.failure_threshold is None:
+         return None
+      return CircuitBreaker(self.failure_threshold, self.reset_timeout)
@@ -1,10 +1,209 @@
+import re
 import json
+import struct
+from math import isfinite
+from json.encoder import encode_basestring as json_string
+
+"""
+   Validation levels used when adding items to a NodeV1, StreamV1 or
+   ControllerV1. Full checks field types and values (finite, non-bool
+   numbers), types only checks field types, and off trusts the producer
+"""
+VALIDATE_FULL = "full"
+VALIDATE_TYPES = "types"
+VALIDATE_OFF = "off"
+
+"""
+   Binary ActionV1 frames start with ACTION_BINARY_V1, which can never
+   start a json frame, followed by the little endian int64 timestamp,
+   float64 value and uint16 byte lengths of the controller and action
+   ids, then both ids in UTF-8
+"""
+ACTION_BINARY_V1 = 0x01
+action_header = struct.Struct("<BqdHH")
+
+"""Documentation for a method.
+
+   Check every item of an iterable against the given validation level
+   returns a list of the items, or None if any of them is invalid
+"""
+def validate_all(items, item_type, validation):
+   if validation == VALIDATE_OFF:
+      return list(items)
+   checked = []
+   for item in items:
+      if not isinstance(item, item_type) or not item.is_valid(validation):
+         print("Invalid " + item_type.__name__ + " in bulk add")
+         return None
+      checked.append(item)
+   return checked
+
+"""Documentation for a method.
+
+   Encode a sequence of V1 objects as a json array in one pass,
+   optionally wrapped in the given prefix and suffix. The pieces are
+   joined once at the end, so encoding is linear in the number of items
+   returns the encoded string
+"""
+def encode_many(items, prefix="[", suffix="]"):
+   encoded = [prefix]
+   for item in items:
+      encoded.append(item.encode())
+      encoded.append(",")
+   if len(encoded) > 1:
+      encoded[-1] = suffix
+   else:
+      encoded.append(suffix)
+   return "".join(encoded)
+
+"""
+   Readings and actions as written by their encode() methods, with ids
+   free of escaped characters. The fast decoders split data matching
+   these directly into fields and fall back to json for anything else.
+   Numbers must follow the json number syntax, so values json would
+   reject (1_000, NaN, leading spaces or zeros) never take the fast
+   path. Data holding a backslash is left to json as well
+"""
+json_integer = rb"(-?(?:0|[1-9]\d*))"
+json_number = rb"(-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+backslash_pattern = re.compile(rb"\\")
+readings_pattern = re.compile(rb'\{"timestamp":' + json_integer + rb',"node_id":"([^"]*)","sensor_id":"([^"]*)","value":' + json_number + rb"\}")
+reading_pattern = re.compile(rb'\{"timestamp":' + json_integer + rb',"node_id":"([^"\\]*)","sensor_id":"([^"\\]*)","value":' + json_number + rb"\}")
+action_pattern = re.compile(rb'\{"timestamp":' + json_integer + rb',"controller_id":"([^"\\]*)","action_id":"([^"\\]*)","value":' + json_number + rb"\}")
+stream_pattern = re.compile(rb'\{"timestamp":(-?\d+),"sequence":(-?\d+),"data":\[(.*)\]\}\Z', re.S)
+response_pattern = re.compile(rb'\{"status":(-?\d+),"data":\[(.*)\]\}\Z', re.S)
+
+"""Documentation for a method.
+
+   Get encoded data as something both re and json accept without
+   copying it where possible
+"""
+def json_source(data):
+   if isinstance(data, str):
+      return data.encode("utf-8")
+   if isinstance(data, bytearray):
+      return bytes(data)
+   return data
+
+"""Documentation for a method.
+
+   Split the body of a json array of readings into columns of raw fields
+   returns (timestamps, node ids, sensor ids, values) lists of bytes,
+   or None if the body is not in the form written by ReadingV1.encode
+"""
+def split_readings(body):
+   if not len(body):
+      return [], [], [], []
+   if backslash_pattern.search(body):
+      return None
+   parts = readings_pattern.split(body)
+   gaps = parts[0::5]
+   if gaps[0] or gaps[-1] or gaps[1:-1].count(b",") != len(gaps) - 2:
+      return None
+   return parts[1::5], parts[2::5], parts[3::5], parts[4::5]
+
+"""Documentation for a method.
+
+   Build ReadingV1 objects from columns of raw fields, decoding every
+   distinct id only once and skipping the constructor's type checks.
+   Raises ValueError if a field is not a number
+"""
+def build_readings(columns):
+   timestamps, node_ids, sensor_ids, values = columns
+   strings = {raw: raw.decode("utf-8") for raw in set(node_ids).union(sensor_ids)}
+   new = object.__new__
+   readings = []
+   append = readings.append
+   for timestamp, node_id, sensor_id, value in zip(timestamps, node_ids, sensor_ids, values):
+      reading = new(ReadingV1)
+      reading.timestamp = int(timestamp)
+      reading.node_id = strings[node_id]
+      reading.sensor_id = strings[sensor_id]
+      reading.value = float(value)
+      append(reading)
+   return readings
+
+"""Documentation for a method.
+
+   Build ReadingV1 objects from decoded json readings
+"""
+def readings_from_decoded(decoded_readings):
+   new = object.__new__
+   readings = []
+   for decoded in decoded_readings:
+      reading = new(ReadingV1)
+      reading.timestamp = decoded["timestamp"]
+      reading.node_id = decoded["node_id"]
+      reading.sensor_id = decoded["sensor_id"]
+      reading.value = float(decoded["value"])
+      readings.append(reading)
+   return readings
+
+"""Documentation for a method.
+
+   Split encoded readings, an array, a stream or a monolith response
+   with status 200, into columns of raw fields as split_readings does
+   returns the columns, or None if the data is not in the form written
+   by encode
+"""
+def split_json(data):
+   view = memoryview(data)
+   if data[0:1] == b"[" and data[-1:] == b"]":
+      return split_readings(view[1:-1])
+   match = stream_pattern.match(data)
+   if match is not None:
+      return split_readings(view[match.start(3):match.end(3)])
+   match = response_pattern.match(data)
+   if match is not None and match.group(1) == b"200":
+      return split_readings(view[match.start(2):match.end(2)])
+   return None
+
+"""Documentation for a method.
+
+   Decode encoded readings, an array, a stream or a monolith response,
+   through json
+   returns (status, readings) where status is None if the data is not a
+   response, and readings are the decoded json readings or None if the
+   status is not 200
+"""
+def decode_json(data):
+   decoded = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+   if not isinstance(decoded, dict):
+      return None, decoded
+   status = decoded.get("status")
+   if status is not None and status != 200:
+      return status, None
+   return status, decoded["data"]
+
+"""Documentation for a method.
+
+   Check a decoded action against the requested validation level
+   returns the action, raises if it is not valid
+"""
+def check_action(action, validation):
+   if validation == VALIDATE_FULL and (isinstance(action.timestamp, bool) or not isfinite(action.value)):
+      raise Exception("Decoded action is not valid")
+   return action
+
+"""Documentation for a method.
+
+   Check decoded readings against the requested validation level
+   returns the readings, raises if one of them is not valid
+"""
+def check_readings(readings, validation):
+   if validation != VALIDATE_OFF:
+      for reading in readings:
+         if not reading.is_valid(validation):
+            raise Exception("Decoded reading is not valid")
+   return readings
 
 """Documentation for a class.
 
    Object representing an ipv4 address and port
 """
 class IPV4Connection:
+   __slots__ = ("address", "port")
+
    def __init__(self, address, port):
       if not isinstance(address, str):
          raise Exception("ADDRESS Must be a string")
@@ -42,13 +241,12 @@ class VersionV1:
       returns encoded version
    """
    def encode(self):
-      encoded = "{{\"name\":\"{0}\",\"hash\":\"{1}\",\"version_major\":\"{2}\", \
-                  \"version_minor\":\"{3}\",\"version_patch\":\"{4}\"}}".format(
-         self.name, 
-         self.hash, 
-         self.major,
-         self.minor,
-         self.patch
+      encoded = "{{\"name\":{0},\"hash\":{1},\"version_major\":{2},\"version_minor\":{3},\"version_patch\":{4}}}".format(
+         json_string(self.name),
+         json_string(self.hash),
+         json_string(self.major),
+         json_string(self.minor),
+         json_string(self.patch)
       )
       return encoded
 
@@ -75,6 +273,8 @@ class VersionV1:
    Object representing a V1 Node Sensor entry
 """
 class NodeV1SensorEntry:
+   __slots__ = ("id", "type", "description")
+
    def __init__(self, id, type, description):
       if not isinstance(id, str):
          raise Exception("ID be a string")
@@ -86,16 +286,28 @@ class NodeV1SensorEntry:
       self.type = type
       self.description = description
 
+   """Documentation for a method.
+
+      Check the fields of the entry directly
+      returns true iff the entry is valid
+   """
+   def is_valid(self, validation=VALIDATE_FULL):
+      if validation == VALIDATE_OFF:
+         return True
+      return (isinstance(self.id, str) and
+              isinstance(self.type, str) and
+              isinstance(self.description, str))
+
    """Documentation for a method.
 
       Encode action to json string
       returns encoded entry
    """
    def encode(self):
-      encoded = "{{\"id\":\"{0}\",\"type\":\"{1}\",\"description\":\"{2}\"}}".format(
-         self.id, 
-         self.type, 
-         self.description
+      encoded = "{{\"id\":{0},\"type\":{1},\"description\":{2}}}".format(
+         json_string(self.id),
+         json_string(self.type),
+         json_string(self.description)
       )
       return encoded
 
@@ -120,13 +332,14 @@ class NodeV1SensorEntry:
    Object representing a V1 Node
 """
 class NodeV1:
-   def __init__(self, id, description):
+   def __init__(self, id, description, validation=VALIDATE_FULL):
       if not isinstance(id, str):
          raise Exception("ID be a string")
       if not isinstance(description, str):
          raise Exception("DESCRIPTION Must be a string")
       self.id = id
       self.description = description
+      self.validation = validation
       self.sensors = []
 
    """Documentation for a method.
@@ -134,32 +347,42 @@ class NodeV1:
       Add a sensor to the sensor list and ensure that its unique
       returns true iff the item could be added
    """
-   def add_sensor(self, sensor):
+   def add_sensor(self, sensor, validation=None):
       if not isinstance(sensor, NodeV1SensorEntry):
          print("SENSOR must be a NodeV1SensorEntry object")
          return False
 
-      encoded = sensor.encode()
-      if not sensor.decode_from(encoded):
+      if not sensor.is_valid(validation or self.validation):
          print("Invalid sensor")
          return False
 
       self.sensors.append(sensor)
       return True
 
+   """Documentation for a method.
+
+      Add every sensor of an iterable in one pass
+      returns true iff all of them could be added,
+      if any of them is invalid none of them are added
+   """
+   def add_sensors(self, sensors, validation=None):
+      checked = validate_all(sensors, NodeV1SensorEntry, validation or self.validation)
+      if checked is None:
+         return False
+      self.sensors.extend(checked)
+      return True
+
    """Documentation for a method.
 
       Encode node to json string
       returns encoded node
    """
    def encode(self):
-      encoded = "{{\"id\":\"{0}\",\"description\":\"{1}\",\"sensors\":[".format(self.id, self.description)
-      for sensor in self.sensors:
-         encoded += sensor.encode() + ","
-      if len(self.sensors) > 0:
-         encoded = encoded[:-1]
-      encoded += "]}"
-      return encoded
+      prefix = "{{\"id\":{0},\"description\":{1},\"sensors\":[".format(
+         json_string(self.id),
+         json_string(self.description)
+      )
+      return encode_many(self.sensors, prefix, "]}")
 
    """Documentation for a method.
 
@@ -167,8 +390,15 @@ class NodeV1:
       returns true iff the node could be built from the string
    """
    def decode_from(self, encoded_node):
+      return self.load_decoded(json.loads(encoded_node))
+
+   """Documentation for a method.
+
+      Attempt to build a node from its decoded json
+      returns true iff the node could be built
+   """
+   def load_decoded(self, decoded):
       self.sensors = []
-      decoded = json.loads(encoded_node)
       if decoded is None:
          print("Failed to parse data")
          return False
@@ -184,6 +414,8 @@ class NodeV1:
    Object representing a V1 Node
 """
 class ReadingV1:
+   __slots__ = ("timestamp", "node_id", "sensor_id", "value")
+
    def __init__(self, timestamp, node_id, sensor_id, value):
       if not isinstance(timestamp, int):
          raise Exception("TIMESTAMP Must be an int")
@@ -199,14 +431,31 @@ class ReadingV1:
       self.sensor_id = sensor_id
       self.value = value
 
+   """Documentation for a method.
+
+      Check the fields of the reading directly
+      returns true iff the reading is valid
+   """
+   def is_valid(self, validation=VALIDATE_FULL):
+      if validation == VALIDATE_OFF:
+         return True
+      if not (isinstance(self.timestamp, int) and
+              isinstance(self.node_id, str) and
+              isinstance(self.sensor_id, str) and
+              isinstance(self.value, float)):
+         return False
+      if validation == VALIDATE_FULL:
+         return not isinstance(self.timestamp, bool) and isfinite(self.value)
+      return True
+
    """Documentation for a method.
 
       Encode reading to json string
       returns encoded node
    """
    def encode(self):
-      encoded = "{{\"timestamp\":{0},\"node_id\":\"{1}\",\"sensor_id\":\"{2}\",\"value\":{3}}}".format(
-         self.timestamp, self.node_id, self.sensor_id, self.value
+      encoded = "{{\"timestamp\":{0},\"node_id\":{1},\"sensor_id\":{2},\"value\":{3}}}".format(
+         self.timestamp, json_string(self.node_id), json_string(self.sensor_id), self.value
       )
 
       return encoded
@@ -227,13 +476,50 @@ class ReadingV1:
       self.sensor_id = decoded["sensor_id"]
       self.value = decoded["value"]
       return True
+
+   """Documentation for a method.
+
+      Build a reading from encoded json, given as str, bytes, bytearray
+      or memoryview. Data written by encode() is split up directly
+      rather than through json, which guarantees valid fields. Anything
+      else goes through json and is checked at the given `validation`
+      level
+      returns a ReadingV1, raises if the data is not a reading
+   """
+   @classmethod
+   def from_json(cls, data, validation=VALIDATE_OFF):
+      data = json_source(data)
+      match = reading_pattern.fullmatch(data) if cls is ReadingV1 else None
+      if match is not None:
+         return build_readings([[group] for group in match.groups()])[0]
+      decoded = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+      reading = cls(decoded["timestamp"], decoded["node_id"], decoded["sensor_id"], float(decoded["value"]))
+      return check_readings([reading], validation)[0]
+
+   """Documentation for a method.
+
+      Build readings from an encoded json array of readings, as in
+      from_json
+      returns a list of ReadingV1
+   """
+   @classmethod
+   def from_json_array(cls, data, validation=VALIDATE_OFF):
+      data = json_source(data)
+      columns = None
+      if len(data) >= 2 and data[0:1] == b"[" and data[-1:] == b"]":
+         columns = split_readings(memoryview(data)[1:-1])
+      if columns is not None:
+         try: return build_readings(columns)
+         except ValueError:
+            pass
+      return check_readings(readings_from_decoded(json.loads(bytes(data) if isinstance(data, memoryview) else data)), validation)
       
 """Documentation for a class.
 
    Object representing a V1 Stream
 """
 class StreamV1:
-   def __init__(self, timestamp, sequence):
+   def __init__(self, timestamp, sequence, validation=VALIDATE_FULL):
       if not isinstance(timestamp, int):
          raise Exception("TIMESTAMP Must be an int")
       if not isinstance(sequence, int):
@@ -241,38 +527,46 @@ class StreamV1:
 
       self.timestamp = timestamp
       self.sequence = sequence
+      self.validation = validation
       self.readings = []
 
    """Documentation for a method.
 
       Add a metric reading to the stream
    """
-   def add_reading(self, reading):
+   def add_reading(self, reading, validation=None):
       if not isinstance(reading, ReadingV1):
          print("READING must be a ReadingV1 object")
          return False
 
-      encoded_reading = reading.encode()
-      if not reading.decode_from(encoded_reading):
+      if not reading.is_valid(validation or self.validation):
          print("Invalid reading")
          return False
 
       self.readings.append(reading)
       return True
 
+   """Documentation for a method.
+
+      Add every reading of an iterable in one pass
+      returns true iff all of them could be added,
+      if any of them is invalid none of them are added
+   """
+   def add_readings(self, readings, validation=None):
+      checked = validate_all(readings, ReadingV1, validation or self.validation)
+      if checked is None:
+         return False
+      self.readings.extend(checked)
+      return True
+
    """Documentation for a method.
 
       Encode to json string
       returns encoded stream
    """
    def encode(self):
-      encoded = "{{\"timestamp\":{0},\"sequence\":{1},\"data\":[".format(self.timestamp, self.sequence)
-      for reading in self.readings:
-         encoded += reading.encode() + ","
-      if len(self.readings) > 0:
-         encoded = encoded[:-1]
-      encoded += "]}"
-      return encoded
+      prefix = "{{\"timestamp\":{0},\"sequence\":{1},\"data\":[".format(self.timestamp, self.sequence)
+      return encode_many(self.readings, prefix, "]}")
 
    """Documentation for a method.
 
@@ -292,11 +586,40 @@ class StreamV1:
          self.readings.append(ReadingV1(reading["timestamp"], reading["node_id"], reading["sensor_id"], reading["value"]))
       return True
 
+   """Documentation for a method.
+
+      Build a stream from encoded json, given as bytes, bytearray,
+      memoryview or str. Streams written by encode() are split up
+      directly rather than through json, and readings are built without
+      the constructor's checks, as in ReadingV1.from_json
+      returns a StreamV1, raises if the data is not a stream
+   """
+   @classmethod
+   def from_bytes(cls, data, validation=VALIDATE_OFF):
+      data = json_source(data)
+      match = stream_pattern.match(data)
+      columns = None
+      if match is not None:
+         columns = split_readings(memoryview(data)[match.start(3):match.end(3)])
+      if columns is not None:
+         try:
+            stream = cls(int(match.group(1)), int(match.group(2)))
+            stream.readings = build_readings(columns)
+            return stream
+         except ValueError:
+            pass
+      decoded = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+      stream = cls(decoded["timestamp"], decoded["sequence"])
+      stream.readings = check_readings(readings_from_decoded(decoded["data"]), validation)
+      return stream
+
 """Documentation for a class.
 
    Object representing a V1 Action
 """
 class ActionV1:
+   __slots__ = ("timestamp", "controller_id", "action_id", "value")
+
    def __init__(self, timestamp, controller_id, action_id, value):
       if not isinstance(timestamp, int):
          raise Exception("TIMESTAMP Must be an int")
@@ -318,8 +641,8 @@ class ActionV1:
       returns encoded node
    """
    def encode(self):
-      encoded = "{{\"timestamp\":{0},\"controller_id\":\"{1}\",\"action_id\":\"{2}\",\"value\":{3}}}".format(
-         self.timestamp, self.controller_id, self.action_id, self.value
+      encoded = "{{\"timestamp\":{0},\"controller_id\":{1},\"action_id\":{2},\"value\":{3}}}".format(
+         self.timestamp, json_string(self.controller_id), json_string(self.action_id), self.value
       )
 
       return encoded
@@ -341,6 +664,79 @@ class ActionV1:
       self.value = decoded["value"]
       return True
 
+   """Documentation for a method.
+
+      Build an action from encoded json, as ReadingV1.from_json does
+      returns an ActionV1, raises if the data is not an action
+   """
+   @classmethod
+   def from_json(cls, data, validation=VALIDATE_OFF):
+      data = json_source(data)
+      match = action_pattern.fullmatch(data)
+      if match is not None:
+         timestamp, controller_id, action_id, value = match.groups()
+         action = cls(int(timestamp), controller_id.decode("utf-8"), action_id.decode("utf-8"), float(value))
+      else:
+         decoded = json.loads(bytes(data) if isinstance(data, memoryview) else data)
+         action = cls(decoded["timestamp"], decoded["controller_id"], decoded["action_id"], float(decoded["value"]))
+      return check_action(action, validation)
+
+   """Documentation for a method.
+
+      Encode action to a binary frame payload, see ACTION_BINARY_V1
+      returns the encoded bytes
+   """
+   def encode_binary(self):
+      controller_id = self.controller_id.encode("utf-8")
+      action_id = self.action_id.encode("utf-8")
+      if len(controller_id) > 0xffff or len(action_id) > 0xffff:
+         raise Exception("IDS must be at most 65535 bytes long")
+      try:
+         header = action_header.pack(ACTION_BINARY_V1, self.timestamp, self.value,
+                                     len(controller_id), len(action_id))
+      except struct.error:
+         raise Exception("TIMESTAMP must fit in a signed 64 bit int")
+      return header + controller_id + action_id
+
+   """Documentation for a method.
+
+      Build an action from a binary frame payload (bytes, bytearray or
+      memoryview), unpacking it in place. The fields of a binary action
+      always have the right types, so the constructor checks are skipped
+      returns an ActionV1, raises if the data is not a binary action
+   """
+   @classmethod
+   def from_binary(cls, data, validation=VALIDATE_OFF):
+      kind, timestamp, value, controller_len, action_len = action_header.unpack_from(data)
+      if kind != ACTION_BINARY_V1:
+         raise Exception("Unknown binary action type " + str(kind))
+      ids_start = action_header.size
+      ids_end = ids_start + controller_len + action_len
+      if len(data) != ids_end:
+         raise Exception("Binary action is " + str(len(data)) + " bytes, expected " + str(ids_end))
+      controller_id = str(data[ids_start:ids_start + controller_len], "utf-8")
+      action_id = str(data[ids_start + controller_len:ids_end], "utf-8")
+      if cls is not ActionV1:
+         return check_action(cls(timestamp, controller_id, action_id, value), validation)
+      action = object.__new__(ActionV1)
+      action.timestamp = timestamp
+      action.controller_id = controller_id
+      action.action_id = action_id
+      action.value = value
+      return check_action(action, validation)
+
+   """Documentation for a method.
+
+      Build an action from a frame payload in either encoding, telling
+      binary from json by its first byte
+      returns an ActionV1, raises if the data is not an action
+   """
+   @classmethod
+   def from_frame(cls, data, validation=VALIDATE_OFF):
+      if len(data) and data[0] == ACTION_BINARY_V1:
+         return cls.from_binary(data, validation)
+      return cls.from_json(data, validation)
+
       
 
 """Documentation for a class.
@@ -348,6 +744,8 @@ class ActionV1:
    Object representing a V1 Controller's action entry
 """
 class ControllerV1ActionEntry:
+   __slots__ = ("id", "description")
+
    def __init__(self, id, description):
       if not isinstance(id, str):
          raise Exception("ID be a string")
@@ -356,14 +754,24 @@ class ControllerV1ActionEntry:
       self.id = id
       self.description = description
 
+   """Documentation for a method.
+
+      Check the fields of the entry directly
+      returns true iff the entry is valid
+   """
+   def is_valid(self, validation=VALIDATE_FULL):
+      if validation == VALIDATE_OFF:
+         return True
+      return isinstance(self.id, str) and isinstance(self.description, str)
+
    """Documentation for a method.
 
       Encode action to json string
       returns encoded entry
    """
    def encode(self):
-      encoded = "{{\"id\":\"{0}\",\"description\":\"{1}\"}}".format(
-         self.id, self.description
+      encoded = "{{\"id\":{0},\"description\":{1}}}".format(
+         json_string(self.id), json_string(self.description)
       )
 
       return encoded
@@ -388,7 +796,7 @@ class ControllerV1ActionEntry:
    Object representing a V1 Controller
 """
 class ControllerV1:
-   def __init__(self, id, description, connection):
+   def __init__(self, id, description, connection, validation=VALIDATE_FULL):
       if not isinstance(id, str):
          raise Exception("ID Must be an string")
       if not isinstance(description, str):
@@ -400,38 +808,48 @@ class ControllerV1:
       self.description = description
       self.ip = connection.address
       self.port = connection.port
+      self.validation = validation
       self.actions = []
 
    """Documentation for a method.
 
       Add an action reading to the controller
    """
-   def add_action(self, action):
+   def add_action(self, action, validation=None):
       if not isinstance(action, ControllerV1ActionEntry):
          print("ACTION must be a ControllerV1ActionEntry object")
          return False
 
-      encoded = action.encode()
-      if not action.decode_from(encoded):
+      if not action.is_valid(validation or self.validation):
          print("Invalid action")
          return False
 
       self.actions.append(action)
       return True
 
+   """Documentation for a method.
+
+      Add every action of an iterable in one pass
+      returns true iff all of them could be added,
+      if any of them is invalid none of them are added
+   """
+   def add_actions(self, actions, validation=None):
+      checked = validate_all(actions, ControllerV1ActionEntry, validation or self.validation)
+      if checked is None:
+         return False
+      self.actions.extend(checked)
+      return True
+
    """Documentation for a method.
 
       Encode to json string
       returns encoded controller
    """
    def encode(self):
-      encoded = "{{\"id\":\"{0}\",\"description\":\"{1}\",\"ip\":\"{2}\",\"port\":{3},\"actions\":[".format(self.id, self.description, self.ip, self.port, )
-      for action in self.actions:
-         encoded += action.encode() + ","
-      if len(self.actions) > 0:
-         encoded = encoded[:-1]
-      encoded += "]}"
-      return encoded
+      prefix = "{{\"id\":{0},\"description\":{1},\"ip\":{2},\"port\":{3},\"actions\":[".format(
+         json_string(self.id), json_string(self.description), json_string(self.ip), self.port
+      )
+      return encode_many(self.actions, prefix, "]}")
 
    """Documentation for a method.
 
@@ -439,8 +857,15 @@ class ControllerV1:
       returns true iff the controller could be built from the string
    """
    def decode_from(self, encoded):
+      return self.load_decoded(json.loads(encoded))
+
+   """Documentation for a method.
+
+      Attempt to build a controller from its decoded json
+      returns true iff the controller could be built
+   """
+   def load_decoded(self, decoded):
       self.actions = []
-      decoded = json.loads(encoded)
       if decoded is None:
          print("Failed to parse data")
          return False
@@ -459,6 +884,8 @@ class ControllerV1:
    Object representing a V1 Heartbeat
 """
 class HeartbeatV1:
+   __slots__ = ("id",)
+
    def __init__(self, id):
       if not isinstance(id, str):
          raise Exception("ID Must be a string")
@@ -470,8 +897,8 @@ class HeartbeatV1:
       returns encoded heartbeat
    """
    def encode(self):
-      encoded = "{{\"heartbeat\":\"{0}\"}}".format(
-         self.id
+      encoded = "{{\"heartbeat\":{0}}}".format(
+         json_string(self.id)
       )
       return encoded
 
@@ -487,4 +914,77 @@ class HeartbeatV1:
          return False
 
       self.id = decoded["heartbeat"]
-      return True
\ No newline at end of file
+      return True
+
+"""Documentation for a class.
+
+   Base for immutable, hashable variants of the V1 types. Instances
+   compare equal when they are of the same type and their fields match.
+   Fields can not be changed once built, so decode_from raises; build
+   them with the constructor or the from_json class methods instead.
+
+   The `frozen` slot makes each instance one pointer larger than its
+   mutable type, a FrozenReadingV1 takes about 128 bytes where a
+   ReadingV1 takes 120 (see tests/bench_memory.py)
+"""
+class FrozenV1:
+   __slots__ = ()
+
+   def decode_from(self, *args, **kwargs):
+      raise Exception(type(self).__name__ + " is immutable and can not be decoded into")
+
+   def __setattr__(self, name, value):
+      if getattr(self, "frozen", False):
+         raise AttributeError(type(self).__name__ + " is immutable")
+      object.__setattr__(self, name, value)
+
+   def __delattr__(self, name):
+      raise AttributeError(type(self).__name__ + " is immutable")
+
+   def fields(self):
+      return tuple(getattr(self, name) for name in self.field_names)
+
+   def __eq__(self, other):
+      return type(other) is type(self) and other.fields() == self.fields()
+
+   def __hash__(self):
+      return hash(self.fields())
+
+   def __repr__(self):
+      return type(self).__name__ + repr(self.fields())
+
+"""Documentation for a class.
+
+   Immutable, hashable IPV4Connection
+"""
+class FrozenIPV4Connection(FrozenV1, IPV4Connection):
+   __slots__ = ("frozen",)
+   field_names = IPV4Connection.__slots__
+
+   def __init__(self, address, port):
+      IPV4Connection.__init__(self, address, port)
+      self.frozen = True
+
+"""Documentation for a class.
+
+   Immutable, hashable ReadingV1
+"""
+class FrozenReadingV1(FrozenV1, ReadingV1):
+   __slots__ = ("frozen",)
+   field_names = ReadingV1.__slots__
+
+   def __init__(self, timestamp, node_id, sensor_id, value):
+      ReadingV1.__init__(self, timestamp, node_id, sensor_id, value)
+      self.frozen = True
+
+"""Documentation for a class.
+
+   Immutable, hashable ActionV1
+"""
+class FrozenActionV1(FrozenV1, ActionV1):
+   __slots__ = ("frozen",)
+   field_names = ActionV1.__slots__
+
+   def __init__(self, timestamp, controller_id, action_id, value):
+      ActionV1.__init__(self, timestamp, controller_id, action_id, value)
+      self.frozen = True
@@ -0,0 +1,386 @@
+import os
+import threading
+from time import monotonic
+from .types import ReadingV1, HeartbeatV1
+from .monolith import Monolith
+from .transport import ERROR_HTTP
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_REJECT = "reject"
+
+"""Documentation for a method.
+
+   Cut a segment back to its last complete record, dropping a record
+   that was only partly written when the process stopped. Only the end
+   of the file is read
+   returns the size of the segment
+"""
+def repair_segment(path):
+   with open(path, "r+b") as segment:
+      size = segment.seek(0, os.SEEK_END)
+      end = size
+      keep = 0
+      while end > 0:
+         start = max(0, end - 65536)
+         segment.seek(start)
+         newline = segment.read(end - start).rfind(b"\n")
+         if newline != -1:
+            keep = start + newline + 1
+            break
+         end = start
+      if keep != size:
+         segment.truncate(keep)
+      return keep
+
+"""Documentation for a class.
+
+   Durable submission queue for readings and heartbeats. Submissions are
+   appended to a log of segment files in `directory` and a background
+   thread sends them to the monolith in batches, in the order they were
+   submitted. When the monolith can not be reached the log keeps growing
+   and is drained once is_connected() succeeds again.
+
+   `fsync` is FSYNC_ALWAYS (every submission), FSYNC_INTERVAL (at most
+   every `fsync_interval` seconds) or FSYNC_NEVER (left to the OS).
+
+   The log is kept under `max_bytes` on disk. Once it is full, `overflow`
+   either drops the oldest unsent segment (OVERFLOW_DROP_OLDEST) or
+   refuses new submissions (OVERFLOW_REJECT).
+
+   A checkpoint file records how far the log has been sent, so a restart
+   resumes from there without reading the log. Delivery is at least once:
+   a batch that was sent but not checkpointed before a crash or a
+   connection failure is sent again. Records the monolith answers with a
+   4xx status are counted as rejected and skipped rather than retried
+"""
+class SubmissionLog:
+   def __init__(self, monolith, directory, segment_size=4194304, max_bytes=67108864, fsync=FSYNC_INTERVAL, fsync_interval=1.0, overflow=OVERFLOW_DROP_OLDEST, batch_size=256, retry_interval=1.0):
+      if not isinstance(monolith, Monolith):
+         raise Exception("MONOLITH must be of type Monolith")
+      if not isinstance(segment_size, int) or segment_size < 1:
+         raise Exception("SEGMENT SIZE must be an int greater than 0")
+      if not isinstance(max_bytes, int) or max_bytes < 2 * segment_size:
+         raise Exception("MAX BYTES must be an int of at least two segments")
+      if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+         raise Exception("FSYNC must be one of always, interval or never")
+      if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_REJECT):
+         raise Exception("OVERFLOW must be one of drop_oldest or reject")
+      if not isinstance(batch_size, int) or batch_size < 1:
+         raise Exception("BATCH SIZE must be an int greater than 0")
+
+      self.monolith = monolith
+      self.directory = directory
+      self.segment_size = segment_size
+      self.max_bytes = max_bytes
+      self.fsync = fsync
+      self.fsync_interval = fsync_interval
+      self.overflow = overflow
+      self.batch_size = batch_size
+      self.retry_interval = retry_interval
+
+      self.lock = threading.Lock()
+      self.changed = threading.Condition(self.lock)
+      self.closed = False
+      self.connected = True
+      self.last_sync = monotonic()
+      self.unsynced = False
+      self.submitted = 0
+      self.rejected = 0
+      self.dropped_segments = 0
+      self.dropped_bytes = 0
+      self.overflows = 0
+
+      os.makedirs(directory, exist_ok=True)
+      self.recover()
+      self.thread = threading.Thread(target=self.run, daemon=True)
+      self.thread.start()
+
+   def segment_path(self, number):
+      return os.path.join(self.directory, "%020d.log" % number)
+
+   def checkpoint_path(self):
+      return os.path.join(self.directory, "checkpoint")
+
+   """Documentation for a method.
+
+      Pick up the log left in the directory: resume sending from the
+      checkpoint and appending after the last complete record
+   """
+   def recover(self):
+      numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                       if name.endswith(".log") and name[:-4].isdigit())
+
+      read_segment, read_offset = 0, 0
+      try:
+         with open(self.checkpoint_path(), "r") as checkpoint:
+            read_segment, read_offset = [int(field) for field in checkpoint.read().split()]
+      except (OSError, ValueError):
+         if numbers:
+            read_segment = numbers[0]
+
+      for number in numbers:
+         if number < read_segment:
+            os.remove(self.segment_path(number))
+      numbers = [number for number in numbers if number >= read_segment]
+      if not numbers or numbers[0] > read_segment:
+         # The segment being read was dropped, carry on with the next one
+         read_segment = numbers[0] if numbers else read_segment
+         read_offset = 0
+
+      self.segments = {}
+      for number in numbers[:-1]:
+         self.segments[number] = os.path.getsize(self.segment_path(number))
+      if numbers:
+         self.write_segment = numbers[-1]
+         self.segments[self.write_segment] = repair_segment(self.segment_path(self.write_segment))
+      else:
+         self.write_segment = read_segment
+         self.segments[self.write_segment] = 0
+      self.write_fd = os.open(self.segment_path(self.write_segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+      self.disk_bytes = sum(self.segments.values())
+      self.read_segment = read_segment
+      self.read_offset = min(read_offset, self.segments[read_segment])
+
+   """Documentation for a method.
+
+      Queue a reading to be submitted
+      returns False if it was refused because the log is full
+   """
+   def submit_reading(self, reading):
+      if not isinstance(reading, ReadingV1):
+         raise Exception("READING must be of type ReadingV1")
+      return self.append("/metric/submit/" + reading.encode())
+
+   """Documentation for a method.
+
+      Queue a heartbeat to be submitted
+      returns False if it was refused because the log is full
+   """
+   def submit_heartbeat(self, heartbeat):
+      if not isinstance(heartbeat, HeartbeatV1):
+         raise Exception("HEARTBEAT must be of type HeartbeatV1")
+      return self.append("/metric/heartbeat/" + heartbeat.encode())
+
+   def append(self, endpoint):
+      record = (endpoint + "\n").encode("utf-8")
+      with self.lock:
+         if self.closed:
+            raise Exception("Submission log is closed")
+         if self.segments[self.write_segment] and self.segments[self.write_segment] + len(record) > self.segment_size:
+            self.roll()
+         if not self.make_room(len(record)):
+            self.overflows += 1
+            return False
+         os.write(self.write_fd, record)
+         self.segments[self.write_segment] += len(record)
+         self.disk_bytes += len(record)
+         self.unsynced = True
+         if self.fsync == FSYNC_ALWAYS or monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+         self.changed.notify_all()
+      return True
+
+   def sync(self):
+      if self.unsynced and self.fsync != FSYNC_NEVER:
+         os.fsync(self.write_fd)
+      self.unsynced = False
+      self.last_sync = monotonic()
+
+   """Documentation for a method.
+
+      Start appending to a new segment
+   """
+   def roll(self):
+      self.sync()
+      os.close(self.write_fd)
+      self.write_segment += 1
+      self.write_fd = os.open(self.segment_path(self.write_segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+      self.segments[self.write_segment] = 0
+
+   """Documentation for a method.
+
+      Apply the overflow policy until `size` more bytes fit on disk
+      returns False if they do not
+   """
+   def make_room(self, size):
+      if size > self.max_bytes - self.segment_size:
+         return False
+      while self.disk_bytes + size > self.max_bytes:
+         if self.overflow == OVERFLOW_REJECT:
+            return False
+         if len(self.segments) == 1:
+            self.roll()
+         oldest = min(self.segments)
+         self.dropped_segments += 1
+         self.dropped_bytes += self.segments[oldest] - (self.read_offset if oldest == self.read_segment else 0)
+         self.remove_segment(oldest)
+         if oldest == self.read_segment:
+            self.read_segment = min(self.segments)
+            self.read_offset = 0
+      return True
+
+   def remove_segment(self, number):
+      self.disk_bytes -= self.segments.pop(number)
+      try: os.remove(self.segment_path(number))
+      except OSError:
+         pass
+
+   def write_checkpoint(self):
+      temporary = self.checkpoint_path() + ".tmp"
+      with open(temporary, "w") as checkpoint:
+         checkpoint.write(str(self.read_segment) + " " + str(self.read_offset) + "\n")
+         if self.fsync == FSYNC_ALWAYS:
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+      os.replace(temporary, self.checkpoint_path())
+
+   """Documentation for a method.
+
+      Number of bytes of the log that have not been sent yet
+   """
+   def pending_bytes(self):
+      with self.lock:
+         return self.pending()
+
+   def pending(self):
+      return self.disk_bytes - sum(size for number, size in self.segments.items() if number < self.read_segment) - self.read_offset
+
+   """Documentation for a method.
+
+      Read the next batch of records, at most batch_size of them and
+      never across a segment boundary
+      returns the segment, offset, records and offset past the records
+   """
+   def read_batch(self):
+      segment, offset = self.read_segment, self.read_offset
+      limit = self.segments[segment]
+      records = []
+      end = offset
+      with open(self.segment_path(segment), "rb") as log:
+         log.seek(offset)
+         while len(records) < self.batch_size and end < limit:
+            line = log.readline()
+            if not line.endswith(b"\n"):
+               break
+            records.append(line[:-1].decode("utf-8"))
+            end += len(line)
+      return segment, offset, records, end
+
+   """Documentation for a method.
+
+      Move past the sent records. Fully sent segments are removed.
+      Nothing is done if the segment was dropped while being sent
+   """
+   def advance(self, segment, offset, end):
+      if segment != self.read_segment or offset != self.read_offset:
+         return
+      self.read_offset = end
+      while self.read_segment != self.write_segment and self.read_offset >= self.segments[self.read_segment]:
+         self.remove_segment(self.read_segment)
+         self.read_segment = min(self.segments)
+         self.read_offset = 0
+      self.write_checkpoint()
+
+   def run(self):
+      while True:
+         with self.lock:
+            while not self.closed and (not self.pending() or not self.connected):
+               if self.fsync == FSYNC_INTERVAL and monotonic() - self.last_sync >= self.fsync_interval:
+                  self.sync()
+               if not self.connected:
+                  break
+               self.changed.wait(self.fsync_interval)
+            if self.closed:
+               return
+            if self.connected:
+               batch = self.read_batch()
+
+         if not self.connected:
+            if self.monolith.is_connected():
+               self.connected = True
+            else:
+               with self.lock:
+                  if not self.closed:
+                     self.changed.wait(self.retry_interval)
+            continue
+
+         segment, offset, records, end = batch
+         if not records:
+            with self.lock:
+               self.advance(segment, offset, end)
+            continue
+
+         sent = 0
+         sent_bytes = 0
+         for record, result in zip(records, self.monolith.request_endpoints(records)):
+            if result.ok() and self.monolith.submission_result(result.body):
+               self.submitted += 1
+            elif result.ok() or (result.error == ERROR_HTTP and not result.is_transient()):
+               # The monolith refused the record, sending it again would not help
+               self.rejected += 1
+            else:
+               self.connected = False
+               break
+            sent += 1
+            sent_bytes += len(record.encode("utf-8")) + 1
+
+         if sent:
+            with self.lock:
+               self.advance(segment, offset, offset + sent_bytes)
+               self.changed.notify_all()
+
+   """Documentation for a method.
+
+      Wait for every queued submission to be sent
+      returns False if that did not happen within `timeout` seconds
+   """
+   def wait_drained(self, timeout=None):
+      deadline = None if timeout is None else monotonic() + timeout
+      with self.lock:
+         while self.pending():
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+               return False
+            self.changed.wait(remaining if remaining is None else min(remaining, 0.05))
+      return True
+
+   """Documentation for a method.
+
+      Stop sending and close the log. Unsent submissions stay on disk
+      and are picked up by the next SubmissionLog on the same directory
+   """
+   def close(self):
+      with self.lock:
+         if self.closed:
+            return
+         self.closed = True
+         self.changed.notify_all()
+      self.thread.join()
+      with self.lock:
+         self.sync()
+         os.close(self.write_fd)
+         self.write_checkpoint()
+
+   def stats(self):
+      with self.lock:
+         return {
+            "pending_bytes": self.pending(),
+            "disk_bytes": self.disk_bytes,
+            "segments": len(self.segments),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "dropped_segments": self.dropped_segments,
+            "dropped_bytes": self.dropped_bytes,
+            "overflows": self.overflows,
+            "connected": self.connected,
+         }
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
@@ -0,0 +1,64 @@
+'''
+   Decode benchmark for the fast-path decoders. Compares decoding a
+   StreamV1 frame and a metric_fetch response through decode_from / json
+   against StreamV1.from_bytes, ReadingV1.from_json_array,
+   ReadingBlock.from_json and ReadingView (building the view, then
+   taking its timestamp and value columns).
+
+   Run with: python tests/bench_decode.py [readings]
+'''
+
+import sys
+import json
+from time import perf_counter
+from pycrate import *
+
+def best_of(fn, repeat=5):
+   best = None
+   for _ in range(0, repeat):
+      start = perf_counter()
+      fn()
+      elapsed = perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+   return best
+
+def decode_stream(frame):
+   stream = StreamV1(0, 0)
+   stream.decode_from(frame.decode("utf-8"))
+   return stream
+
+def decode_response(response):
+   decoded = json.loads(response)
+   return [ReadingV1(r["timestamp"], r["node_id"], r["sensor_id"], r["value"]) for r in decoded["data"]]
+
+def view_columns(response):
+   view = ReadingView.from_json(response)
+   return view.timestamps, view.values
+
+def run(count=100000):
+   stream = StreamV1(0, 0)
+   stream.add_readings([ReadingV1(x, "node-" + str(x % 16), "sensor-" + str(x % 4), x * 0.5) for x in range(0, count)])
+   frame = stream.encode().encode("utf-8")
+   response = ('{"status":200,"data":' + encode_many(stream.readings) + '}').encode("utf-8")
+   array = encode_many(stream.readings).encode("utf-8")
+
+   timings = {
+      "stream_decode_from": best_of(lambda: decode_stream(frame)),
+      "stream_from_bytes": best_of(lambda: StreamV1.from_bytes(frame)),
+      "stream_from_bytes_memoryview": best_of(lambda: StreamV1.from_bytes(memoryview(frame))),
+      "stream_to_block": best_of(lambda: ReadingBlock.from_json(frame)),
+      "fetch_json_readings": best_of(lambda: decode_response(response)),
+      "fetch_from_json_array": best_of(lambda: ReadingV1.from_json_array(array)),
+      "fetch_to_block": best_of(lambda: ReadingBlock.from_json(response)),
+      "fetch_to_view": best_of(lambda: ReadingView.from_json(response)),
+      "fetch_view_columns": best_of(lambda: view_columns(response)),
+   }
+   return {
+      "readings": count,
+      "bytes": len(frame),
+      "readings_per_second": {name: count / seconds for name, seconds in timings.items()},
+   }
+
+if __name__ == "__main__":
+   count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+   print(json.dumps(run(count), indent=2))
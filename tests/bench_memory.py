@@ -0,0 +1,44 @@
+'''
+   Memory benchmark for the slotted V1 types. Compares the bytes held per
+   ReadingV1 against an equivalent __dict__ based class (the layout used
+   before the types gained __slots__).
+
+   Run with: python tests/bench_memory.py [count]
+'''
+
+import sys
+import json
+import tracemalloc
+from pycrate import ReadingV1, FrozenReadingV1
+
+class DictReadingV1:
+   def __init__(self, timestamp, node_id, sensor_id, value):
+      self.timestamp = timestamp
+      self.node_id = node_id
+      self.sensor_id = sensor_id
+      self.value = value
+
+def bytes_per_reading(reading_type, count):
+   node_id = "node"
+   sensor_id = "sensor"
+   tracemalloc.start()
+   before = tracemalloc.get_traced_memory()[0]
+   readings = [reading_type(x, node_id, sensor_id, float(x)) for x in range(0, count)]
+   after = tracemalloc.get_traced_memory()[0]
+   tracemalloc.stop()
+   # Exclude the list holding the readings
+   held = after - before - sys.getsizeof(readings)
+   del readings
+   return held / count
+
+def run(count=100000):
+   return {
+      "count": count,
+      "dict_reading_bytes": bytes_per_reading(DictReadingV1, count),
+      "reading_v1_bytes": bytes_per_reading(ReadingV1, count),
+      "frozen_reading_v1_bytes": bytes_per_reading(FrozenReadingV1, count),
+   }
+
+if __name__ == "__main__":
+   count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+   print(json.dumps(run(count), indent=2))
@@ -0,0 +1,290 @@
+'''
+   Offline performance benchmarks. Runs against FakeMonolith and a local
+   ControlServer, so no monolith is needed, and writes the results as
+   JSON to compare them across releases.
+
+   Measures:
+      submissions       readings submitted per second, one request at a
+                        time, pipelined, and through a ReadingBatcher
+      fetch             metric_fetch_range latency percentiles
+      codecs            encodes / decodes per second of every V1 type,
+                        and of ActionV1 in both frame encodings
+      control_server    actions per second received from N clients, with
+                        json and with binary action frames
+      overload          delay from sending to handling actions that arrive
+                        faster than the callback takes them, without and
+                        with coalescing / load shedding
+
+   Run with: python tests/bench_suite.py [--quick] [--clients N] [--output FILE]
+   Pass --baseline FILE (an earlier output) to list the measurements that
+   got worse by more than --tolerance, exiting with 1 if there are any
+'''
+
+import sys
+import json
+import socket
+import argparse
+import platform
+import threading
+from time import time, sleep, perf_counter
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+"""Documentation for a method.
+
+   Get the given percentiles of a list of latencies, in milliseconds
+"""
+def percentiles(latencies, points=(50, 90, 99)):
+   latencies = sorted(latencies)
+   result = {}
+   for point in points:
+      index = min(len(latencies) - 1, int(len(latencies) * point / 100))
+      result["p" + str(point)] = latencies[index] * 1000.0
+   result["max"] = latencies[-1] * 1000.0
+   return result
+
+"""Documentation for a method.
+
+   Call fn `count` times
+   returns the number of calls per second
+"""
+def rate(fn, count):
+   start = perf_counter()
+   for _ in range(0, count):
+      fn()
+   return count / (perf_counter() - start)
+
+def bench_submissions(count):
+   results = {}
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(0, count)]
+
+      start = perf_counter()
+      for reading in readings:
+         server.metric_submit_reading(reading)
+      results["single_per_second"] = count / (perf_counter() - start)
+
+      start = perf_counter()
+      for offset in range(0, count, 100):
+         server.metric_submit_readings(readings[offset:offset + 100])
+      results["pipelined_per_second"] = count / (perf_counter() - start)
+
+      start = perf_counter()
+      with ReadingBatcher(server, max_readings=100, max_delay=60.0) as batcher:
+         for reading in readings:
+            batcher.add(reading)
+      results["batcher_per_second"] = count / (perf_counter() - start)
+      server.close()
+   return results
+
+def bench_fetch(count, readings_per_fetch):
+   with FakeMonolith() as fake:
+      now = int(time())
+      fake.readings = [{"timestamp": now - readings_per_fetch + x, "node_id": "node",
+                        "sensor_id": "sensor", "value": float(x)} for x in range(0, readings_per_fetch)]
+      server = Monolith(fake.connection)
+      latencies = []
+      for _ in range(0, count):
+         start = perf_counter()
+         server.metric_fetch_range("node", now - readings_per_fetch - 1, now)
+         latencies.append(perf_counter() - start)
+      server.close()
+   results = percentiles(latencies)
+   results["readings_per_fetch"] = readings_per_fetch
+   return results
+
+"""Documentation for a method.
+
+   Build a sample of every V1 type, along with a function making an
+   empty object to decode it into
+"""
+def codec_samples():
+   node = NodeV1("node", "a node")
+   node.add_sensors([NodeV1SensorEntry("sensor-" + str(x), "temperature", "a sensor") for x in range(0, 8)])
+   stream = StreamV1(1, 1)
+   stream.add_readings([ReadingV1(x, "node", "sensor", float(x)) for x in range(0, 100)])
+   controller = ControllerV1("controller", "a controller", IPV4Connection("127.0.0.1", 8080))
+   controller.add_actions([ControllerV1ActionEntry("action-" + str(x), "an action") for x in range(0, 8)])
+   return {
+      "VersionV1": (VersionV1("monolith", "abc", "1", "2", "3"), lambda: VersionV1("", "", "", "", "")),
+      "NodeV1": (node, lambda: NodeV1("", "")),
+      "ReadingV1": (ReadingV1(1, "node", "sensor", 1.5), lambda: ReadingV1(0, "", "", 0.0)),
+      "StreamV1[100]": (stream, lambda: StreamV1(0, 0)),
+      "ActionV1": (ActionV1(1, "controller", "action", 1.5), lambda: ActionV1(0, "", "", 0.0)),
+      "ControllerV1": (controller, lambda: ControllerV1("", "", IPV4Connection("127.0.0.1", 1))),
+      "HeartbeatV1": (HeartbeatV1("node"), lambda: HeartbeatV1("")),
+   }
+
+def bench_codecs(count):
+   results = {}
+   for name, (sample, empty) in codec_samples().items():
+      encoded = sample.encode()
+      scale = 100 if name.startswith("StreamV1") else 1
+      results[name] = {
+         "bytes": len(encoded),
+         "encodes_per_second": rate(sample.encode, max(1, count // scale)),
+         "decodes_per_second": rate(lambda: empty().decode_from(encoded), max(1, count // scale)),
+      }
+   action = ActionV1(1, "controller", "action", 1.5)
+   json_frame = action.encode().encode("utf-8")
+   binary_frame = action.encode_binary()
+   results["ActionV1 json frame"] = {
+      "bytes": len(json_frame),
+      "encodes_per_second": rate(lambda: action.encode().encode("utf-8"), count),
+      "decodes_per_second": rate(lambda: ActionV1.from_frame(json_frame), count),
+   }
+   results["ActionV1 binary frame"] = {
+      "bytes": len(binary_frame),
+      "encodes_per_second": rate(action.encode_binary, count),
+      "decodes_per_second": rate(lambda: ActionV1.from_frame(binary_frame), count),
+   }
+   return results
+
+"""Documentation for a method.
+
+   Send `count` framed actions to a control server, `batch` at a time,
+   encoded as json or binary
+"""
+def send_actions(connection, count, batch=64, binary=False):
+   action = ActionV1(1, "controller", "action", 1.5)
+   encoded = action.encode_binary() if binary else action.encode().encode("utf-8")
+   frame = len(encoded).to_bytes(4, "little") + encoded
+   sock = socket.create_connection((connection.address, connection.port))
+   sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+   sent = 0
+   while sent < count:
+      frames = min(batch, count - sent)
+      sock.sendall(frame * frames)
+      sent += frames
+   sock.close()
+
+def bench_control_server(clients, actions_per_client, binary=False):
+   total = clients * actions_per_client
+   done = threading.Event()
+   received = [0]
+   lock = threading.Lock()
+
+   def callback(action):
+      with lock:
+         received[0] += 1
+         if received[0] == total:
+            done.set()
+
+   with ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=4) as server:
+      senders = [threading.Thread(target=send_actions, args=(server.address, actions_per_client, 64, binary))
+                 for _ in range(0, clients)]
+      start = perf_counter()
+      for sender in senders:
+         sender.start()
+      completed = done.wait(60.0)
+      elapsed = perf_counter() - start
+      for sender in senders:
+         sender.join()
+      stats = server.stats.snapshot()
+   return {
+      "clients": clients,
+      "actions": received[0],
+      "completed": completed,
+      "actions_per_second": received[0] / elapsed,
+      "paused": stats["paused"],
+      "callback_latency": stats["callback_latency"],
+   }
+
+"""Documentation for a method.
+
+   Send bursts of setpoint updates for `keys` actuators to a server whose
+   callback takes `service_time` seconds. Each action carries its send
+   time as its value
+   returns the percentiles of the send to callback delay
+"""
+def bench_overload(actions, keys=10, service_time=0.0005, **options):
+   latencies = []
+
+   def callback(action):
+      latencies.append(perf_counter() - action.value)
+      sleep(service_time)
+
+   with ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=1, **options) as server:
+      sock = socket.create_connection((server.address.address, server.address.port))
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      now = int(time())
+      for sent in range(0, actions, keys):
+         frames = []
+         for x in range(sent, min(actions, sent + keys)):
+            encoded = ActionV1(now, "controller", str(x % keys), perf_counter()).encode().encode("utf-8")
+            frames.append(len(encoded).to_bytes(4, "little") + encoded)
+         sock.sendall(b"".join(frames))
+         sleep(service_time)
+      while server.stats.frames < actions or server.workers.pending():
+         sleep(0.01)
+      sock.close()
+      stats = server.stats.snapshot()
+   results = percentiles(latencies)
+   results.update({"handled": len(latencies), "coalesced": stats["coalesced"], "shed": stats["shed"]})
+   return results
+
+def run(quick=False, clients=8):
+   scale = 10 if quick else 1
+   return {
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "timestamp": int(time()),
+      "results": {
+         "submissions": bench_submissions(5000 // scale),
+         "fetch": bench_fetch(1000 // scale, 1000),
+         "codecs": bench_codecs(50000 // scale),
+         "control_server": bench_control_server(clients, 20000 // scale),
+         "control_server_binary": bench_control_server(clients, 20000 // scale, binary=True),
+         "overload": {
+            "queued": bench_overload(20000 // scale),
+            "coalesce": bench_overload(20000 // scale, coalesce=True),
+            "high_water": bench_overload(20000 // scale, high_water=64),
+         },
+      },
+   }
+
+"""Documentation for a method.
+
+   Compare results against a baseline run. Rates ("*_per_second") are
+   expected not to drop and fetch latencies not to grow by more than
+   `tolerance` (a fraction)
+   returns a list of (measurement, baseline, current) regressions
+"""
+def regressions(baseline, current, tolerance, path=""):
+   found = []
+   for key, value in current.items():
+      if key not in baseline:
+         continue
+      name = path + "/" + key if path else key
+      if isinstance(value, dict):
+         found.extend(regressions(baseline[key], value, tolerance, name))
+      elif key.endswith("_per_second") and value < baseline[key] * (1 - tolerance):
+         found.append((name, baseline[key], value))
+      elif path == "results/fetch" and key.startswith("p") and value > baseline[key] * (1 + tolerance):
+         found.append((name, baseline[key], value))
+   return found
+
+if __name__ == "__main__":
+   parser = argparse.ArgumentParser(description="pycrate benchmarks")
+   parser.add_argument("--quick", action="store_true", help="run a tenth of the iterations")
+   parser.add_argument("--clients", type=int, default=8, help="concurrent control server clients")
+   parser.add_argument("--output", help="file to write the JSON results to, stdout by default")
+   parser.add_argument("--baseline", help="earlier results to check for regressions")
+   parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fraction of slow down")
+   args = parser.parse_args()
+
+   current = run(args.quick, args.clients)
+   results = json.dumps(current, indent=2)
+   if args.output:
+      with open(args.output, "w") as output:
+         output.write(results + "\n")
+   else:
+      print(results)
+
+   if args.baseline:
+      with open(args.baseline) as baseline:
+         found = regressions(json.load(baseline), current, args.tolerance)
+      for name, before, after in found:
+         print("Regression in " + name + ": " + format(before, ".6g") + " -> " + format(after, ".6g"), file=sys.stderr)
+      sys.exit(1 if found else 0)
@@ -0,0 +1,169 @@
+'''
+   In-process stand-in for a monolith, implementing the HTTP endpoints
+   used by pycrate.Monolith. Lets the client be tested without a real
+   monolith running on 0.0.0.0:8080
+'''
+
+import json
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pycrate import IPV4Connection
+
+class FakeMonolithHandler(BaseHTTPRequestHandler):
+   protocol_version = "HTTP/1.1"
+   disable_nagle_algorithm = True
+
+   def setup(self):
+      super().setup()
+      with self.server.monolith.lock:
+         self.server.monolith.connections += 1
+
+   def log_message(self, format, *args):
+      pass
+
+   def do_GET(self):
+      monolith = self.server.monolith
+      path = urllib.parse.unquote(self.path)
+      with monolith.lock:
+         monolith.requests += 1
+         drop = monolith.drop_requests > 0
+         if drop:
+            monolith.drop_requests -= 1
+      if drop:
+         self.close_connection = True
+         return
+      try: body = monolith.handle(path) if monolith.available else None
+      except ValueError:
+         self.send_response(400)
+         self.send_header("Content-Length", "0")
+         self.end_headers()
+         return
+      if body is None:
+         self.send_response(404 if monolith.available else 503)
+         self.send_header("Content-Length", "0")
+         self.end_headers()
+         return
+      encoded = body.encode("utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(encoded)))
+      self.end_headers()
+      self.wfile.write(encoded)
+
+def status(code, data):
+   return json.dumps({"status": code, "data": data})
+
+class FakeMonolith:
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.registrar = {}
+      self.readings = []
+      self.heartbeats = []
+      self.streams = []
+      self.connections = 0
+      self.requests = 0
+      self.available = True
+      self.drop_requests = 0
+      self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeMonolithHandler)
+      self.httpd.daemon_threads = True
+      self.httpd.monolith = self
+      self.thread = None
+
+   @property
+   def connection(self):
+      return IPV4Connection("127.0.0.1", self.httpd.server_address[1])
+
+   def start(self):
+      self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                     kwargs={"poll_interval": 0.05},
+                                     daemon=True)
+      self.thread.start()
+      return self
+
+   def stop(self):
+      self.httpd.shutdown()
+      self.httpd.server_close()
+      self.thread.join()
+
+   def __enter__(self):
+      return self.start()
+
+   def __exit__(self, *args):
+      self.stop()
+
+   def handle(self, path):
+      parts = path.split("/", 4)[1:]
+      with self.lock:
+         if parts == [""]:
+            return status(200, "Monolith")
+         if parts == ["version"]:
+            return json.dumps({"status": 200, "data": {
+               "name": "Monolith", "hash": "fake",
+               "version_major": "0", "version_minor": "0", "version_patch": "0"}})
+         if parts[0] == "registrar":
+            return self.handle_registrar(parts[1:])
+         if parts[0] == "metric":
+            return self.handle_metric(path.split("/", 3)[2:])
+      return None
+
+   def handle_registrar(self, parts):
+      command = parts[0]
+      if command == "add":
+         self.registrar[parts[1]] = "/".join(parts[2:])
+         return status(200, "success")
+      if command == "probe":
+         return status(200, "found" if parts[1] in self.registrar else "not found")
+      if command == "fetch":
+         if parts[1] not in self.registrar:
+            return status(200, "not found")
+         return self.registrar[parts[1]]
+      if command == "delete":
+         self.registrar.pop(parts[1], None)
+         return status(200, "success")
+      return None
+
+   def handle_metric(self, parts):
+      command = parts[0]
+      if command == "submit":
+         self.readings.append(json.loads(parts[1]))
+         return status(200, "success")
+      if command == "heartbeat":
+         self.heartbeats.append(json.loads(parts[1])["heartbeat"])
+         return status(200, "success")
+      if command == "stream":
+         action, address, port = parts[1].split("/")
+         if action == "add":
+            self.streams.append((address, int(port)))
+         else:
+            self.streams.remove((address, int(port)))
+         return status(200, "success")
+      if command == "fetch":
+         return self.handle_fetch(parts[1].split("/"))
+      return None
+
+   def handle_fetch(self, parts):
+      if parts == ["nodes"]:
+         nodes = []
+         for reading in self.readings:
+            if reading["node_id"] not in nodes:
+               nodes.append(reading["node_id"])
+         return status(200, nodes)
+      node_readings = [r for r in self.readings if r["node_id"] == parts[0]]
+      if parts[1] == "sensors":
+         sensors = []
+         for reading in node_readings:
+            if reading["sensor_id"] not in sensors:
+               sensors.append(reading["sensor_id"])
+         return status(200, sensors)
+      if parts[1] == "range":
+         start, end = int(parts[2]), int(parts[3])
+         selected = [r for r in node_readings if start < r["timestamp"] < end]
+      elif parts[1] == "after":
+         selected = [r for r in node_readings if r["timestamp"] > int(parts[2])]
+      elif parts[1] == "before":
+         selected = [r for r in node_readings if r["timestamp"] < int(parts[2])]
+      else:
+         return None
+      selected.sort(key=lambda r: r["timestamp"])
+      return status(200, selected)
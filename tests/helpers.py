@@ -0,0 +1,24 @@
+'''
+   Helpers shared by the tests: polling for a condition, and sending
+   framed actions to a control server
+'''
+
+import socket
+from time import sleep, monotonic
+
+def wait_for(condition, timeout=5.0):
+   deadline = monotonic() + timeout
+   while not condition():
+      if monotonic() > deadline:
+         return False
+      sleep(0.01)
+   return True
+
+def frame(action, binary=False):
+   encoded = action.encode_binary() if binary else action.encode().encode("utf-8")
+   return len(encoded).to_bytes(4, "little") + encoded
+
+def send(server, actions):
+   client = socket.create_connection(("127.0.0.1", server.address.port))
+   client.sendall(b"".join(frame(action) for action in actions))
+   client.close()
@@ -0,0 +1,70 @@
+import asyncio
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def test_async_registrar():
+   async def run(connection):
+      async with AsyncMonolith(connection) as server:
+         assert(await server.is_connected())
+         node = NodeV1("async-node", "a node")
+         node.add_sensor(NodeV1SensorEntry("0", "temp", "a sensor"))
+         assert(await server.registrar_add_node(node))
+         assert(await server.registrar_probe(node.id))
+         assert(not await server.registrar_probe("missing"))
+         fetched = await server.registrar_fetch_node(node.id)
+         assert(fetched.id == node.id)
+         assert(len(fetched.sensors) == 1)
+         assert(await server.registrar_delete(node.id))
+         assert(await server.registrar_fetch_node(node.id) is None)
+         controller = ControllerV1("async-controller", "a controller", IPV4Connection("127.0.0.1", 1))
+         controller.add_action(ControllerV1ActionEntry("a", "an action"))
+         assert(await server.registrar_add_controller(controller))
+         fetched = await server.registrar_fetch_controller(controller.id)
+         assert(fetched.port == 1 and fetched.actions[0].id == "a")
+         assert(await server.registrar_fetch_controller("missing") is None)
+         version = await server.get_version()
+         assert(version.name == "Monolith")
+
+   with FakeMonolith() as fake:
+      asyncio.run(run(fake.connection))
+
+def test_async_concurrent_submit():
+   async def run(connection):
+      async with AsyncMonolith(connection, max_concurrency=8) as server:
+         readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(1, 201)]
+         results = await server.metric_submit_readings(readings)
+         assert(results == [True] * 200)
+         fetched = await server.metric_fetch_range("node", 0, 1000)
+         assert(len(fetched) == 200)
+         assert(await server.metric_fetch_nodes() == ["node"])
+
+   with FakeMonolith() as fake:
+      asyncio.run(run(fake.connection))
+      assert(fake.connections <= 8)
+
+def test_async_unreachable():
+   async def run():
+      async with AsyncMonolith(IPV4Connection("127.0.0.1", 1), timeout=1.0) as server:
+         assert(not await server.is_connected())
+         assert(await server.metric_submit_heartbeat(HeartbeatV1("node")) is None)
+
+   asyncio.run(run())
+
+def test_async_no_resend_of_submit_after_server_close():
+   async def run(fake):
+      async with AsyncMonolith(fake.connection) as server:
+         assert(await server.is_connected())
+         fake.drop_requests = 1
+         before = fake.requests
+         assert(await server.metric_submit_reading(ReadingV1(1, "node", "sensor", 1.0)) is None)
+         assert(fake.requests == before + 1)
+         assert(len(fake.readings) == 0)
+
+         # Reads are still sent again on a new connection
+         assert(await server.is_connected())
+         fake.drop_requests = 1
+         assert(await server.registrar_probe("missing") is False)
+         assert(fake.drop_requests == 0)
+
+   with FakeMonolith() as fake:
+      asyncio.run(run(fake))
@@ -0,0 +1,72 @@
+from time import sleep
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def test_submit_readings():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(0, 100)]
+      results = server.metric_submit_readings(readings)
+      assert(results == [True] * 100)
+      assert([r["timestamp"] for r in fake.readings] == list(range(0, 100)))
+      assert(fake.connections == 1)
+      server.close()
+
+def test_submit_readings_partial_failure():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(0, 10)]
+      endpoints = ["/metric/submit/" + r.encode() for r in readings]
+      endpoints[4] = "/metric/unknown"
+      results = [server.submission_result(r) for r in server.fetch_endpoints(endpoints)]
+      assert(results[4] is None)
+      assert(results[:4] == [True] * 4 and results[5:] == [True] * 5)
+      assert(len(fake.readings) == 9)
+      server.close()
+
+def test_batcher_size_limit():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      flushed = []
+      batcher = ReadingBatcher(server, max_readings=10, max_delay=60.0,
+                               callback=lambda stream, results: flushed.append((stream, results)))
+      for x in range(0, 25):
+         batcher.add(ReadingV1(x, "node", "sensor", 1.0))
+      assert(len(flushed) == 2)
+      assert([len(stream.readings) for stream, _ in flushed] == [10, 10])
+      assert([stream.sequence for stream, _ in flushed] == [0, 1])
+      batcher.close()
+      assert(len(flushed) == 3)
+      assert(len(fake.readings) == 25)
+      assert(batcher.submitted == 25 and batcher.failed == 0)
+
+def test_batcher_byte_limit():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      batcher = ReadingBatcher(server, max_bytes=1, max_delay=60.0)
+      batcher.add(ReadingV1(1, "node", "sensor", 1.0))
+      assert(len(fake.readings) == 1)
+      batcher.close()
+
+def test_batcher_deadline():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      batcher = ReadingBatcher(server, max_delay=0.05)
+      batcher.add(ReadingV1(1, "node", "sensor", 1.0))
+      sleep(0.5)
+      assert(len(fake.readings) == 1)
+      batcher.close()
+
+def test_batcher_survives_callback_errors():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      def fail(stream, results):
+         raise Exception("callback error")
+      batcher = ReadingBatcher(server, max_delay=0.05, callback=fail)
+      batcher.add(ReadingV1(1, "node", "sensor", 1.0))
+      sleep(0.3)
+      batcher.add(ReadingV1(2, "node", "sensor", 1.0))
+      sleep(0.3)
+      assert(len(fake.readings) == 2)
+      assert(batcher.thread.is_alive())
+      batcher.close()
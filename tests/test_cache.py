@@ -0,0 +1,159 @@
+from time import sleep, time
+from pycrate import *
+from pycrate.cache import MISS
+from fake_monolith import FakeMonolith, status
+
+def test_registrar_cache_hits_and_invalidation():
+   with FakeMonolith() as fake:
+      cache = RegistrarCache(ttl=60.0)
+      server = Monolith(fake.connection, registrar_cache=cache)
+      node = NodeV1("node", "a node")
+      assert(server.registrar_add_node(node))
+
+      requests = fake.requests
+      for _ in range(0, 10):
+         assert(server.registrar_probe("node"))
+         assert(server.registrar_fetch_node("node").id == "node")
+      assert(fake.requests == requests + 2)
+      assert(cache.stats()["hits"] == 18)
+
+      # Negative results are cached too
+      assert(not server.registrar_probe("missing"))
+      assert(not server.registrar_probe("missing"))
+      assert(server.registrar_fetch_controller("missing") is None)
+      assert(server.registrar_fetch_controller("missing") is None)
+      assert(fake.requests == requests + 4)
+
+      # Adding / deleting drops what was cached for the id
+      controller = ControllerV1("missing", "now here", IPV4Connection("127.0.0.1", 1))
+      assert(server.registrar_add_controller(controller))
+      assert(server.registrar_probe("missing"))
+      assert(server.registrar_fetch_controller("missing").description == "now here")
+      assert(server.registrar_delete("node"))
+      assert(server.registrar_fetch_node("node") is None)
+      server.close()
+
+def test_registrar_cache_without_negative_caching():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, registrar_cache=RegistrarCache(negative_caching=False))
+      assert(not server.registrar_probe("missing"))
+      fake.registrar["missing"] = "{}"
+      assert(server.registrar_probe("missing"))
+      server.close()
+
+def test_registrar_cache_skips_errors():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, registrar_cache=RegistrarCache(ttl=60.0))
+      handle = fake.handle
+      fake.handle = lambda path: status(500, "error") if path.startswith("/registrar/probe/") else handle(path)
+      assert(server.registrar_probe("node") is False)
+      fake.handle = handle
+      fake.registrar["node"] = "{}"
+      assert(server.registrar_probe("node"))
+      server.close()
+
+def test_registrar_cache_ttl_and_lru():
+   cache = RegistrarCache(ttl=0.05, max_size=2)
+   cache.put("probe", "a", True)
+   cache.put("probe", "b", True)
+   assert(cache.get("probe", "a") is True)
+   cache.put("probe", "c", True)
+   assert(cache.get("probe", "b") is MISS)
+   assert(cache.stats()["evictions"] == 1)
+   sleep(0.1)
+   assert(cache.get("probe", "a") is MISS)
+   assert(cache.stats()["expirations"] == 1)
+
+def reading(timestamp):
+   return {"timestamp": timestamp, "node_id": "node", "sensor_id": "s", "value": float(timestamp)}
+
+def test_metric_cache_fetches_only_gaps():
+   with FakeMonolith() as fake:
+      now = int(time())
+      fake.readings = [reading(t) for t in range(now - 1000, now)]
+      cache = MetricCache(settle=100)
+      server = Monolith(fake.connection, metric_cache=cache)
+
+      assert(server.metric_fetch_range("node", now - 900, now - 800) == fake.readings[101:200])
+      assert(server.metric_fetch_range("node", now - 700, now - 600) == fake.readings[301:400])
+      requests = fake.requests
+      # Overlapping query: only the two gaps around the cached ranges are fetched
+      assert(server.metric_fetch_range("node", now - 950, now - 650) == fake.readings[51:350])
+      assert(fake.requests == requests + 2)
+      assert(cache.series[(server.host, "node")].covered == [(now - 949, now - 601)])
+
+      requests = fake.requests
+      assert(server.metric_fetch_range("node", now - 900, now - 700) == fake.readings[101:300])
+      assert(fake.requests == requests)
+      assert(cache.stats()["hits"] == 1)
+
+      # Polling: the settled part is kept, only the recent tail is refetched
+      assert(server.metric_fetch_after("node", now - 500) == fake.readings[501:])
+      requests = fake.requests
+      fake.readings.append(reading(now))
+      assert(server.metric_fetch_after("node", now - 500) == fake.readings[501:])
+      assert(fake.requests == requests + 1)
+      assert(server.metric_fetch_before("node", now - 900) == fake.readings[:100])
+      server.close()
+
+def test_metric_cache_evicts_oldest():
+   with FakeMonolith() as fake:
+      now = int(time())
+      fake.readings = [reading(t) for t in range(now - 1000, now - 500)]
+      cache = MetricCache(max_readings=150, settle=100)
+      server = Monolith(fake.connection, metric_cache=cache)
+
+      assert(len(server.metric_fetch_range("node", now - 1001, now - 900)) == 100)
+      assert(len(server.metric_fetch_range("node", now - 801, now - 700)) == 100)
+      assert(cache.stats()["readings"] == 150)
+      assert(cache.stats()["evictions"] == 50)
+      assert(cache.series[(server.host, "node")].covered == [(now - 950, now - 901), (now - 800, now - 701)])
+
+      # Evicted readings are fetched again when asked for
+      assert(server.metric_fetch_range("node", now - 1001, now - 900) == fake.readings[:100])
+      server.close()
+
+def test_metric_cache_per_monolith_copies():
+   now = int(time())
+   cache = MetricCache(settle=100)
+   with FakeMonolith() as first, FakeMonolith() as second:
+      first.readings = [reading(t) for t in range(now - 1000, now - 500)]
+      second.readings = [dict(reading(t), value=2.0) for t in range(now - 1000, now - 500)]
+      first_server = Monolith(first.connection, metric_cache=cache)
+      second_server = Monolith(second.connection, metric_cache=cache)
+
+      readings = first_server.metric_fetch_range("node", now - 1001, now - 900)
+      assert(second_server.metric_fetch_range("node", now - 1001, now - 900) == second.readings[:100])
+
+      # Changing returned readings does not change what is cached
+      readings[0]["value"] = -1.0
+      assert(first_server.metric_fetch_range("node", now - 1001, now - 900) == first.readings[:100])
+      cache.invalidate("node")
+      assert(cache.stats()["readings"] == 0)
+      first_server.close()
+      second_server.close()
+
+def test_metric_cache_fractional_settle():
+   with FakeMonolith() as fake:
+      now = int(time())
+      fake.readings = [reading(t) for t in range(now - 1000, now)]
+      server = Monolith(fake.connection, metric_cache=MetricCache(settle=100.5))
+      # Fetched intervals are given whole timestamps
+      assert(server.metric_fetch_after("node", now - 500) == fake.readings[501:])
+      server.close()
+
+class InvalidatingMonolith(Monolith):
+   def fetch_data(self, endpoint):
+      self.metric_cache.invalidate("node")
+      return super().fetch_data(endpoint)
+
+def test_metric_cache_invalidated_during_fetch():
+   with FakeMonolith() as fake:
+      now = int(time())
+      fake.readings = [reading(t) for t in range(now - 1000, now - 500)]
+      cache = MetricCache(max_readings=50, settle=100)
+      server = InvalidatingMonolith(fake.connection, metric_cache=cache)
+      assert(server.metric_fetch_range("node", now - 1001, now - 900) == fake.readings[:100])
+      assert(cache.stats()["readings"] == 0)
+      assert(server.metric_fetch_range("node", now - 801, now - 700) == fake.readings[200:300])
+      server.close()
@@ -0,0 +1,265 @@
+import socket
+import threading
+from time import time, sleep, monotonic
+from pycrate import *
+from pycrate.control_server import FrameDecoder
+from helpers import wait_for, frame, send
+
+def free_port():
+   sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   sock.bind(("127.0.0.1", 0))
+   port = sock.getsockname()[1]
+   sock.close()
+   return port
+
+def test_frame_decoder_partial_reads():
+   decoder = FrameDecoder()
+   data = frame(ActionV1(1, "c", "a", 1.0)) + frame(ActionV1(2, "c", "b", 2.0))
+   frames = []
+   for x in range(0, len(data)):
+      frames += decoder.feed(data[x:x + 1])
+   assert(len(frames) == 2)
+   assert(frames[1] == ActionV1(2, "c", "b", 2.0).encode().encode("utf-8"))
+
+def test_frame_decoder_limit():
+   decoder = FrameDecoder(max_frame_size=8)
+   try:
+      decoder.feed((9).to_bytes(4, "little"))
+      assert(False)
+   except Exception:
+      pass
+
+def test_concurrent_clients():
+   port = free_port()
+   received = []
+   lock = threading.Lock()
+
+   def callback_fn(action):
+      with lock:
+         received.append(action)
+
+   control_server_start(IPV4Connection("127.0.0.1", port), callback_fn)
+   try:
+      clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(0, 20)]
+      for index, client in enumerate(clients):
+         data = b"".join(frame(ActionV1(x, "controller", str(index), float(x))) for x in range(0, 10))
+         # Split frames across sends to exercise reassembly
+         client.sendall(data[:7])
+         client.sendall(data[7:])
+      for client in clients:
+         client.close()
+      assert(wait_for(lambda: len(received) == 200))
+   finally:
+      control_server_stop()
+
+def test_slow_callback_does_not_block_others():
+   port = free_port()
+   received = []
+   release = threading.Event()
+
+   def callback_fn(action):
+      if action.action_id == "slow":
+         release.wait(5.0)
+      received.append(action.action_id)
+
+   control_server_start(IPV4Connection("127.0.0.1", port), callback_fn, workers=2)
+   try:
+      slow = socket.create_connection(("127.0.0.1", port))
+      slow.sendall(frame(ActionV1(0, "c", "slow", 0.0)))
+      fast = socket.create_connection(("127.0.0.1", port))
+      fast.sendall(frame(ActionV1(0, "c", "fast", 0.0)))
+      assert(wait_for(lambda: "fast" in received))
+      release.set()
+      assert(wait_for(lambda: "slow" in received))
+      slow.close()
+      fast.close()
+   finally:
+      control_server_stop()
+
+def test_stop_is_prompt_and_restartable():
+   port = free_port()
+   for _ in range(0, 2):
+      control_server_start(IPV4Connection("127.0.0.1", port), lambda action: None)
+      start = monotonic()
+      control_server_stop()
+      assert(monotonic() - start < 1.0)
+
+def test_backpressure_delivers_everything():
+   port = free_port()
+   received = []
+
+   def callback_fn(action):
+      sleep(0.001)
+      received.append(action.timestamp)
+
+   control_server_start(IPV4Connection("127.0.0.1", port), callback_fn, workers=1, queue_size=2)
+   try:
+      client = socket.create_connection(("127.0.0.1", port))
+      client.sendall(b"".join(frame(ActionV1(x, "c", "a", 0.0)) for x in range(0, 100)))
+      assert(wait_for(lambda: len(received) == 100))
+      assert(received == list(range(0, 100)))
+      client.close()
+   finally:
+      control_server_stop()
+
+def test_many_servers_share_one_loop():
+   loop = ControlLoop()
+   received = []
+   servers = []
+   for index in range(0, 10):
+      server = ControlServer(IPV4Connection("127.0.0.1", 0),
+                             lambda action, index=index: received.append((index, action.action_id)),
+                             workers=1,
+                             loop=loop)
+      server.start()
+      servers.append(server)
+
+   threads_before = threading.active_count()
+   for index, server in enumerate(servers):
+      send(server, [ActionV1(0, "c", str(index), 0.0)])
+
+   assert(wait_for(lambda: len(received) == 10))
+   assert(sorted(received) == [(x, str(x)) for x in range(0, 10)])
+   assert(threading.active_count() == threads_before)
+   for server in servers:
+      assert(server.stats.accepted == 1)
+      assert(server.stats.actions == 1)
+      server.stop()
+   loop.stop()
+
+def test_server_restart():
+   server = ControlServer(IPV4Connection("127.0.0.1", 0), lambda action: None)
+   server.start()
+   port = server.address.port
+   server.stop()
+   server.connection = IPV4Connection("127.0.0.1", port)
+   with server:
+      client = socket.create_connection(("127.0.0.1", port))
+      client.sendall(frame(ActionV1(0, "c", "a", 0.0)) + (5).to_bytes(4, "little") + b"bogus")
+      client.close()
+      assert(wait_for(lambda: server.stats.actions == 1 and server.stats.decode_failures == 1))
+      assert(server.stats.frames == 2)
+
+def test_mixed_json_and_binary_frames():
+   received = []
+   with ControlServer(IPV4Connection("127.0.0.1", 0), lambda action: received.append(action)) as server:
+      client = socket.create_connection(("127.0.0.1", server.address.port))
+      client.sendall(b"".join(frame(ActionV1(x, "c", "ä" + str(x), x * 0.5), binary=x % 2 == 1) for x in range(0, 10)))
+      # A complete frame holding a truncated binary action is a decode
+      # failure, not a crash
+      truncated = ActionV1(10, "c", "a", 0.0).encode_binary()[:-1]
+      client.sendall(len(truncated).to_bytes(4, "little") + truncated)
+      client.sendall(frame(ActionV1(11, "c", "b", 1.0), binary=True))
+      client.close()
+      assert(wait_for(lambda: len(received) == 11 and server.stats.decode_failures == 1))
+      # Several workers run the callback, so actions may be seen out of order
+      received.sort(key=lambda action: action.timestamp)
+      assert(received.pop().timestamp == 11)
+      assert([(a.timestamp, a.action_id, a.value) for a in received] == [(x, "ä" + str(x), x * 0.5) for x in range(0, 10)])
+
+def blocked_server(**options):
+   release = threading.Event()
+   started = threading.Event()
+   received = []
+
+   def callback_fn(action):
+      started.set()
+      release.wait(5.0)
+      received.append((action.action_id, action.value))
+
+   server = ControlServer(IPV4Connection("127.0.0.1", 0), callback_fn, workers=1, **options)
+   server.start()
+   client = socket.create_connection(("127.0.0.1", server.address.port))
+   client.sendall(frame(ActionV1(int(time()), "c", "first", 0.0)))
+   assert(started.wait(5.0))
+   return server, client, release, received
+
+def test_coalescing_keeps_latest_value():
+   server, client, release, received = blocked_server(coalesce=True)
+   now = int(time())
+   client.sendall(b"".join(frame(ActionV1(now, "c", "set", float(x))) for x in range(0, 100)) +
+                  frame(ActionV1(now, "c", "other", 1.0)) +
+                  frame(ActionV1(now, "c", "set", 100.0)) +
+                  # An older action does not replace a newer queued one
+                  frame(ActionV1(now - 1, "c", "set", -1.0)))
+   assert(wait_for(lambda: server.stats.frames == 104))
+   assert(server.workers.pending() == 2)
+   release.set()
+   assert(wait_for(lambda: len(received) == 3))
+   # The coalesced action keeps its place ahead of "other"
+   assert(received == [("first", 0.0), ("set", 100.0), ("other", 1.0)])
+   assert(server.stats.coalesced == 101)
+   client.close()
+   server.stop()
+
+def test_expired_actions_are_dropped():
+   server, client, release, received = blocked_server(max_age=30)
+   now = int(time())
+   client.sendall(frame(ActionV1(now - 60, "c", "stale", 0.0)) + frame(ActionV1(now, "c", "fresh", 0.0)))
+   assert(wait_for(lambda: server.workers.pending() == 2))
+   release.set()
+   assert(wait_for(lambda: len(received) == 2 and server.stats.expired == 1))
+   assert([action_id for action_id, _ in received] == ["first", "fresh"])
+   client.close()
+   server.stop()
+
+def test_load_shedding_above_high_water():
+   server, client, release, received = blocked_server(queue_size=10, high_water=5)
+   now = int(time())
+   client.sendall(b"".join(frame(ActionV1(now, "c", str(x), 0.0)) for x in range(0, 50)))
+   assert(wait_for(lambda: server.stats.frames == 51))
+   # Shedding instead of pausing keeps the queue, and the delay, bounded
+   assert(server.workers.pending() == 5 and server.stats.shed == 45)
+   assert(server.stats.paused == 0)
+   release.set()
+   assert(wait_for(lambda: len(received) == 6))
+   # The oldest actions are the ones dropped
+   assert([action_id for action_id, _ in received] == ["first", "45", "46", "47", "48", "49"])
+   client.close()
+   server.stop()
+
+class FailingServer(ControlServer):
+   def submit(self, action):
+      if action.action_id == "fail":
+         raise Exception("submit failed")
+      return super().submit(action)
+
+def test_loop_survives_submit_errors():
+   loop = ControlLoop()
+   received = []
+   with FailingServer(IPV4Connection("127.0.0.1", 0), lambda action: received.append(action.action_id), loop=loop) as server:
+      client = socket.create_connection(("127.0.0.1", server.address.port))
+      client.sendall(frame(ActionV1(0, "c", "fail", 0.0)))
+      # The failing connection is closed, the loop keeps serving others
+      assert(client.recv(16) == b"")
+      client.close()
+      client = socket.create_connection(("127.0.0.1", server.address.port))
+      client.sendall(frame(ActionV1(0, "c", "ok", 0.0)))
+      assert(wait_for(lambda: received == ["ok"]))
+      assert(loop.thread.is_alive())
+      client.close()
+   loop.stop()
+
+def test_call_on_dead_loop():
+   loop = ControlLoop()
+   # A loop whose thread ended without the loop being stopped
+   loop.running = True
+   loop.thread = threading.Thread(target=lambda: None)
+   loop.thread.start()
+   loop.thread.join()
+   try:
+      loop.call(lambda: None)
+      assert(False)
+   except AssertionError:
+      raise
+   except Exception:
+      pass
+
+def test_servers_share_default_workers():
+   first = ControlServer(IPV4Connection("127.0.0.1", 0), lambda action: None)
+   second = ControlServer(IPV4Connection("127.0.0.1", 0), lambda action: None)
+   with first, second:
+      assert(first.workers is second.workers is ActionWorkers.default())
+   own = ControlServer(IPV4Connection("127.0.0.1", 0), lambda action: None, coalesce=True)
+   with own:
+      assert(own.workers is not ActionWorkers.default())
@@ -0,0 +1,131 @@
+import socket
+import threading
+from pycrate import *
+from fake_monolith import FakeMonolith
+from helpers import wait_for
+
+def register(server, controller_id, port):
+   controller = ControllerV1(controller_id, "a controller", IPV4Connection("127.0.0.1", port))
+   assert(server.registrar_add_controller(controller))
+
+def collector():
+   received = []
+   lock = threading.Lock()
+   def callback(action):
+      with lock:
+         received.append((action.controller_id, action.timestamp))
+   return received, callback
+
+def test_fan_out_to_many_controllers():
+   received, callback = collector()
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      loop = ControlLoop()
+      controllers = [ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=1, loop=loop) for _ in range(0, 5)]
+      ids = []
+      for index, controller in enumerate(controllers):
+         controller.start()
+         ids.append("controller-" + str(index))
+         register(server, ids[-1], controller.address.port)
+
+      for binary in (False, True):
+         with ActionDispatcher(server, binary=binary) as dispatcher:
+            requests = fake.requests
+            for timestamp in range(0, 20):
+               assert(all(dispatcher.fan_out(ids, "act", 1.5, timestamp)))
+            assert(dispatcher.flush(5.0))
+            # Endpoints are looked up once and then cached
+            assert(fake.requests - requests == 5)
+            stats = dispatcher.stats()
+            assert(stats["sent"] == 100 and stats["connected"] == 5 and stats["queued"] == 0)
+            # One persistent connection per controller
+            assert(all(dispatcher.status(id)["connects"] == 1 for id in ids))
+            assert(dispatcher.send(ActionV1(0, "missing", "act", 0.0)) is False)
+            assert(dispatcher.stats()["lookup_failures"] == 1)
+
+      assert(wait_for(lambda: len(received) == 200))
+      for id in ids:
+         assert([t for c, t in received if c == id] == list(range(0, 20)) * 2)
+      for controller in controllers:
+         controller.stop()
+      loop.stop()
+      server.close()
+
+def test_reconnects_after_controller_restart():
+   received, callback = collector()
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      controller = ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=1)
+      controller.start()
+      port = controller.address.port
+      register(server, "c", port)
+
+      policy = TransportPolicy(backoff=0.01, max_backoff=0.05)
+      with ActionDispatcher(server, policy=policy) as dispatcher:
+         assert(dispatcher.send(ActionV1(0, "c", "act", 0.0)))
+         assert(wait_for(lambda: len(received) == 1))
+         controller.stop()
+         assert(wait_for(lambda: not dispatcher.status("c")["connected"]))
+
+         # Queued while the controller is down, delivered once it is back
+         for timestamp in range(1, 10):
+            assert(dispatcher.send(ActionV1(timestamp, "c", "act", 0.0)))
+         assert(wait_for(lambda: dispatcher.status("c")["errors"] >= 2))
+         controller.connection = IPV4Connection("127.0.0.1", port)
+         controller.start()
+         assert(dispatcher.flush(5.0))
+         assert(wait_for(lambda: len(received) == 10))
+         assert([t for c, t in received] == list(range(0, 10)))
+      controller.stop()
+      server.close()
+
+def test_slow_controller_does_not_block_others():
+   received, callback = collector()
+   stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   stalled.bind(("127.0.0.1", 0))
+   stalled.listen(1)
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      fast = ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=1)
+      fast.start()
+      register(server, "fast", fast.address.port)
+      register(server, "stalled", stalled.getsockname()[1])
+
+      with ActionDispatcher(server, queue_size=8) as dispatcher:
+         # Never read, so the socket buffers fill up and the queue with them
+         big = "x" * 60000
+         results = [dispatcher.send(ActionV1(x, "stalled", big, 0.0)) for x in range(0, 400)]
+         assert(not all(results))
+         assert(dispatcher.status("stalled")["dropped"] > 0)
+         for timestamp in range(0, 50):
+            # The queue of the fast controller is small too, retry when it is full
+            action = ActionV1(timestamp, "fast", "act", 0.0)
+            assert(wait_for(lambda: dispatcher.send(action)))
+         assert(wait_for(lambda: len(received) == 50))
+         assert([t for c, t in received] == list(range(0, 50)))
+         assert(dispatcher.flush(0.2) is False)
+      fast.stop()
+      server.close()
+   stalled.close()
+
+def test_unresolvable_controller_does_not_stop_others():
+   received, callback = collector()
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      good = ControlServer(IPV4Connection("127.0.0.1", 0), callback, workers=1)
+      good.start()
+      register(server, "good", good.address.port)
+      bad = ControllerV1("bad", "a controller", IPV4Connection("no-such-host.invalid", 5000))
+      assert(server.registrar_add_controller(bad))
+
+      policy = TransportPolicy(backoff=0.01, max_backoff=0.05)
+      with ActionDispatcher(server, policy=policy) as dispatcher:
+         assert(dispatcher.send(ActionV1(0, "bad", "act", 0.0)))
+         assert(wait_for(lambda: dispatcher.status("bad")["errors"] >= 1))
+         assert(dispatcher.thread.is_alive())
+         assert(not dispatcher.status("bad")["connected"])
+         assert(dispatcher.send(ActionV1(1, "good", "act", 0.0)))
+         assert(wait_for(lambda: len(received) == 1))
+         assert(dispatcher.stats()["connected"] == 1)
+      good.stop()
+      server.close()
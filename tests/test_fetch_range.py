@@ -0,0 +1,91 @@
+from pycrate import *
+from pycrate.monolith import iter_response_data
+from fake_monolith import FakeMonolith
+
+def submit_readings(server, timestamps):
+   readings = [ReadingV1(t, "node", "sensor-" + str(t % 2), float(t)) for t in timestamps]
+   assert(all(server.metric_submit_readings(readings)))
+
+def test_iter_response_data():
+   response = b' { "status" : 200 , "data" : [ {"a": 1} , {"a": [2]} ] } '
+   assert(list(iter_response_data(response)) == [{"a": 1}, {"a": [2]}])
+   assert(list(iter_response_data('{"data":[],"status":200}')) == [])
+   try:
+      list(iter_response_data('{"status":500,"data":"error"}'))
+      assert(False)
+   except Exception:
+      pass
+
+def test_iter_metric_range_matches_fetch_range():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      # Submit out of order, including readings on window boundaries
+      submit_readings(server, [50, 10, 11, 19, 20, 21, 30, 99, 100, 1, 0])
+
+      expected = [r["timestamp"] for r in server.metric_fetch_range("node", 0, 100)]
+      for window in [1, 3, 10, 1000]:
+         for prefetch in [0, 1, 4]:
+            readings = list(server.iter_metric_range("node", 0, 100, window=window, prefetch=prefetch))
+            assert([r.timestamp for r in readings] == expected)
+      assert(expected == [1, 10, 11, 19, 20, 21, 30, 50, 99])
+      server.close()
+
+def test_iter_metric_range_blocks():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      submit_readings(server, range(0, 100))
+      blocks = list(server.iter_metric_range("node", -1, 100, window=25, as_blocks=True))
+      assert([len(block) for block in blocks] == [25, 25, 25, 25])
+      assert(blocks[1].timestamps[0] == 25)
+      assert(isinstance(blocks[0].reading(0), ReadingV1))
+      server.close()
+
+def test_iter_metric_range_failure():
+   server = Monolith(IPV4Connection("127.0.0.1", 1))
+   try:
+      list(server.iter_metric_range("node", 0, 10))
+      assert(False)
+   except Exception:
+      pass
+
+def test_fetch_fleet():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, pool_size=4)
+      readings = []
+      for node in range(0, 20):
+         for t in range(1, 6):
+            readings.append(ReadingV1(t, "node-" + str(node), "sensor", float(t)))
+      assert(all(server.metric_submit_readings(readings)))
+
+      results = {result.node_id: result for result in server.fetch_fleet(0, 10, max_workers=4)}
+      assert(len(results) == 20)
+      for result in results.values():
+         assert(result.ok())
+         assert(result.sensors == ["sensor"])
+         assert(len(result.readings) == 5)
+
+      # Invalid node ids fail on their own without affecting the rest
+      results = list(server.fetch_fleet(0, 10, nodes=["node-0", 5, "node-1"]))
+      failed = [result for result in results if not result.ok()]
+      assert(len(results) == 3 and len(failed) == 1)
+      assert(failed[0].node_id == 5)
+
+      # Arguments are checked when fetch_fleet is called, not when iterated
+      for arguments in ({"max_workers": 0}, {"start": "0"}, {"start": 10, "end": 0}, {"start": 10}):
+         try:
+            server.fetch_fleet(**dict({"start": 0, "end": 10}, **arguments))
+            assert(False)
+         except AssertionError:
+            raise
+         except Exception:
+            pass
+      server.close()
+
+   unreachable = Monolith(IPV4Connection("127.0.0.1", 1))
+   try:
+      unreachable.fetch_fleet(0, 10)
+      assert(False)
+   except AssertionError:
+      raise
+   except Exception as error:
+      assert("list of nodes" in str(error))
@@ -0,0 +1,52 @@
+from time import sleep, monotonic
+from pycrate import *
+from fake_monolith import FakeMonolith
+from helpers import wait_for
+
+def test_heartbeat_scheduler_many_nodes():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      node_ids = ["node-" + str(x) for x in range(0, 2000)]
+      with HeartbeatScheduler(server, interval=0.5, jitter=0.2) as scheduler:
+         scheduler.add_many(node_ids)
+         assert(wait_for(lambda: len(set(fake.heartbeats)) == 2000))
+         assert(wait_for(lambda: scheduler.stats()["sent"] >= 4000))
+         assert(scheduler.status("node-0").last_success is not None)
+         assert(scheduler.failing() == [])
+         # Heartbeats are pipelined in batches rather than one request per round trip
+         assert(fake.connections <= 2)
+      server.close()
+
+def test_heartbeat_scheduler_failures_and_remove():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      with HeartbeatScheduler(server, interval=0.05) as scheduler:
+         scheduler.add("a")
+         scheduler.add("b")
+         assert(wait_for(lambda: scheduler.status("a").sent > 0))
+         fake.available = False
+         assert(wait_for(lambda: scheduler.status("a").failures >= 3))
+         assert("a" in scheduler.failing(3))
+         fake.available = True
+         assert(wait_for(lambda: scheduler.status("a").failures == 0))
+
+         assert(scheduler.remove("b"))
+         assert(not scheduler.remove("b"))
+         sleep(0.1)
+         count = fake.heartbeats.count("b")
+         sleep(0.2)
+         assert(fake.heartbeats.count("b") == count)
+         assert(scheduler.status("b") is None)
+      server.close()
+
+def test_heartbeat_scheduler_lagging():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      scheduler = HeartbeatScheduler(server, interval=10.0, jitter=0.0)
+      scheduler.add("a")
+      node = scheduler.status("a")
+      # The heartbeat went out long after it was due
+      node.due = monotonic() - 100.0
+      scheduler.send([node])
+      assert(node.due >= monotonic() + 9.0)
+      server.close()
@@ -0,0 +1,72 @@
+import socket
+from time import sleep
+from pycrate import *
+from pycrate.metrics import endpoint_family
+from fake_monolith import FakeMonolith
+
+def test_latency_histogram():
+   histogram = LatencyHistogram()
+   for x in range(1, 101):
+      histogram.record(x / 1000.0)
+   assert(histogram.count == 100)
+   assert(histogram.min == 0.001 and histogram.max == 0.1)
+   # Buckets are about 19% wide
+   assert(0.05 <= histogram.quantile(0.5) <= 0.05 * 1.19)
+   assert(0.099 <= histogram.quantile(0.99) <= 0.1)
+   assert(LatencyHistogram().quantile(0.5) is None)
+
+def test_endpoint_family():
+   assert(endpoint_family("/") == "root")
+   assert(endpoint_family("/version") == "version")
+   assert(endpoint_family("/registrar/probe/x") == "registrar")
+   assert(endpoint_family("/metric/fetch/node/range/1/2") == "metric_fetch")
+   assert(endpoint_family("/metric/submit/{}") == "metric_submit")
+
+def test_client_metrics():
+   with FakeMonolith() as fake:
+      metrics = ClientMetrics()
+      server = Monolith(fake.connection, metrics=metrics)
+      assert(server.registrar_add_node(NodeV1("node", "a node")))
+      assert(server.registrar_probe("node"))
+      assert(server.metric_submit_reading(ReadingV1(1, "node", "s", 1.0)))
+      assert(server.metric_submit_readings([ReadingV1(x, "node", "s", 1.0) for x in range(2, 12)]) == [True] * 10)
+      assert(server.metric_fetch_range("node", 0, 100) is not None)
+      assert(server.fetch_endpoint("/unknown") is None)
+      assert(server.fetch_endpoints(["/unknown", "/version", "/unknown"])[1] is not None)
+
+      snapshot = metrics.snapshot()
+      assert(snapshot["registrar"]["requests"] == 2)
+      assert(snapshot["registrar"]["encodes"] == 1)
+      assert(snapshot["metric_submit"]["requests"] == 11)
+      # Pipelined requests are recorded one by one
+      assert(snapshot["metric_submit"]["latency"]["count"] == 11)
+      assert(snapshot["metric_submit"]["decodes"] == 11)
+      assert(snapshot["metric_fetch"]["decodes"] == 1)
+      assert(snapshot["metric_fetch"]["received_bytes"] > 0)
+      assert(snapshot["unknown"]["errors"] == {"http": 3})
+      assert(snapshot["unknown"]["latency"]["count"] == 3)
+
+      text = metrics.prometheus()
+      assert("pycrate_requests_total{family=\"metric_submit\"} 11" in text)
+      assert("pycrate_errors_total{family=\"unknown\",error=\"http\"} 3" in text)
+      assert("pycrate_request_duration_seconds_count{family=\"registrar\"} 2" in text)
+      assert("pycrate_request_duration_seconds_bucket{family=\"registrar\",le=\"+Inf\"} 2" in text)
+      server.close()
+
+def test_control_server_stats_export():
+   received = []
+   server = ControlServer(IPV4Connection("127.0.0.1", 0), received.append)
+   with server:
+      sock = socket.create_connection((server.address.address, server.address.port))
+      encoded = ActionV1(1, "controller", "action", 1.0).encode().encode("utf-8")
+      sock.sendall(len(encoded).to_bytes(4, "little") + encoded)
+      while not received:
+         sleep(0.01)
+      sock.close()
+   snapshot = server.stats.snapshot()
+   assert(snapshot["actions"] == 1)
+   assert(snapshot["callback_latency"]["count"] == 1)
+   text = server.stats.prometheus()
+   assert("pycrate_control_server_actions_total 1" in text)
+   assert("pycrate_control_server_callback_seconds_count 1" in text)
+   assert("pycrate_control_server_callback_seconds_bucket{le=\"+Inf\"} 1" in text)
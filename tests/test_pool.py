@@ -0,0 +1,82 @@
+from threading import Thread
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def test_connection_reuse():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, pool_size=2)
+      for x in range(0, 20):
+         assert(server.metric_submit_reading(ReadingV1(x, "node", "sensor", float(x))))
+      assert(len(fake.readings) == 20)
+      assert(fake.connections == 1)
+      server.close()
+
+def test_reconnect_after_server_close():
+   fake = FakeMonolith().start()
+   server = Monolith(fake.connection)
+   assert(server.is_connected())
+
+   # The server closes the pooled connection instead of answering
+   fake.drop_requests = 1
+   assert(server.registrar_probe("missing") is False)
+   assert(fake.drop_requests == 0)
+   assert(fake.connections == 2)
+   fake.stop()
+
+def test_no_resend_of_submit_after_server_close():
+   fake = FakeMonolith().start()
+   server = Monolith(fake.connection)
+   assert(server.is_connected())
+
+   fake.drop_requests = 1
+   before = fake.requests
+   assert(server.metric_submit_reading(ReadingV1(1, "node", "sensor", 1.0)) is None)
+   assert(fake.requests == before + 1)
+   assert(len(fake.readings) == 0)
+   fake.stop()
+
+def test_idle_timeout():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, idle_timeout=0)
+      assert(server.is_connected())
+      assert(server.is_connected())
+      assert(fake.connections == 2)
+      server.close()
+
+def test_pool_shared_between_threads():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection, pool_size=3)
+      results = []
+
+      def submit(offset):
+         for x in range(0, 25):
+            results.append(server.metric_submit_reading(ReadingV1(offset + x, "node", "sensor", 1.0)))
+
+      threads = [Thread(target=submit, args=(x * 100,)) for x in range(0, 6)]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+
+      assert(len(results) == 150)
+      assert(all(results))
+      assert(fake.connections <= 3)
+      server.close()
+
+def test_unreachable_monolith():
+   server = Monolith(IPV4Connection("127.0.0.1", 1))
+   assert(not server.is_connected())
+   assert(server.metric_submit_reading(ReadingV1(0, "node", "sensor", 1.0)) is None)
+
+def test_pipeline_gives_up_on_requests_in_flight():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      assert(server.is_connected())
+
+      # The first window is written before the server drops the connection,
+      # the second window is only sent on a new connection
+      fake.drop_requests = 1
+      results = server.pool.pipeline(["/registrar/probe/" + str(x) for x in range(0, 4)], depth=2)
+      assert(results[0:2] == [None, None])
+      assert([status for status, _ in results[2:4]] == [200, 200])
+      server.close()
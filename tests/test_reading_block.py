@@ -0,0 +1,87 @@
+from pycrate import *
+
+def build_stream():
+   stream = StreamV1(0, 0)
+   for x in range(0, 100):
+      assert(stream.add_reading(ReadingV1(x, "node-" + str(x % 2), "sensor-" + str(x % 3), float(x))))
+   return stream
+
+def test_round_trip():
+   stream = build_stream()
+   block = ReadingBlock.from_stream(stream)
+   assert(len(block) == 100)
+   assert(block.node_ids == ["node-0", "node-1"])
+   assert(len(block.sensor_ids) == 3)
+
+   restored = block.to_stream(1, 2)
+   assert(restored.sequence == 2)
+   for x in range(0, 100):
+      assert(restored.readings[x].encode() == stream.readings[x].encode())
+
+def test_filters_and_aggregates():
+   block = ReadingBlock.from_stream(build_stream())
+   assert(list(block.select(10, 20)) == list(range(10, 20)))
+   assert(list(block.select(10, 20, node_id="node-1")) == [11, 13, 15, 17, 19])
+   assert(list(block.select(node_id="node-0", sensor_id="sensor-0")) == list(range(0, 100, 6)))
+   assert(len(block.select(node_id="missing")) == 0)
+
+   assert(block.min() == 0.0)
+   assert(block.max() == 99.0)
+   assert(block.sum() == sum(range(0, 100)))
+   assert(block.mean(0, 10) == 4.5)
+   assert(block.max(node_id="node-0") == 98.0)
+   assert(block.mean(node_id="missing") is None)
+
+   filtered = block.filter(50, 60, sensor_id="sensor-2")
+   assert(list(filtered.timestamps) == [50, 53, 56, 59])
+   assert(filtered.reading(0).sensor_id == "sensor-2")
+
+def test_unsorted_block():
+   block = ReadingBlock()
+   for timestamp in [5, 1, 9, 3]:
+      block.append(timestamp, "node", "sensor", float(timestamp))
+   assert(not block.is_sorted)
+   assert(list(block.select(2, 6)) == [0, 3])
+
+def test_take_out_of_order():
+   block = ReadingBlock()
+   for timestamp in [1, 3, 5, 7]:
+      block.append(timestamp, "node", "sensor", float(timestamp))
+   taken = block.take([3, 0, 2, 1])
+   assert(not taken.is_sorted)
+   assert(list(taken.select(2, 6)) == [2, 3])
+   assert(list(taken.filter(start=2, end=6).timestamps) == [5, 3])
+   assert(block.take([0, 2, 3]).is_sorted)
+
+def test_decoded_and_buffers():
+   block = ReadingBlock.from_decoded([
+      {"timestamp": 1, "node_id": "n", "sensor_id": "s", "value": 2},
+      {"timestamp": 2, "node_id": "n", "sensor_id": "s", "value": 3.5},
+   ])
+   assert(block.sum() == 5.5)
+   view = memoryview(block.values)
+   assert(view.format == "d" and view.nbytes == 16)
+
+def test_block_from_json():
+   stream = StreamV1(1, 1)
+   stream.add_readings([ReadingV1(x, "node-" + str(x % 2), "sensor", float(x)) for x in range(0, 20)])
+   expected = ReadingBlock.from_stream(stream)
+
+   response = '{"status":200,"data":' + encode_many(stream.readings) + '}'
+   for data in (stream.encode().encode("utf-8"), encode_many(stream.readings), response,
+                '{"data": ' + encode_many(stream.readings) + ', "status": 200}'):
+      block = ReadingBlock.from_json(data)
+      assert(list(block.timestamps) == list(expected.timestamps))
+      assert(list(block.values) == list(expected.values))
+      assert(block.node_ids == ["node-0", "node-1"])
+      assert(block.is_sorted)
+
+   try:
+      ReadingBlock.from_json('{"status":500,"data":[]}')
+      assert(False)
+   except Exception as error:
+      assert("500" in str(error))
+
+   block = ReadingBlock.from_json(encode_many([ReadingV1(2, "n", "s", 1.0), ReadingV1(1, "n", "s", 2.0)]))
+   assert(not block.is_sorted)
+   assert(list(block.sorted().values) == [2.0, 1.0])
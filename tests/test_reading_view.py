@@ -0,0 +1,54 @@
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def sample_readings():
+   return [ReadingV1(x, "node-" + str(x % 2), "sensor-" + str(x % 3), x * 0.5) for x in range(0, 10)]
+
+def check_view(view, readings):
+   assert(len(view) == len(readings))
+   assert(list(view.timestamps) == [r.timestamp for r in readings])
+   assert(list(view.values) == [r.value for r in readings])
+   assert(view.node_id_list() == [r.node_id for r in readings])
+   assert([r.encode() for r in view] == [r.encode() for r in readings])
+
+def test_view_from_json():
+   readings = sample_readings()
+   encoded = encode_many(readings)
+   response = '{"status":200,"data":' + encoded + '}'
+   for data in [encoded, response, response.encode("utf-8"), memoryview(response.encode("utf-8"))]:
+      check_view(ReadingView.from_json(data), readings)
+
+   # Not in the form written by encode, decoded through json
+   spaced = '{"status": 200, "data": [{"timestamp": 1, "node_id": "n\\u00e9", "sensor_id": "s", "value": 2}]}'
+   check_view(ReadingView.from_json(spaced), [ReadingV1(1, "né", "s", 2.0)])
+
+   assert(ReadingView.decode('{"status":404,"data":"not found"}') == (404, None))
+   assert(ReadingView.decode(response)[0] == 200)
+   assert(len(ReadingView.from_json('{"status":200,"data":[]}')) == 0)
+
+def test_view_access():
+   readings = sample_readings()
+   view = ReadingView.from_json(encode_many(readings))
+   assert(view[-1].timestamp == 9)
+   assert(view[3] is not view[3])
+   assert(view[3].node_id is view[5].node_id)
+   part = view[2:8:2]
+   assert(isinstance(part, ReadingView))
+   check_view(part, readings[2:8:2])
+   try:
+      view[10]
+      assert(False)
+   except IndexError:
+      pass
+
+def test_fetch_as_view():
+   for cache in [None, MetricCache(settle=0)]:
+      with FakeMonolith() as fake:
+         server = Monolith(fake.connection, metric_cache=cache)
+         readings = sample_readings()
+         assert(all(server.metric_submit_readings(readings)))
+         view = server.metric_fetch_range("node-0", -1, 10, as_view=True)
+         check_view(view, [r for r in readings if r.node_id == "node-0"])
+         assert(list(server.metric_fetch_after("node-1", 4, as_view=True).timestamps) == [5, 7, 9])
+         assert(list(server.metric_fetch_before("node-1", 4, as_view=True).timestamps) == [1, 3])
+         server.close()
@@ -0,0 +1,74 @@
+import os
+import functools
+import threading
+from pycrate import *
+from helpers import wait_for, send
+
+def record_in_file(output_path, action):
+   with open(output_path, "a") as output:
+      output.write(str(os.getpid()) + " " + str(action.timestamp) + "\n")
+
+def fail(action):
+   raise Exception("handler failed")
+
+def test_route_resolution():
+   router = ActionRouter()
+   calls = []
+   router.route(lambda action: calls.append("exact"), "c1", "a1")
+   router.route(lambda action: calls.append("action"), action_id="a1")
+   router.route(lambda action: calls.append("controller"), controller_id="c1")
+   assert(router.resolve("c1", "a1") is router.resolve("c1", "a1"))
+   for controller_id, action_id in (("c1", "a1"), ("c2", "a1"), ("c1", "a2")):
+      router.resolve(controller_id, action_id).handler(None)
+   assert(calls == ["exact", "action", "controller"])
+   assert(router.resolve("c2", "a2") is None)
+
+   # Changing the routes rebuilds the index
+   router.route(lambda action: calls.append("any"))
+   router.resolve("c2", "a2").handler(None)
+   assert(router.unroute("c1", "a1") and not router.unroute("c1", "a1"))
+   router.resolve("c1", "a1").handler(None)
+   assert(calls[-2:] == ["any", "action"])
+
+   controller = ControllerV1("c1", "a controller", IPV4Connection("127.0.0.1", 1))
+   controller.add_action(ControllerV1ActionEntry("a1", "an action"))
+   router.allow(controller)
+   assert(router.resolve("c1", "a1") is not None)
+   assert(router.resolve("c1", "a2") is None and not router.is_allowed("c1", "a2"))
+   assert(router.resolve("c2", "a1") is None)
+
+def test_router_in_control_server():
+   received = []
+   network_thread = []
+   router = ActionRouter()
+   router.route(lambda action: received.append(("thread", action.timestamp)), "c", "slow")
+   router.route(lambda action: network_thread.append(threading.current_thread()), "c", "fast", EXECUTE_INLINE)
+   router.route(lambda action: received.append(("any", action.action_id)), action_id="other")
+   controller = ControllerV1("c", "a controller", IPV4Connection("127.0.0.1", 1))
+   controller.add_actions([ControllerV1ActionEntry(id, "an action") for id in ("slow", "fast", "unrouted", "other")])
+   router.allow(controller)
+
+   with ControlServer(IPV4Connection("127.0.0.1", 0), router, workers=1) as server:
+      send(server, [ActionV1(0, "c", "slow", 0.0), ActionV1(1, "c", "fast", 0.0), ActionV1(2, "c", "unknown", 0.0),
+                    ActionV1(3, "x", "slow", 0.0), ActionV1(4, "c", "unrouted", 0.0), ActionV1(5, "c", "other", 0.0)])
+      assert(wait_for(lambda: len(received) == 2 and len(network_thread) == 1))
+      assert(sorted(received) == [("any", "other"), ("thread", 0)])
+      assert(network_thread[0] is server.loop.thread)
+      assert(server.stats.rejected == 2)
+      assert(server.stats.unrouted == 1)
+      assert(server.stats.actions == 3)
+
+def test_process_execution(tmp_path):
+   output_path = str(tmp_path / "actions")
+   with ActionRouter(process_workers=2, process_queue_size=4) as router:
+      # The path travels with the handler, so it works with any start method
+      router.route(functools.partial(record_in_file, output_path), action_id="heavy", execution=EXECUTE_PROCESS)
+      router.route(fail, action_id="broken", execution=EXECUTE_PROCESS)
+      with ControlServer(IPV4Connection("127.0.0.1", 0), router) as server:
+         send(server, [ActionV1(x, "c", "heavy", 0.0) for x in range(0, 20)] + [ActionV1(0, "c", "broken", 0.0)])
+         assert(wait_for(lambda: server.stats.callback_latency.count == 21, 20.0))
+         assert(server.stats.callback_errors == 1)
+   with open(output_path) as output:
+      lines = [line.split() for line in output]
+   assert(sorted(int(timestamp) for _, timestamp in lines) == list(range(0, 20)))
+   assert(str(os.getpid()) not in {pid for pid, _ in lines})
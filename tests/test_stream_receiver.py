@@ -0,0 +1,99 @@
+import asyncio
+import socket
+import threading
+from time import sleep, monotonic
+from pycrate import *
+from helpers import wait_for
+
+def stream_frame(sequence, count):
+   stream = StreamV1(0, sequence)
+   for x in range(0, count):
+      stream.add_reading(ReadingV1(sequence * 1000 + x, "node", "sensor", float(x)))
+   encoded = stream.encode().encode("utf-8")
+   return len(encoded).to_bytes(4, "little") + encoded
+
+def test_queue_and_sequence_tracking():
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0)) as receiver:
+      sender = socket.create_connection(("127.0.0.1", receiver.address.port))
+      data = b"".join(stream_frame(sequence, 3) for sequence in [0, 1, 4, 2, 5])
+      sender.sendall(data[:10])
+      sender.sendall(data[10:])
+      sender.close()
+
+      received = [receiver.get(5.0) for _ in range(0, 5)]
+      assert([stream.sequence for stream in received] == [0, 1, 4, 2, 5])
+      assert(receiver.stats.readings == 15)
+      assert(receiver.stats.gaps == 1)
+      assert(receiver.stats.missing == 2)
+      assert(receiver.stats.reordered == 1)
+
+def test_sequence_tracking_per_connection():
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0)) as receiver:
+      first = socket.create_connection(("127.0.0.1", receiver.address.port))
+      second = socket.create_connection(("127.0.0.1", receiver.address.port))
+      # Two senders at once, each with its own sequence
+      first.sendall(stream_frame(10, 1) + stream_frame(11, 1))
+      second.sendall(stream_frame(0, 1) + stream_frame(1, 1))
+      first.sendall(stream_frame(12, 1))
+      second.sendall(stream_frame(2, 1))
+      first.close()
+      # A sender restarting its sequence on a new connection
+      restarted = socket.create_connection(("127.0.0.1", receiver.address.port))
+      restarted.sendall(stream_frame(0, 1) + stream_frame(2, 1))
+      restarted.close()
+      second.close()
+
+      assert(len([receiver.get(5.0) for _ in range(0, 8)]) == 8)
+      assert(receiver.stats.reordered == 0)
+      assert(receiver.stats.gaps == 1)
+      assert(receiver.stats.missing == 1)
+
+def test_batch_callback():
+   batches = []
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0), batch_callback=batches.append) as receiver:
+      sender = socket.create_connection(("127.0.0.1", receiver.address.port))
+      sender.sendall(stream_frame(0, 4) + stream_frame(1, 2))
+      sender.close()
+      assert(wait_for(lambda: len(batches) == 2))
+   assert([len(batch) for batch in batches] == [4, 2])
+   assert(isinstance(batches[0][0], ReadingV1))
+
+def test_get_waits_out_its_timeout():
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0)) as receiver:
+      def notify():
+         sleep(0.05)
+         with receiver.lock:
+            receiver.available.notify_all()
+      threading.Thread(target=notify).start()
+      started = monotonic()
+      # A wakeup with nothing queued does not end the wait early
+      assert(receiver.get(0.3) is None)
+      assert(monotonic() - started >= 0.25)
+
+def test_backpressure_bounds_pending_readings():
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0), max_pending_readings=10) as receiver:
+      sender = socket.create_connection(("127.0.0.1", receiver.address.port))
+      sender.sendall(b"".join(stream_frame(sequence, 5) for sequence in range(0, 20)))
+      assert(wait_for(lambda: receiver.stats.paused > 0))
+      assert(receiver.pending_readings <= 10)
+
+      readings = []
+      while len(readings) < 100:
+         readings += receiver.get(5.0).readings
+      assert(len(readings) == 100)
+      sender.close()
+
+def test_async_iteration():
+   async def consume(receiver):
+      received = []
+      async for stream in receiver:
+         received.append(stream.sequence)
+         if len(received) == 3:
+            break
+      return received
+
+   with StreamReceiver(IPV4Connection("127.0.0.1", 0)) as receiver:
+      sender = socket.create_connection(("127.0.0.1", receiver.address.port))
+      sender.sendall(b"".join(stream_frame(sequence, 1) for sequence in range(0, 3)))
+      assert(asyncio.run(consume(receiver)) == [0, 1, 2])
+      sender.close()
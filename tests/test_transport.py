@@ -0,0 +1,101 @@
+import socket
+from time import sleep, monotonic
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def unused_port():
+   sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   sock.bind(("127.0.0.1", 0))
+   port = sock.getsockname()[1]
+   sock.close()
+   return port
+
+def test_error_results():
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      assert(server.request("/version").ok())
+      result = server.request("/unknown")
+      assert(result.error == ERROR_HTTP and result.status == 404)
+      assert(server.fetch_endpoint("/unknown") is None)
+      server.close()
+
+   refused = Monolith(IPV4Connection("127.0.0.1", unused_port()))
+   assert(refused.request("/").error == ERROR_REFUSED)
+   assert(refused.is_connected() is False)
+
+def test_read_timeout():
+   # Accepts connections but never answers
+   listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+   listener.bind(("127.0.0.1", 0))
+   listener.listen(8)
+   policy = TransportPolicy(read_timeout=0.1, retries=1, backoff=0.01, failure_threshold=None)
+   server = Monolith(IPV4Connection("127.0.0.1", listener.getsockname()[1]), policy=policy)
+   start = monotonic()
+   result = server.request("/version")
+   assert(result.error == ERROR_TIMEOUT)
+   assert(result.attempts == 2)
+   assert(monotonic() - start < 1.0)
+   # Submissions are not retried
+   assert(server.request("/metric/heartbeat/{}").attempts == 1)
+   server.close()
+   listener.close()
+
+def test_retries_and_circuit_breaker():
+   with FakeMonolith() as fake:
+      policy = TransportPolicy(retries=2, backoff=0.001, failure_threshold=3, reset_timeout=0.2)
+      server = Monolith(fake.connection, policy=policy)
+      fake.available = False
+      requests = fake.requests
+      result = server.request("/version")
+      assert(result.error == ERROR_HTTP and result.status == 503)
+      assert(result.attempts == 3)
+      assert(fake.requests == requests + 3)
+
+      # The breaker is open: requests fail without reaching the monolith
+      requests = fake.requests
+      assert(server.request("/version").error == ERROR_CIRCUIT_OPEN)
+      assert(server.get_version() is None)
+      assert(fake.requests == requests)
+
+      # A trial request after reset_timeout closes it again
+      fake.available = True
+      sleep(0.25)
+      assert(server.request("/version").ok())
+      assert(server.breaker.state == CircuitBreaker.CLOSED)
+      server.close()
+
+def test_pool_wait_timeout():
+   with FakeMonolith() as fake:
+      policy = TransportPolicy(connect_timeout=0.1, retries=2, failure_threshold=1)
+      server = Monolith(fake.connection, pool_size=1, policy=policy)
+      conn = server.pool.acquire()
+      start = monotonic()
+      result = server.request("/version")
+      # Contention on the local pool is not retried and does not open the circuit
+      assert(result.error == ERROR_POOL_EXHAUSTED and result.attempts == 1)
+      assert(monotonic() - start < 1.0)
+      assert(server.fetch_endpoints(["/version", "/"]) == [None, None])
+      assert(server.breaker.state == CircuitBreaker.CLOSED)
+      server.pool.release(conn)
+      assert(server.request("/version").ok())
+      server.close()
+
+def test_breaker_cancel_frees_the_trial():
+   breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+   breaker.record(False)
+   assert(breaker.allow())
+   assert(not breaker.allow())
+   breaker.cancel()
+   assert(breaker.allow())
+   breaker.record(True)
+   assert(breaker.state == CircuitBreaker.CLOSED)
+
+def test_policy_validation():
+   for arguments in ({"read_timeout": 0}, {"retries": -1}, {"backoff": "1"}, {"max_backoff": -1.0}, {"max_backoff": None}):
+      try:
+         TransportPolicy(**arguments)
+         assert(False)
+      except AssertionError:
+         raise
+      except Exception:
+         pass
@@ -1,3 +1,4 @@
+import json
 from pycrate import *
 
 monolith = Monolith(IPV4Connection("0.0.0.0", 8080))
@@ -117,6 +118,176 @@ def test_version_v1():
    assert(v.minor == decoded.minor)
    assert(v.patch == decoded.patch)
 
+def test_json_escaping():
+   awkward = "a \"quoted\" \\ back\\slash\nnewline \u00e9"
+   node = NodeV1("node \"0\"", awkward)
+   assert(node.add_sensor(NodeV1SensorEntry("0", "t\\ype", awkward)))
+   decoded_node = NodeV1("","")
+   assert(decoded_node.decode_from(node.encode()))
+   assert(decoded_node.id == node.id)
+   assert(decoded_node.description == awkward)
+   assert(decoded_node.sensors[0].type == "t\\ype")
+   assert(decoded_node.sensors[0].description == awkward)
+
+   controller = ControllerV1("c", awkward, IPV4Connection("0.0.0.0", 6969))
+   assert(controller.add_action(ControllerV1ActionEntry("a", awkward)))
+   decoded_controller = ControllerV1("","", IPV4Connection("", 0))
+   assert(decoded_controller.decode_from(controller.encode()))
+   assert(decoded_controller.description == awkward)
+   assert(decoded_controller.actions[0].description == awkward)
+
+   decoded_heartbeat = HeartbeatV1("")
+   assert(decoded_heartbeat.decode_from(HeartbeatV1(awkward).encode()))
+   assert(decoded_heartbeat.id == awkward)
+
+def test_encode_many():
+   readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(0, 1000)]
+   assert(encode_many([]) == "[]")
+   decoded = json.loads(encode_many(readings))
+   assert(len(decoded) == 1000)
+   assert(decoded[999]["timestamp"] == 999)
+
+   stream = StreamV1(1, 2)
+   assert(json.loads(stream.encode()) == {"timestamp": 1, "sequence": 2, "data": []})
+
+def test_validation_levels():
+   stream = StreamV1(0, 0)
+   readings = [ReadingV1(x, "node", "sensor", float(x)) for x in range(0, 100)]
+   assert(stream.add_readings(readings))
+   assert(len(stream.readings) == 100)
+
+   bad = ReadingV1(0, "node", "sensor", float("nan"))
+   assert(not stream.add_reading(bad))
+   assert(stream.add_reading(bad, VALIDATE_TYPES))
+   assert(not stream.add_readings([readings[0], bad]))
+   assert(len(stream.readings) == 101)
+
+   broken = ReadingV1(0, "node", "sensor", 1.0)
+   broken.value = "1.0"
+   assert(not stream.add_reading(broken, VALIDATE_TYPES))
+   assert(stream.add_reading(broken, VALIDATE_OFF))
+
+   trusted = StreamV1(0, 0, validation=VALIDATE_OFF)
+   assert(trusted.add_readings(iter(readings)))
+   assert(len(trusted.readings) == 100)
+
+   node = NodeV1("node", "a node")
+   assert(node.add_sensors([NodeV1SensorEntry(str(x), "t", "d") for x in range(0, 5)]))
+   assert(len(node.sensors) == 5)
+
+   controller = ControllerV1("c", "a controller", IPV4Connection("0.0.0.0", 0))
+   assert(controller.add_actions([ControllerV1ActionEntry(str(x), "d") for x in range(0, 5)]))
+   assert(not controller.add_actions([NodeV1SensorEntry("0", "t", "d")]))
+   assert(len(controller.actions) == 5)
+
+def test_slotted_types():
+   reading = ReadingV1(1, "node", "sensor", 1.0)
+   try:
+      reading.extra = 1
+      assert(False)
+   except AttributeError:
+      pass
+   assert(not hasattr(reading, "__dict__"))
+
+   frozen = FrozenReadingV1(1, "node", "sensor", 1.0)
+   assert(frozen == FrozenReadingV1(1, "node", "sensor", 1.0))
+   assert(frozen != FrozenReadingV1(2, "node", "sensor", 1.0))
+   assert(len({frozen, FrozenReadingV1(1, "node", "sensor", 1.0)}) == 1)
+   assert(frozen.encode() == reading.encode())
+   try:
+      frozen.value = 2.0
+      assert(False)
+   except AttributeError:
+      pass
+
+   stream = StreamV1(0, 0)
+   assert(stream.add_reading(frozen))
+
+   action = FrozenActionV1(1, "controller", "action", 1.0)
+   decoded = ActionV1(0, "", "", 0.0)
+   assert(decoded.decode_from(action.encode()))
+   assert(decoded.action_id == "action")
+
+   for frozen_object in (frozen, action):
+      try:
+         frozen_object.decode_from(frozen_object.encode())
+         assert(False)
+      except Exception as error:
+         assert("immutable" in str(error))
+   routes = {FrozenIPV4Connection("127.0.0.1", 80): "a"}
+   assert(routes[FrozenIPV4Connection("127.0.0.1", 80)] == "a")
+
+def test_fast_decoders():
+   reading = ReadingV1(5, "node", "sensor", 1.5)
+   for data in (reading.encode(), reading.encode().encode("utf-8"), memoryview(reading.encode().encode("utf-8"))):
+      decoded = ReadingV1.from_json(data)
+      assert((decoded.timestamp, decoded.node_id, decoded.sensor_id, decoded.value) == (5, "node", "sensor", 1.5))
+
+   # Anything not written by encode() goes through json
+   decoded = ReadingV1.from_json(b'{"value": 2, "sensor_id": "s\\"q", "node_id": "n", "timestamp": 1}')
+   assert(decoded.sensor_id == "s\"q" and decoded.value == 2.0 and isinstance(decoded.value, float))
+   try:
+      ReadingV1.from_json('{"timestamp": true, "node_id": "n", "sensor_id": "s", "value": 1.0}', VALIDATE_FULL)
+      assert(False)
+   except Exception as error:
+      assert("not valid" in str(error))
+
+   stream = StreamV1(10, 3)
+   stream.add_readings([ReadingV1(x, "node", "sensor-" + str(x % 3), float(x)) for x in range(0, 50)])
+   stream.add_reading(ReadingV1(50, "nöde", "q\"uote", -1.5e-7))
+   for data in (stream.encode().encode("utf-8"), bytearray(stream.encode().encode("utf-8")), stream.encode()):
+      decoded = StreamV1.from_bytes(data)
+      assert(decoded.timestamp == 10 and decoded.sequence == 3)
+      assert([r.encode() for r in decoded.readings] == [r.encode() for r in stream.readings])
+   empty = StreamV1.from_bytes(StreamV1(1, 2).encode().encode("utf-8"))
+   assert(empty.readings == [] and empty.sequence == 2)
+
+   array = encode_many(stream.readings[:10]).encode("utf-8")
+   assert([r.timestamp for r in ReadingV1.from_json_array(array)] == list(range(0, 10)))
+
+   # Numbers json would reject are not let through by the fast path
+   for value in (b"1_000", b"nan", b"01"):
+      try:
+         ReadingV1.from_json_array(b'[{"timestamp":1,"node_id":"n","sensor_id":"s","value":' + value + b"}]")
+         assert(False)
+      except AssertionError:
+         raise
+      except Exception:
+         pass
+   spaced = ReadingV1.from_json_array(b'[{"timestamp":1,"node_id":"n","sensor_id":"s","value": 5}]')
+   assert(spaced[0].value == 5.0)
+
+   action = ActionV1.from_json(ActionV1(7, "controller", "action", 0.5).encode().encode("utf-8"))
+   assert((action.timestamp, action.controller_id, action.action_id, action.value) == (7, "controller", "action", 0.5))
+
+def test_binary_action():
+   action = ActionV1(-7, "contrôller", "", -0.25)
+   encoded = action.encode_binary()
+   assert(encoded[0] == ACTION_BINARY_V1 and len(encoded) == action_header.size + 11)
+   for data in (encoded, bytearray(encoded), memoryview(b"xx" + encoded)[2:]):
+      decoded = ActionV1.from_frame(data)
+      assert((decoded.timestamp, decoded.controller_id, decoded.action_id, decoded.value) == (-7, "contrôller", "", -0.25))
+   assert(ActionV1.from_frame(action.encode().encode("utf-8")).controller_id == "contrôller")
+   assert(isinstance(FrozenActionV1.from_binary(encoded), FrozenActionV1))
+
+   for bad in (encoded[:-1], encoded + b"x", b"\x02" + encoded[1:]):
+      try:
+         ActionV1.from_binary(bad)
+         assert(False)
+      except Exception:
+         pass
+   try:
+      ActionV1.from_binary(ActionV1(1, "c", "a", float("nan")).encode_binary(), VALIDATE_FULL)
+      assert(False)
+   except Exception as error:
+      assert("not valid" in str(error))
+   for timestamp in (2 ** 63, -2 ** 63 - 1):
+      try:
+         ActionV1(timestamp, "c", "a", 0.0).encode_binary()
+         assert(False)
+      except Exception as error:
+         assert("TIMESTAMP" in str(error))
+
 print("Test NodeV1 type")
 test_node_v1()
 
@@ -136,4 +307,22 @@ print("Test HeartbeatV1 type")
 test_heartbeat_v1()
 
 print("Test VersionV1 type")
-test_version_v1()
\ No newline at end of file
+test_version_v1()
+
+print("Test JSON escaping")
+test_json_escaping()
+
+print("Test encode_many")
+test_encode_many()
+
+print("Test validation levels")
+test_validation_levels()
+
+print("Test slotted types")
+test_slotted_types()
+
+print("Test fast decoders")
+test_fast_decoders()
+
+print("Test binary actions")
+test_binary_action()
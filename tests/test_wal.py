@@ -0,0 +1,95 @@
+import os
+from time import sleep
+from pycrate import *
+from fake_monolith import FakeMonolith
+
+def test_submission_log_drains_in_order(tmp_path):
+   with FakeMonolith() as fake:
+      server = Monolith(fake.connection)
+      with SubmissionLog(server, str(tmp_path), batch_size=16) as log:
+         for x in range(0, 100):
+            assert(log.submit_reading(ReadingV1(x, "node", "sensor", float(x))))
+         assert(log.submit_heartbeat(HeartbeatV1("node")))
+         assert(log.wait_drained(5.0))
+         assert(log.stats()["submitted"] == 101)
+      assert([r["timestamp"] for r in fake.readings] == list(range(0, 100)))
+      assert(fake.heartbeats == ["node"])
+      server.close()
+
+def test_submission_log_outage_and_restart(tmp_path):
+   with FakeMonolith() as fake:
+      fake.available = False
+      server = Monolith(fake.connection)
+      log = SubmissionLog(server, str(tmp_path), segment_size=1024, retry_interval=0.05)
+      for x in range(0, 50):
+         assert(log.submit_reading(ReadingV1(x, "node", "sensor", float(x))))
+      assert(not log.wait_drained(0.2))
+      assert(log.stats()["segments"] > 1)
+      log.close()
+
+      # A partly written record is dropped on recovery
+      segments = sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".log"))
+      with open(os.path.join(str(tmp_path), segments[-1]), "ab") as segment:
+         segment.write(b"/metric/submit/{\"torn")
+
+      log = SubmissionLog(server, str(tmp_path), segment_size=1024, retry_interval=0.05)
+      assert(log.submit_reading(ReadingV1(50, "node", "sensor", 50.0)))
+      fake.available = True
+      assert(log.wait_drained(5.0))
+      assert(log.stats()["segments"] == 1)
+      log.close()
+      assert([r["timestamp"] for r in fake.readings] == list(range(0, 51)))
+      server.close()
+
+def test_submission_log_overflow(tmp_path):
+   with FakeMonolith() as fake:
+      fake.available = False
+      server = Monolith(fake.connection)
+      reading = ReadingV1(0, "node", "sensor", 0.0)
+      size = len("/metric/submit/" + reading.encode()) + 1
+
+      log = SubmissionLog(server, str(tmp_path), segment_size=size * 10, max_bytes=size * 20,
+                          overflow=OVERFLOW_REJECT, retry_interval=0.05)
+      results = [log.submit_reading(reading) for _ in range(0, 25)]
+      assert(results == [True] * 20 + [False] * 5)
+      assert(log.stats()["overflows"] == 5)
+      log.close()
+
+      log = SubmissionLog(server, str(tmp_path), segment_size=size * 10, max_bytes=size * 20,
+                          retry_interval=0.05)
+      # Let the log find out about the outage so no batch is in flight
+      while log.stats()["connected"]:
+         sleep(0.01)
+      for x in range(0, 15):
+         assert(log.submit_reading(ReadingV1(x + 1, "node", "sensor", 0.0)))
+      assert(log.stats()["dropped_segments"] == 2)
+      assert(log.stats()["disk_bytes"] <= size * 20)
+      fake.available = True
+      assert(log.wait_drained(5.0))
+      log.close()
+      assert([r["timestamp"] for r in fake.readings] == list(range(1, 16)))
+      server.close()
+
+def test_submission_log_skips_rejected_records(tmp_path):
+   with FakeMonolith() as fake:
+      fake.available = False
+      server = Monolith(fake.connection)
+      log = SubmissionLog(server, str(tmp_path), retry_interval=0.05)
+      assert(log.submit_reading(ReadingV1(0, "node", "sensor", 0.0)))
+      log.close()
+
+      # A record the monolith answers with 400 must not block the log
+      segments = sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".log"))
+      with open(os.path.join(str(tmp_path), segments[-1]), "ab") as segment:
+         segment.write(b"/metric/submit/{malformed\n")
+
+      log = SubmissionLog(server, str(tmp_path), retry_interval=0.05)
+      assert(log.submit_reading(ReadingV1(1, "node", "sensor", 1.0)))
+      fake.available = True
+      assert(log.wait_drained(5.0))
+      assert(log.stats()["submitted"] == 2)
+      assert(log.stats()["rejected"] == 1)
+      assert(log.stats()["connected"])
+      log.close()
+      assert([r["timestamp"] for r in fake.readings] == [0, 1])
+      server.close()